@@ -3,9 +3,13 @@ import warnings
 
 import torch.utils.data
 
+from src.scripts.infer import start_infer
 from src.scripts.kp_test import start_test
+from src.scripts.pack import start_pack, start_render_pack
+from src.scripts.serve import start_serve
 from src.scripts.train import start_train
-from src.utils.utils import add_train_arguments, add_kp_test_arguments
+from src.utils.utils import add_train_arguments, add_kp_test_arguments, add_pack_arguments, \
+    add_render_pack_arguments, add_infer_arguments, add_serve_arguments
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-c', '--config',
@@ -28,6 +32,20 @@ add_train_arguments(train_parser)
 test_parser = sub_parsers.add_parser('kp_test', help='Use this to start testing the model')
 add_kp_test_arguments(test_parser)
 
+pack_parser = sub_parsers.add_parser('pack', help='Use this to precompute the cropped samples of a dataset split')
+add_pack_arguments(pack_parser)
+
+render_pack_parser = sub_parsers.add_parser(
+    'render_pack', help='Use this to precompute the renders of the template for the sfm poses of a pack')
+add_render_pack_arguments(render_pack_parser)
+
+infer_parser = sub_parsers.add_parser(
+    'infer', help='Use this to write the UV maps of a directory or a list of images')
+add_infer_arguments(infer_parser)
+
+serve_parser = sub_parsers.add_parser('serve', help='Use this to serve the UV maps over local HTTP')
+add_serve_arguments(serve_parser)
+
 args = parser.parse_args()
 
 if not args.show_warnings:
@@ -35,13 +53,28 @@ if not args.show_warnings:
 
 if __name__ == '__main__':
 
-    print('Device: %s:%s' % (
-        torch.cuda.get_device_name(),
-        torch.cuda.current_device()))
+    if torch.device(args.device).type == 'cuda' and torch.cuda.is_available():
+        print('Device: %s:%s' % (
+            torch.cuda.get_device_name(),
+            torch.cuda.current_device()))
+    else:
+        print('Device: %s' % args.device)
 
     if args.mode == 'train':
         print('Starting the training........')
         start_train(args.config, args.__dict__, args.device)
     elif args.mode == 'kp_test':
         print('Starting the key point transfer testing........')
-        start_test(args.config, args.__dict__, args.device)
\ No newline at end of file
+        start_test(args.config, args.__dict__, args.device)
+    elif args.mode == 'pack':
+        print('Packing the dataset........')
+        start_pack(args.config, args.__dict__, args.device)
+    elif args.mode == 'render_pack':
+        print('Rendering the pack........')
+        start_render_pack(args.config, args.__dict__, args.device)
+    elif args.mode == 'infer':
+        print('Starting the inference........')
+        start_infer(args.config, args.__dict__, args.device)
+    elif args.mode == 'serve':
+        print('Starting the server........')
+        start_serve(args.config, args.__dict__, args.device)
\ No newline at end of file
@@ -8,6 +8,7 @@ from torch.utils.data import Dataset
 
 from src.data.utils import image, transformations
 from src.data.utils.image import get_texture_map, get_template_texture
+from src.data.utils.pack import PackedRenders, PackedSamples, get_pack_size
 from src.nnutils.geometry import convert_3d_to_uv_coordinates
 
 
@@ -27,6 +28,25 @@ class IDataset(Dataset):
         self.flip = config.flip
         self.device = device
 
+        # 'uint8' keeps the images as uint8 (0-255) and the masks as uint8 (0/1) until they reach the device.
+        # 'float64' returns the images as float values between 0-1 and soft masks
+        self.img_dtype = config.get('img_dtype', 'uint8')
+        # Leave the crop, scale and mirror to src.data.utils.augmentation.BatchAugmentation
+        self.gpu_augment = config.get('gpu_augment', False)
+
+        # Serve the samples from a pack written by src.data.utils.pack.pack_dataset
+        pack_path = config.dir.get('pack')
+        self.packed = PackedSamples(pack_path) if pack_path else None
+
+        # Serve the renders of the template for the sfm poses written by src.data.utils.pack.render_pack
+        renders_path = config.dir.get('renders')
+        self.renders = None
+        if renders_path:
+            if self.packed is None or config.tight_crop:
+                raise ValueError('The precomputed renders need the pack they were rendered for (dataset.dir.pack) '
+                                 'and square crops (dataset.tight_crop: False)')
+            self.renders = PackedRenders(renders_path)
+
         self.mean_shape = self._get_mean_shape()
         self.texture_map = get_texture_map(self.config.dir.texture).to(self.device)
         self.template_mesh = self._get_template_mesh()
@@ -54,8 +74,15 @@ class IDataset(Dataset):
         if self.transform == 'flip'
         flip_img: A np.ndarray 3*256*256, img after flip
         flip_mask: A np.ndarray 256*256, mask after transformation
+
+        if dataset.dir.renders is set
+        render_mask: A np.ndarray 256*256, mask of the template rendered for sfm_pose
+        render_depth: A np.ndarray 256*256, depth of the template rendered for sfm_pose
         """
-        img, kp, kp_uv, mask, sfm_pose = self.forward_img(index)
+        if self.gpu_augment:
+            return self.forward_frame(index)
+
+        img, kp, kp_uv, mask, sfm_pose, renders = self.forward_img(index)
         elem = {
             'img': img,
             'kp': kp,
@@ -66,6 +93,8 @@ class IDataset(Dataset):
             'quat': sfm_pose[2],
             'inds': np.array([index]),
         }
+        if renders is not None:
+            elem['render_mask'], elem['render_depth'] = renders
         if self.transform == 'flip':
             flip_img = img[:, :, ::-1].copy()
             elem['flip_img'] = flip_img
@@ -73,6 +102,17 @@ class IDataset(Dataset):
             elem['flip_mask'] = flip_mask
         return elem
 
+    @staticmethod
+    def mean_shape_path(config) -> str:
+        """
+        Path to the mean shape of the category, which is needed without the dataset e.g. for the inference
+
+        :param config: The dataset config
+        :return: Path to the mat file with the mean shape, see src.nnutils.geometry.load_mean_shape
+        """
+
+        raise NotImplementedError('Must be implemented by a child class')
+
     def _get_mean_shape(self) -> dict:
         """
         Gets the template information
@@ -146,20 +186,26 @@ class IDataset(Dataset):
         float, scale,
         np.ndarray 1*2, trans
         np.ndarray 1*4, quaternion
+        renders: None or a tuple (mask, depth) of np.ndarray 256*256 with the precomputed renders for sfm_pose
         """
 
-        bbox, mask, parts, sfm_pose, img_path = self.get_data(index)
+        renders = None
+        if self.packed is not None:
+            img, mask, bbox, kp, sfm_pose = self.packed.get(index)
+            mask = mask >= 128 if self.img_dtype == 'uint8' else mask / 255.0
+            if self.renders is not None:
+                renders = self.renders.get(index)
+        else:
+            img, mask, bbox, kp, sfm_pose = self._read_sample(index)
 
-        img = imageio.imread(img_path) / 255.0
-        
-        # Some are grayscale:
-        if len(img.shape) == 2:
-            img = np.repeat(np.expand_dims(img, 2), 3, axis=2)
-        mask = np.expand_dims(mask, 2)
+        if self.img_dtype == 'uint8':
+            img = img.astype(np.uint8, copy=False)
+            mask = mask.astype(np.uint8, copy=False)
+        else:
+            img = img / 255.0
+            mask = mask.astype(float)
 
-        kp = np.copy(parts)
         vis = kp[:, 2] > 0
-        kp[vis, :2] -= 1
         kp_uv = self.kp_uv.copy()
         # Peturb bbox
 
@@ -188,8 +234,13 @@ class IDataset(Dataset):
             img, mask, kp, sfm_pose = self.scale_image(img, mask, kp, vis, sfm_pose)
 
         # Mirror image on random.
+        flip = False
         if self.config.split == 'train':
-            img, mask, kp, kp_uv, sfm_pose = self.mirror_image(img, mask, kp, kp_uv, sfm_pose)
+            flip = self.rngFlip.rand(1) > 0.5 and self.config.flip
+            img, mask, kp, kp_uv, sfm_pose = self.mirror_image(img, mask, kp, kp_uv, sfm_pose, flip)
+
+        if renders is not None:
+            renders = self.crop_renders(renders, bbox, flip)
 
         # Normalize kp to be [-1, 1]
         img_h, img_w = img.shape[:2]
@@ -197,7 +248,138 @@ class IDataset(Dataset):
 
         # Finally transpose the image to 3xHxW
         img = np.transpose(img, (2, 0, 1))
-        return img, kp_norm, kp_uv, mask, sfm_pose
+        return img, kp_norm, kp_uv, mask, sfm_pose, renders
+
+    def crop_renders(self, renders, bbox, flip):
+        """
+        Crops, scales and mirrors the precomputed renders like the image in forward_img.
+        The masks and depths are resized with the nearest neighbour. The depths are rendered with the
+        camera at z = 5 and scale with the crop, i.e. z = 5 + (P / w) * (z_P - 5) for a crop of width w.
+
+        :param renders: A np.ndarray P*P*4 as returned by src.data.utils.pack.PackedRenders.get
+        :param bbox: A np.ndarray 1*4, square bbox of the crop in the frame of the pack
+        :param flip: True if the image is mirrored
+        :return: A tuple (mask, depth) of np.ndarray img_size*img_size
+        """
+
+        pack_size = renders.shape[0]
+        renders = image.crop(renders, bbox, bgval=0)
+        crop_size = renders.shape[0]
+        renders = cv2.resize(renders, (self.img_size, self.img_size), interpolation=cv2.INTER_NEAREST_EXACT)
+
+        if flip:
+            mask, depth = renders[:, ::-1, 2], renders[:, ::-1, 3]
+        else:
+            mask, depth = renders[:, :, 0], renders[:, :, 1]
+
+        depth = 5 + (pack_size / crop_size) * (depth - 5)
+
+        return np.ascontiguousarray(mask), np.ascontiguousarray(depth)
+
+    def forward_frame(self, index):
+        """
+        Returns the sample without any augmentation for src.data.utils.augmentation.BatchAugmentation,
+        which crops, scales and mirrors the whole batch on the device
+
+        :param index: the index of image
+        :return: a dict contains info of the given index image
+        img: A np.ndarray 3*P*P uint8, crop of the image padded by padding_frac + jitter_frac
+        mask: A np.ndarray P*P uint8, mask of the crop (0-255)
+        bbox: A np.ndarray 4, tight bbox in the crop
+        kp: A np.ndarray 15*3, key points in the crop
+        scale, trans, quat: sfm_pose in the crop
+        inds: np.ndarray of given indexs
+        renders: A np.ndarray 4*P*P, precomputed renders if dataset.dir.renders is set.
+            See src.data.utils.pack.PackedRenders.get
+        """
+
+        if self.packed is not None:
+            img, mask, bbox, kp, sfm_pose = self.packed.get(index)
+            mask = mask[:, :, 0]
+        else:
+            img, mask, bbox, kp, sfm_pose = self.pack_sample(
+                index, get_pack_size(self.img_size, self.padding_frac, self.jitter_frac))
+
+        elem = {
+            'img': np.ascontiguousarray(np.transpose(img, (2, 0, 1))),
+            'mask': np.ascontiguousarray(mask),
+            'bbox': np.asarray(bbox, dtype=float),
+            'kp': kp,
+            'scale': sfm_pose[0],
+            'trans': sfm_pose[1],
+            'quat': sfm_pose[2],
+            'inds': np.array([index]),
+        }
+
+        if self.renders is not None:
+            elem['renders'] = np.ascontiguousarray(np.transpose(self.renders.get(index), (2, 0, 1)))
+
+        return elem
+
+    def _read_sample(self, index):
+        """
+        Decodes the image of the sample and converts the annotations to zero-indexed values
+
+        :param index: index of the sample
+        :return: A tuple (img, mask, bbox, kp, sfm_pose)
+            img - (H X W X 3) decoded image as returned by imageio
+            mask - (H X W X 1) foreground mask
+            bbox, sfm_pose - same as in get_data
+            kp - (KP X 3) zero-indexed key points
+        """
+
+        bbox, mask, parts, sfm_pose, img_path = self.get_data(index)
+
+        img = imageio.imread(img_path)
+
+        # Some are grayscale:
+        if len(img.shape) == 2:
+            img = np.repeat(np.expand_dims(img, 2), 3, axis=2)
+        mask = np.expand_dims(mask, 2)
+
+        kp = np.copy(parts)
+        vis = kp[:, 2] > 0
+        kp[vis, :2] -= 1
+
+        return img, mask, bbox, kp, sfm_pose
+
+    def pack_sample(self, index, pack_size):
+        """
+        Crops the sample with the bbox padded by padding_frac + jitter_frac and resizes it to pack_size.
+        Used by src.data.utils.pack.pack_dataset to precompute the samples.
+
+        :param index: index of the sample
+        :param pack_size: side length of the packed crop
+        :return: A tuple (img, mask, bbox, kp, sfm_pose)
+            img - (P X P X 3) uint8 crop
+            mask - (P X P) uint8 mask scaled to 0-255
+            bbox - tight bbox in the crop frame
+            kp - (KP X 3) key points in the crop frame
+            sfm_pose - sfm_pose in the crop frame
+        """
+
+        img, mask, bbox, kp, sfm_pose = self._read_sample(index)
+        mask = mask.astype(float)
+        vis = kp[:, 2] > 0
+
+        outer_bbox = image.peturb_bbox(bbox, pf=self.padding_frac + self.jitter_frac, jf=0)
+        outer_bbox = image.square_bbox(outer_bbox)
+
+        img, mask, kp, sfm_pose = self.crop_image(img, mask, outer_bbox, kp, vis, sfm_pose)
+
+        scale = pack_size / float(img.shape[0])
+        img, _ = image.resize_img(img, scale)
+        mask, _ = image.resize_img(mask, scale)
+        kp[vis, :2] *= scale
+        sfm_pose[0] *= scale
+        sfm_pose[1] *= scale
+
+        bbox = (np.asarray(bbox) - np.asarray(outer_bbox)[[0, 1, 0, 1]]) * scale
+
+        img = np.clip(np.round(img), 0, 255).astype(np.uint8)
+        mask = np.clip(np.round(mask * 255), 0, 255).astype(np.uint8)
+
+        return img, mask, bbox, kp, sfm_pose
 
     @staticmethod
     def crop_image(img, mask, bbox, kp, vis, sfm_pose):
@@ -222,7 +404,7 @@ class IDataset(Dataset):
         np.ndarray 1*2, trans
         np.ndarray 1*4, quaternion
         """
-        img = image.crop(img, bbox, bgval=1)
+        img = image.crop(img, bbox, bgval=255 if img.dtype == np.uint8 else 1)
         mask = image.crop(mask, bbox, bgval=0)
         kp[vis, 0] -= bbox[0]
         kp[vis, 1] -= bbox[1]
@@ -306,7 +488,7 @@ class IDataset(Dataset):
 
         return img_scale, mask_scale, kp, sfm_pose
 
-    def mirror_image(self, img, mask, kp, kp_uv, sfm_pose):
+    def mirror_image(self, img, mask, kp, kp_uv, sfm_pose, flip=None):
         """
         half of img left-right
 
@@ -318,6 +500,7 @@ class IDataset(Dataset):
         float, scale,
         np.ndarray 1*2, trans
          np.ndarray 1*4, quaternion,
+        :param flip: True or False. Whether to mirror. Default is random
         :return:
         img_scale: A np.ndarray 256*256*3, left-right image
         mask_scale: A np.ndarray 256*256, left-right mask
@@ -330,7 +513,9 @@ class IDataset(Dataset):
          np.ndarray 1*4, quaternion
         """
         kp_perm = self.kp_perm
-        if self.rngFlip.rand(1) > 0.5 and self.config.flip:
+        if flip is None:
+            flip = self.rngFlip.rand(1) > 0.5 and self.config.flip
+        if flip:
             # Need copy bc torch collate doesnt like neg strides
             img_flip = img[:, ::-1, :].copy()
             mask_flip = mask[:, ::-1].copy()
@@ -399,7 +584,13 @@ class IDataset(Dataset):
 
 class KPDataset(Dataset):
 
-    def __init__(self, dataset: IDataset, num_pairs: int):
+    def __init__(self, dataset: IDataset, num_pairs: int, return_indices: bool = False):
+        """
+        :param dataset: The dataset to sample the pairs from
+        :param num_pairs: Number of random pairs
+        :param return_indices: True or False. True if only the dataset indices of the pairs should be returned
+            instead of the samples. Used to evaluate the pairs from samples loaded once (see unique_indices)
+        """
 
         all_indices = [i for i in range(len(dataset))]
         rng = np.random.RandomState(len(dataset))
@@ -407,6 +598,7 @@ class KPDataset(Dataset):
 
         self.dataset = dataset
         self.index_tuples = pairs
+        self.return_indices = return_indices
 
         self.mean_shape = self.dataset.mean_shape
         self.texture_map = self.dataset.texture_map
@@ -422,4 +614,14 @@ class KPDataset(Dataset):
 
         id1, id2 = self.index_tuples[index]
 
+        if self.return_indices:
+            return int(id1), int(id2)
+
         return self.dataset[id1], self.dataset[id2]
+
+    def unique_indices(self):
+        """
+        :return: A sorted list of the dataset indices used in the pairs
+        """
+
+        return sorted(set(int(i) for pair in self.index_tuples for i in pair))
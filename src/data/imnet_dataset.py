@@ -29,11 +29,14 @@ class ImnetDataset(IDataset):
 
         return self.num_samples
 
+    @staticmethod
+    def mean_shape_path(config):
+
+        return osp.join(config.dir.cache_dir, 'shapenet', config.category, 'shape.mat')
+
     def _get_mean_shape(self):
 
-        mean_shape = load_mean_shape(
-            osp.join(self.config.dir.cache_dir, 'shapenet', self.category, 'shape.mat'),
-            device=self.device)
+        mean_shape = load_mean_shape(self.mean_shape_path(self.config), device=self.device)
 
         return mean_shape
 
@@ -0,0 +1,172 @@
+import os
+import os.path as osp
+
+import cv2
+import imageio
+import numpy as np
+from torch.utils.data import Dataset
+
+from src.data.utils import image
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def crop_sample(img, mask, bbox, img_size, padding_frac):
+    """
+    Crops the image around the object, pads the crop by padding_frac, makes it square and scales it to img_size.
+    Without a bounding box the box of the mask is used, without a mask the bounding box (or the whole image)
+    is used as the mask.
+
+    :param img: A (H X W X 3) uint8 np.ndarray
+    :param mask: A (H X W) bool np.ndarray with the foreground mask or None
+    :param bbox: (x1, y1, x2, y2) box of the object in the pixels of the image or None
+    :param img_size: Size of the square crop
+    :param padding_frac: Padding of the crop relative to the size of the object
+    :return: A dict containing
+        img: A np.ndarray 3*img_size*img_size uint8, crop of the image
+        mask: A np.ndarray img_size*img_size uint8 (0/1), mask of the crop
+        bbox: A np.ndarray 4 (x1, y1, x2, y2), square crop in the pixels of the original image
+    """
+
+    if mask is not None:
+        bbox = _get_mask_bbox(mask) if bbox is None else bbox
+    else:
+        if bbox is None:
+            bbox = [0, 0, img.shape[1] - 1, img.shape[0] - 1]
+        mask = np.zeros(img.shape[:2], dtype=bool)
+        x1, y1, x2, y2 = [int(round(c)) for c in bbox]
+        mask[max(y1, 0):y2 + 1, max(x1, 0):x2 + 1] = True
+
+    bbox = image.peturb_bbox(bbox, pf=padding_frac, jf=0)
+    bbox = image.square_bbox(bbox)
+
+    # White padding like IDataset.crop_image
+    img = image.crop(img, bbox, bgval=255)
+    mask = image.crop(mask[:, :, None].astype(np.float32), bbox, bgval=0)
+
+    img = cv2.resize(img, (img_size, img_size))
+    mask = cv2.resize(mask, (img_size, img_size)) > 0.5
+
+    return {
+        'img': np.ascontiguousarray(np.transpose(img, (2, 0, 1)), dtype=np.uint8),
+        'mask': mask.astype(np.uint8),
+        'bbox': np.asarray(bbox, dtype=np.float32),
+    }
+
+
+def _get_mask_bbox(mask):
+
+    ys, xs = np.nonzero(mask)
+    if len(xs) == 0:
+        return [0, 0, mask.shape[1] - 1, mask.shape[0] - 1]
+
+    return [xs.min(), ys.min(), xs.max(), ys.max()]
+
+
+class InferenceDataset(Dataset):
+    """
+    Images without annotations for the inference. Every sample is cropped around the object, padded by
+    padding_frac, made square and scaled to img_size like the samples of the training datasets.
+
+    The samples are read from
+    - a directory with the images. The masks are read from mask_dir (same file name, any image extension).
+        Without mask_dir the whole image is used as the crop and as the mask, e.g. for images which are
+        already cropped
+    - a list file with one sample per line, either "img_path", "img_path mask_path" or "img_path x1 y1 x2 y2".
+        Relative paths are relative to the directory of the list file. Without a mask the bounding box
+        is used as the mask
+    """
+
+    def __init__(self, config):
+        """
+        :param config: A dictionary containing the following parameters
+            img_size: Size of the square crops
+            padding_frac: Padding of the crops relative to the size of the object
+            input: Path to the directory with the images or to the list file
+            mask_dir: Optional directory with the masks of the images of a directory
+        """
+
+        self.img_size = config.img_size
+        self.padding_frac = config.padding_frac
+        self.samples = self._load_samples(config.input, config.get('mask_dir'))
+
+    def __len__(self):
+
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        """
+        :param index: Index of the sample
+        :return: A dict containing
+            img: A np.ndarray 3*img_size*img_size uint8, crop of the image
+            mask: A np.ndarray img_size*img_size uint8 (0/1), mask of the crop
+            bbox: A np.ndarray 4 (x1, y1, x2, y2), square crop in the pixels of the original image
+            inds: A np.ndarray 1 with the index
+        """
+
+        img_path, mask_path, bbox = self.samples[index]
+
+        img = imageio.imread(img_path)
+        if len(img.shape) == 2:
+            img = np.repeat(np.expand_dims(img, 2), 3, axis=2)
+        img = img[:, :, :3]
+
+        if mask_path is not None:
+            mask = imageio.imread(mask_path)
+            mask = (mask[:, :, 0] if len(mask.shape) == 3 else mask) > 0
+        else:
+            mask = None
+
+        sample = crop_sample(img, mask, bbox, self.img_size, self.padding_frac)
+        sample['inds'] = np.array([index])
+
+        return sample
+
+    def get_name(self, index):
+
+        return self.samples[index][0]
+
+    @staticmethod
+    def _load_samples(input_path, mask_dir):
+        """
+        :return: A list of tuples (img_path, mask_path or None, bbox or None)
+        """
+
+        if osp.isdir(input_path):
+            names = sorted(name for name in os.listdir(input_path) if name.lower().endswith(IMG_EXTENSIONS))
+
+            masks = {}
+            if mask_dir:
+                masks = {osp.splitext(name)[0]: osp.join(mask_dir, name)
+                         for name in sorted(os.listdir(mask_dir)) if name.lower().endswith(IMG_EXTENSIONS)}
+
+            samples = []
+            for name in names:
+                mask_path = masks.get(osp.splitext(name)[0])
+                if mask_dir and mask_path is None:
+                    raise ValueError('No mask for %s in %s' % (name, mask_dir))
+                samples.append((osp.join(input_path, name), mask_path, None))
+
+            return samples
+
+        if not osp.isfile(input_path):
+            raise ValueError('%s is neither a directory nor a list file' % input_path)
+
+        root = osp.dirname(input_path)
+        samples = []
+        with open(input_path) as f:
+            for line in f:
+                values = line.split()
+                if len(values) == 0 or values[0].startswith('#'):
+                    continue
+                img_path = osp.join(root, values[0])
+                if len(values) == 1:
+                    samples.append((img_path, None, None))
+                elif len(values) == 2:
+                    samples.append((img_path, osp.join(root, values[1]), None))
+                elif len(values) == 5:
+                    samples.append((img_path, None, [float(v) for v in values[1:]]))
+                else:
+                    raise ValueError('Invalid line in %s: %s' % (input_path, line.strip()))
+
+        return samples
@@ -25,10 +25,14 @@ class P3DDataset(IDataset):
 
         return self.num_samples
 
+    @staticmethod
+    def mean_shape_path(config):
+
+        return osp.join(config.dir.cache_dir, 'uv', '%s_mean_shape.mat' % config.category)
+
     def _get_mean_shape(self):
 
-        mean_shape = load_mean_shape(
-            osp.join(self.config.dir.cache_dir, 'uv', '%s_mean_shape.mat' % self.config.category), device=self.device)
+        mean_shape = load_mean_shape(self.mean_shape_path(self.config), device=self.device)
 
         return mean_shape
 
@@ -0,0 +1,195 @@
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class BatchAugmentation(nn.Module):
+    """
+    Batched version of the crop, scale, mirror and key point normalization of IDataset.forward_img
+    which runs on the device. Used with dataset.gpu_augment where the dataset returns the
+    un-augmented crops of the samples (see IDataset.forward_frame).
+
+    B - batch size
+    P - size of the input crops
+    S - img_size, size of the output images
+    KP - number of key points
+    """
+
+    def __init__(self, config, kp_perm, kp_uv):
+        """
+        :param config: The dataset config. img_size, padding_frac, jitter_frac, tight_crop, flip and split are used
+        :param kp_perm: (KP) permutation of the key points for the mirrored images
+        :param kp_uv: (KP X 2) UV values of the key points
+        """
+
+        super(BatchAugmentation, self).__init__()
+
+        self.img_size = config.img_size
+        self.tight_crop = config.tight_crop
+        self.padding_frac = 0.0 if config.tight_crop else config.padding_frac
+        self.jitter_frac = config.jitter_frac if config.split == 'train' else 0.0
+        self.mirror = config.split == 'train' and config.flip
+
+        self.register_buffer('kp_perm', torch.as_tensor(np.asarray(kp_perm), dtype=torch.long))
+        self.register_buffer('kp_uv', torch.as_tensor(np.asarray(kp_uv), dtype=torch.float))
+
+    def forward(self, batch: dict) -> dict:
+        """
+        :param batch: A dict with the collated output of IDataset.forward_frame
+            img - (B X 3 X P X P) uint8 crops
+            mask - (B X P X P) uint8 masks (0-255)
+            bbox - (B X 4) tight bboxes in the crop frame
+            kp - (B X KP X 3) key points in the crop frame
+            scale, trans, quat - (B), (B X 2), (B X 4) sfm poses in the crop frame
+            renders - Optional (B X 4 X P X P) precomputed renders, see src.data.utils.pack.PackedRenders.get
+        :return: A dict with the same keys and semantics as IDataset.__getitem__
+            img - (B X 3 X S X S) float image (0-1)
+            mask - (B X S X S) float mask
+            kp - (B X KP X 3) normalized key points
+            kp_uv - (B X KP X 2) key points in uv coordinates
+            scale, trans, quat - (B), (B X 2), (B X 4) normalized sfm poses
+            render_mask, render_depth - (B X S X S) precomputed renders for the sfm poses if renders is given
+        """
+
+        device = self.kp_perm.device
+
+        img = batch['img'].to(device, non_blocking=True).float() / 255
+        mask = batch['mask'].to(device, non_blocking=True).float().unsqueeze(1) / 255
+        bbox = batch['bbox'].to(device, dtype=torch.float)
+        kp = batch['kp'].to(device, dtype=torch.float).clone()
+        scale = batch['scale'].to(device, dtype=torch.float).clone()
+        trans = batch['trans'].to(device, dtype=torch.float).clone()
+        quat = batch['quat'].to(device, dtype=torch.float).clone()
+
+        batch_size = img.size(0)
+        frame_size = img.size(-1)
+
+        bbox = self.peturb_bbox(bbox, self.padding_frac, self.jitter_frac)
+        if self.tight_crop:
+            bbox_px = torch.round(bbox)
+        else:
+            bbox = self.square_bbox(bbox)
+            bbox_px = bbox
+
+        # Size of the cropped region in pixels, same as image.crop
+        width = bbox_px[:, 2] - bbox_px[:, 0] + 1
+        height = bbox_px[:, 3] - bbox_px[:, 1] + 1
+
+        # crop, translate kps. Same as IDataset.crop_image
+        vis = kp[:, :, 2] > 0
+        kp_x = torch.min(torch.clamp(kp[:, :, 0] - bbox[:, 0:1], min=0), (bbox[:, 2] - bbox[:, 0]).unsqueeze(1))
+        kp_y = torch.min(torch.clamp(kp[:, :, 1] - bbox[:, 1:2], min=0), (bbox[:, 3] - bbox[:, 1]).unsqueeze(1))
+        trans = trans - bbox[:, :2]
+
+        # scale kps. Same as IDataset.scale_image and IDataset.scale_image_tight
+        if self.tight_crop:
+            scale_x = self.img_size / width
+            scale_y = self.img_size / height
+            scale = scale * scale_x
+            trans = trans * scale_y.unsqueeze(1)
+        else:
+            scale_x = scale_y = self.img_size / torch.max(width, height)
+            scale = scale * scale_x
+            trans = trans * scale_x.unsqueeze(1)
+
+        kp_x = torch.where(vis, kp_x * scale_x.unsqueeze(1), kp[:, :, 0])
+        kp_y = torch.where(vis, kp_y * scale_y.unsqueeze(1), kp[:, :, 1])
+        kp = torch.stack([kp_x, kp_y, kp[:, :, 2]], dim=2)
+        kp_uv = self.kp_uv.unsqueeze(0).repeat(batch_size, 1, 1)
+
+        # Mirror on random. Same as IDataset.mirror_image
+        if self.mirror:
+            flip = torch.rand(batch_size, device=device) > 0.5
+        else:
+            flip = torch.zeros(batch_size, dtype=torch.bool, device=device)
+
+        kp_flip = torch.cat(((self.img_size - kp[:, :, 0:1] - 1), kp[:, :, 1:]), dim=2)[:, self.kp_perm]
+        kp = torch.where(flip.view(-1, 1, 1), kp_flip, kp)
+        kp_uv = torch.where(flip.view(-1, 1, 1), kp_uv[:, self.kp_perm], kp_uv)
+
+        # Mirroring the rotation R -> diag(-1, 1, 1) R diag(-1, 1, 1) negates the y and z
+        # components of the quaternion (w, x, y, z)
+        quat_flip = quat * torch.tensor([1, 1, -1, -1], dtype=torch.float, device=device)
+        quat = torch.where(flip.view(-1, 1), quat_flip, quat)
+        trans_x = torch.where(flip, self.img_size - trans[:, 0] - 1, trans[:, 0])
+        trans = torch.stack([trans_x, trans[:, 1]], dim=1)
+
+        # Sample the crops. With align_corners=False the output pixel i samples the
+        # crop at (i + 0.5) * width / S - 0.5 like cv2.resize
+        theta = torch.zeros((batch_size, 2, 3), device=device)
+        theta[:, 0, 0] = torch.where(flip, -width, width) / frame_size
+        theta[:, 0, 2] = (2 * bbox_px[:, 0] + width) / frame_size - 1
+        theta[:, 1, 1] = height / frame_size
+        theta[:, 1, 2] = (2 * bbox_px[:, 1] + height) / frame_size - 1
+
+        grid = F.affine_grid(theta, [batch_size, 1, self.img_size, self.img_size], align_corners=False)
+
+        # Regions outside the crop are white in the image and background in the mask
+        img = F.grid_sample(img - 1, grid, align_corners=False) + 1
+        mask = F.grid_sample(mask, grid, align_corners=False).squeeze(1)
+
+        # Normalize kp to be [-1, 1]. Same as IDataset.normalize_kp
+        vis = kp[:, :, 2:] > 0
+        kp = torch.cat([2 * kp[:, :, :2] / self.img_size - 1, kp[:, :, 2:]], dim=2) * vis
+        scale = scale * 2.0 / self.img_size
+        trans = 2.0 * trans / self.img_size - 1
+
+        out = dict(batch)
+        out.update({
+            'img': img,
+            'mask': mask,
+            'kp': kp,
+            'kp_uv': kp_uv,
+            'scale': scale,
+            'trans': trans,
+            'quat': quat,
+        })
+        out.pop('bbox')
+
+        if 'renders' in batch:
+            # The renders for the mirrored poses are stored mirrored back to the crop frame, the
+            # grid mirrors them again. The depths scale with the crop like in IDataset.crop_renders
+            renders = batch['renders'].to(device, non_blocking=True).float()
+            renders = torch.where(flip.view(-1, 1, 1, 1), renders[:, 2:], renders[:, :2])
+            renders = F.grid_sample(renders, grid, mode='nearest', align_corners=False)
+
+            depth_scale = frame_size / torch.max(width, height)
+            out['render_mask'] = renders[:, 0]
+            out['render_depth'] = 5 + depth_scale.view(-1, 1, 1) * (renders[:, 1] - 5)
+            out.pop('renders')
+
+        return out
+
+    @staticmethod
+    def peturb_bbox(bbox, pf=0.0, jf=0.0):
+        """
+        Batched version of image.peturb_bbox
+
+        :param bbox: (B X 4) tight bboxes
+        :param pf: padding fraction
+        :param jf: jittering fraction
+        :return: (B X 4) jittered and padded bboxes
+        """
+
+        size = (bbox[:, 2:] - bbox[:, :2] + 1).repeat(1, 2)
+        jitter = (1 - 2 * torch.rand_like(bbox)) * jf
+        sign = torch.tensor([-1, -1, 1, 1], dtype=bbox.dtype, device=bbox.device)
+
+        return bbox + sign * (pf + jitter) * size
+
+    @staticmethod
+    def square_bbox(bbox):
+        """
+        Batched version of image.square_bbox
+
+        :param bbox: (B X 4) bboxes
+        :return: (B X 4) square bboxes with integer coordinates
+        """
+
+        bbox = torch.round(bbox)
+        size = bbox[:, 2:] - bbox[:, :2] + 1
+        max_dim, _ = size.max(dim=1, keepdim=True)
+        start = bbox[:, :2] - torch.round((max_dim - size) / 2)
+
+        return torch.cat([start, start + max_dim - 1], dim=1)
@@ -77,11 +77,14 @@ def crop(img, bbox, bgval=0):
     """
     Crops a region from the image corresponding to the bbox.
     If some regions specified go outside the image boundaries, the pixel values are set to bgval.
+    If the bbox lies inside the image a view of the image is returned.
 
     Args:
         img: image to crop
         bbox: bounding box to crop
         bgval: default background for regions outside image
+    Returns:
+        img_out: cropped image with the same dtype as img
     """
     bbox = [int(round(c)) for c in bbox]
     bwidth = bbox[2] - bbox[0] + 1
@@ -92,7 +95,11 @@ def crop(img, bbox, bgval=0):
 
     nc = 1 if len(im_shape) < 3 else im_shape[2]
 
-    img_out = np.ones((bheight, bwidth, nc)) * bgval
+    # The bbox lies completely inside the image. A view is enough
+    if len(im_shape) == 3 and bbox[0] >= 0 and bbox[1] >= 0 and bbox[2] < im_w and bbox[3] < im_h:
+        return img[bbox[1]:bbox[3] + 1, bbox[0]:bbox[2] + 1, :]
+
+    img_out = np.full((bheight, bwidth, nc), bgval, dtype=img.dtype)
     x_min_src = max(0, bbox[0])
     x_max_src = min(im_w, bbox[2] + 1)
     y_min_src = max(0, bbox[1])
@@ -107,6 +114,22 @@ def crop(img, bbox, bgval=0):
     return img_out
 
 
+def img_to_float(img, device):
+    """
+    Moves a batch of images to the device and converts it to float values between 0-1.
+    uint8 images (0-255) are copied as uint8 and converted on the device.
+
+    :param img: A (B X 3 X H X W) uint8 or float tensor
+    :param device: Device to move the images to
+    :return: A (B X 3 X H X W) float tensor on the device
+    """
+
+    if img.dtype == torch.uint8:
+        return img.to(device, non_blocking=True).float().div_(255)
+
+    return img.to(device, dtype=torch.float, non_blocking=True)
+
+
 def compute_dt(mask):
     """
     Computes distance transform of mask.
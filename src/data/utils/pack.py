@@ -0,0 +1,262 @@
+import os.path as osp
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from src.nnutils.geometry import get_scaled_orthographic_projection
+from src.nnutils.rendering import MaskAndDepthRenderer
+from src.utils.utils import create_dir_if_not_exists, validate_paths
+
+
+"""
+A pack stores the decoded samples of a dataset split in two files
+    {path}.npy - A (N X P X P X 4) uint8 array, memory-mapped while training. The first 3 channels
+        are the RGB crop and the last one is the foreground mask scaled to 0-255
+    {path}.npz - The index with the annotations of every sample in the coordinate frame of its crop
+        bbox - (N X 4) tight bbox (x1, y1, x2, y2)
+        kp - (N X KP X 3) key points
+        scale, trans, quat - (N), (N X 2), (N X 4) sfm pose
+        pack_size, img_size, padding_frac, jitter_frac - parameters used while packing
+
+The crop of every sample is the square bbox padded with padding_frac + jitter_frac on each side,
+so that every jittered bbox used during the training lies (almost) completely inside the crop.
+
+The renders of the template for the ground truth poses of a pack (see render_pack) are stored in
+    {path}.depth.npy - A (N X 2 X P X P) float16 or float32 array with the depths. -1 for the empty pixels
+    {path}.mask.npy - A (N X 2 X P X P/8) uint8 array with the masks packed with np.packbits along the last axis
+        or a (N X 2 X P X P) bool array if the masks are not packed
+The first render of every sample is for the sfm pose in the crop frame. The second one is for the mirrored
+sfm pose, mirrored back to the crop frame, so that mirroring its crop gives the render of the mirrored sample.
+Both are in the image orientation, i.e. the same as the outputs of CSM.
+"""
+
+
+def get_pack_size(img_size, padding_frac, jitter_frac):
+    """
+    Size of the packed crops such that the un-jittered crop keeps the resolution of img_size
+
+    :param img_size: Size of the images returned by the dataset
+    :param padding_frac: Padding fraction of the bbox
+    :param jitter_frac: Jittering fraction of the bbox
+    :return: Side length of the packed crops
+    """
+
+    return int(np.ceil(img_size * (1 + 2 * (padding_frac + jitter_frac)) / (1 + 2 * padding_frac)))
+
+
+def pack_dataset(dataset, path, pack_size=None):
+    """
+    Writes the decoded and cropped samples of the dataset to {path}.npy and {path}.npz
+
+    :param dataset: An IDataset
+    :param path: Path of the pack without the extension
+    :param pack_size: Side length of the packed crops. Default is computed with get_pack_size
+    """
+
+    config = dataset.config
+    if pack_size is None:
+        pack_size = get_pack_size(config.img_size, config.padding_frac, config.jitter_frac)
+
+    create_dir_if_not_exists(osp.dirname(osp.abspath(path)))
+
+    num_samples = len(dataset)
+    num_kps = len(dataset.kp_perm)
+
+    frames = np.lib.format.open_memmap(
+        '%s.npy' % path, mode='w+', dtype=np.uint8, shape=(num_samples, pack_size, pack_size, 4))
+    index = {
+        'bbox': np.zeros((num_samples, 4)),
+        'kp': np.zeros((num_samples, num_kps, 3)),
+        'scale': np.zeros(num_samples),
+        'trans': np.zeros((num_samples, 2)),
+        'quat': np.zeros((num_samples, 4)),
+    }
+
+    for i in tqdm(range(num_samples), desc='Packing %s' % path, dynamic_ncols=True):
+        img, mask, bbox, kp, sfm_pose = dataset.pack_sample(i, pack_size)
+
+        frames[i, :, :, :3] = img
+        frames[i, :, :, 3] = mask
+        index['bbox'][i] = bbox
+        index['kp'][i] = kp
+        index['scale'][i] = sfm_pose[0]
+        index['trans'][i] = sfm_pose[1]
+        index['quat'][i] = sfm_pose[2]
+
+    frames.flush()
+    del frames
+
+    np.savez('%s.npz' % path, pack_size=pack_size, img_size=config.img_size,
+             padding_frac=config.padding_frac, jitter_frac=config.jitter_frac, **index)
+
+
+class PackedSamples:
+    """
+    Read access to a pack written by pack_dataset. The frames are memory-mapped lazily
+    so that every data loader worker opens its own map after the fork.
+    """
+
+    def __init__(self, path):
+
+        validate_paths('%s.npy' % path, '%s.npz' % path)
+
+        self.path = path
+        self._frames = None
+
+        with np.load('%s.npz' % path) as index:
+            self.index = {k: index[k] for k in index.files}
+
+        self.pack_size = int(self.index['pack_size'])
+
+    def __len__(self):
+
+        return len(self.index['bbox'])
+
+    @property
+    def frames(self):
+
+        if self._frames is None:
+            self._frames = np.load('%s.npy' % self.path, mmap_mode='r')
+
+        return self._frames
+
+    def __getstate__(self):
+
+        # Do not pickle the memory map to the data loader workers
+        state = self.__dict__.copy()
+        state['_frames'] = None
+        return state
+
+    def get(self, index):
+        """
+        :param index: Index of the sample
+        :return: A tuple (img, mask, bbox, kp, sfm_pose)
+            img - (P X P X 3) uint8 read-only view of the crop
+            mask - (P X P X 1) uint8 read-only view of the mask (0-255)
+            bbox - tight bbox in the crop frame
+            kp - (KP X 3) key points in the crop frame
+            sfm_pose - A list of scale, translation and quaternions in the crop frame
+        """
+
+        frame = self.frames[index]
+        sfm_pose = [np.copy(self.index['scale'][index]),
+                    np.copy(self.index['trans'][index]),
+                    np.copy(self.index['quat'][index])]
+
+        return frame[:, :, :3], frame[:, :, 3:], np.copy(self.index['bbox'][index]), \
+            np.copy(self.index['kp'][index]), sfm_pose
+
+
+def render_pack(samples, template_mesh, path, batch_size=32, depth_dtype='float16', packbits=True):
+    """
+    Renders the masks and the depths of the template for the sfm poses of the packed samples
+    and writes them to {path}.depth.npy and {path}.mask.npy
+
+    :param samples: A PackedSamples
+    :param template_mesh: A pytorch3d.structures.Meshes with the template. The renders are computed on its device
+    :param path: Path of the renders without the extension
+    :param batch_size: Number of samples rendered at once
+    :param depth_dtype: 'float16' or 'float32'
+    :param packbits: True or False. True if the masks should be stored with 1 bit per pixel
+    """
+
+    create_dir_if_not_exists(osp.dirname(osp.abspath(path)))
+
+    num_samples = len(samples)
+    pack_size = samples.pack_size
+    device = template_mesh.device
+
+    renderer = MaskAndDepthRenderer(template_mesh, image_size=pack_size)
+
+    depths = np.lib.format.open_memmap(
+        '%s.depth.npy' % path, mode='w+', dtype=depth_dtype, shape=(num_samples, 2, pack_size, pack_size))
+    mask_shape = (num_samples, 2, pack_size, (pack_size + 7) // 8 if packbits else pack_size)
+    masks = np.lib.format.open_memmap(
+        '%s.mask.npy' % path, mode='w+', dtype=np.uint8 if packbits else bool, shape=mask_shape)
+
+    for start in tqdm(range(0, num_samples, batch_size), desc='Rendering %s' % path, dynamic_ncols=True):
+        end = min(start + batch_size, num_samples)
+
+        scale = torch.as_tensor(samples.index['scale'][start:end], dtype=torch.float, device=device)
+        trans = torch.as_tensor(samples.index['trans'][start:end], dtype=torch.float, device=device)
+        quat = torch.as_tensor(samples.index['quat'][start:end], dtype=torch.float, device=device)
+
+        # Mirrored poses as in IDataset.mirror_image
+        trans_flip = torch.stack([pack_size - trans[:, 0] - 1, trans[:, 1]], dim=1)
+        quat_flip = quat * torch.tensor([1, 1, -1, -1], dtype=torch.float, device=device)
+
+        # Normalized to the crop frame as in IDataset.normalize_kp
+        scale = torch.cat([scale, scale]) * 2.0 / pack_size
+        trans = 2.0 * torch.cat([trans, trans_flip]) / pack_size - 1
+        rotation, translation = get_scaled_orthographic_projection(scale, trans, torch.cat([quat, quat_flip]), True)
+
+        with torch.no_grad():
+            mask, depth = renderer.render_hard(rotation, translation)
+
+        # Image orientation as in CSM.forward and the renders of the mirrored poses mirrored back
+        mask = torch.flip(mask, (-1, -2)).view(2, end - start, pack_size, pack_size)
+        depth = torch.flip(depth, (-1, -2)).view(2, end - start, pack_size, pack_size)
+        mask = torch.stack([mask[0], mask[1].flip(-1)], dim=1).cpu().numpy() > 0.5
+        depth = torch.stack([depth[0], depth[1].flip(-1)], dim=1).cpu().numpy()
+
+        depths[start:end] = depth
+        masks[start:end] = np.packbits(mask, axis=-1) if packbits else mask
+
+    depths.flush()
+    masks.flush()
+
+
+class PackedRenders:
+    """
+    Read access to the renders written by render_pack. Memory-mapped lazily like PackedSamples.
+    """
+
+    def __init__(self, path):
+
+        validate_paths('%s.depth.npy' % path, '%s.mask.npy' % path)
+
+        self.path = path
+        self._depths = None
+        self._masks = None
+
+    @property
+    def depths(self):
+
+        if self._depths is None:
+            self._depths = np.load('%s.depth.npy' % self.path, mmap_mode='r')
+
+        return self._depths
+
+    @property
+    def masks(self):
+
+        if self._masks is None:
+            self._masks = np.load('%s.mask.npy' % self.path, mmap_mode='r')
+
+        return self._masks
+
+    def __len__(self):
+
+        return len(self.depths)
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state['_depths'] = None
+        state['_masks'] = None
+        return state
+
+    def get(self, index):
+        """
+        :param index: Index of the sample
+        :return: A (P X P X 4) float32 array with the mask and the depth for the sfm pose and
+            the mask and the depth for the mirrored sfm pose in the channels
+        """
+
+        depth = self.depths[index].astype(np.float32)
+        mask = self.masks[index]
+        if mask.dtype == np.uint8:
+            mask = np.unpackbits(mask, axis=-1, count=depth.shape[-1])
+
+        return np.stack([mask[0], depth[0], mask[1], depth[1]], axis=-1).astype(np.float32)
@@ -0,0 +1,172 @@
+import json
+import os.path as osp
+import queue
+import threading
+
+import numpy as np
+
+from src.utils.utils import create_dir_if_not_exists
+
+
+"""
+The outputs of the inference are stored in shards of shard_size samples
+    {out_dir}/shard_{i:05d}.npz
+        uv - (N X 2 X S X S) UV values as float16 or quantized to uint16 (round(uv * 65535))
+        uv_3d - (N X S X S X 3) float16 3D points of the UV values on the mean shape. Optional
+        mask - (N X S X S) uint8 input foreground mask
+        bbox - (N X 4) square crop (x1, y1, x2, y2) of the sample in the pixels of the original image
+        names - (N) paths of the images
+    {out_dir}/index.json
+        shards - File names of the shards
+        num_samples, img_size, uv_dtype - Parameters of the outputs
+"""
+
+UV_DTYPES = ('float16', 'uint16')
+UV_QUANTIZATION = 65535
+
+
+def encode_uv(uv, uv_dtype):
+    """
+    :param uv: A np.ndarray of UV values (0-1)
+    :param uv_dtype: One of UV_DTYPES
+    """
+
+    if uv_dtype == 'uint16':
+        return np.round(np.clip(uv, 0, 1) * UV_QUANTIZATION).astype(np.uint16)
+
+    return uv.astype(np.float16)
+
+
+def decode_uv(uv):
+    """
+    :param uv: A np.ndarray of UV values encoded with encode_uv
+    :return: The UV values as float32
+    """
+
+    if uv.dtype == np.uint16:
+        return uv.astype(np.float32) / UV_QUANTIZATION
+
+    return uv.astype(np.float32)
+
+
+def load_shard(path):
+    """
+    :param path: Path to a shard
+    :return: A dict with the arrays of the shard. The UV values (and the 3D points) are decoded to float32
+    """
+
+    with np.load(path) as shard:
+        data = {key: shard[key] for key in shard.files}
+
+    data['uv'] = decode_uv(data['uv'])
+    if 'uv_3d' in data:
+        data['uv_3d'] = data['uv_3d'].astype(np.float32)
+
+    return data
+
+
+class ShardWriter:
+    """
+    Collects the outputs of the batches and writes them to shards in a background thread.
+    At most max_pending shards wait to be written, add blocks when the writer falls behind.
+    """
+
+    def __init__(self, out_dir, shard_size, img_size, uv_dtype='float16', max_pending=2):
+        """
+        :param out_dir: Directory of the shards
+        :param shard_size: Number of samples per shard
+        :param img_size: Size of the UV maps
+        :param uv_dtype: One of UV_DTYPES
+        :param max_pending: Maximum number of complete shards waiting to be written
+        """
+
+        if uv_dtype not in UV_DTYPES:
+            raise ValueError('Unknown uv dtype %s. Should be one of %s' % (uv_dtype, UV_DTYPES))
+
+        create_dir_if_not_exists(out_dir)
+
+        self.out_dir = out_dir
+        self.shard_size = shard_size
+        self.img_size = img_size
+        self.uv_dtype = uv_dtype
+        self.num_samples = 0
+        self.shards = []
+
+        self._buffer = []
+        self._buffered = 0
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name='ShardWriter', daemon=True)
+        self._thread.start()
+
+    def add(self, uv, mask, bbox, names, uv_3d=None):
+        """
+        :param uv: A (B X 2 X S X S) float np.ndarray with the UV values
+        :param mask: A (B X S X S) np.ndarray with the foreground masks
+        :param bbox: A (B X 4) np.ndarray with the crops
+        :param names: A list of B image paths
+        :param uv_3d: Optional (B X S X S X 3) float np.ndarray with the 3D points
+        """
+
+        batch = {
+            'uv': encode_uv(uv, self.uv_dtype),
+            'mask': mask.astype(np.uint8),
+            'bbox': bbox.astype(np.float32),
+            'names': np.asarray(names),
+        }
+        if uv_3d is not None:
+            batch['uv_3d'] = uv_3d.astype(np.float16)
+
+        self._buffer.append(batch)
+        self._buffered += len(uv)
+        self.num_samples += len(uv)
+
+        while self._buffered >= self.shard_size:
+            self._flush(self.shard_size)
+
+    def close(self):
+        """
+        Writes the remaining samples, waits for the background thread and writes the index
+        """
+
+        if self._buffered > 0:
+            self._flush(self._buffered)
+
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+        with open(osp.join(self.out_dir, 'index.json'), 'w') as f:
+            json.dump({'shards': self.shards, 'num_samples': self.num_samples,
+                       'img_size': self.img_size, 'uv_dtype': self.uv_dtype}, f, indent=2)
+
+    def _flush(self, size):
+
+        # Re-raise a failed write on the main thread
+        if self._error is not None:
+            raise self._error
+
+        data = {key: np.concatenate([batch[key] for batch in self._buffer]) for key in self._buffer[0]}
+
+        shard = {key: value[:size] for key, value in data.items()}
+        rest = {key: value[size:] for key, value in data.items()}
+
+        self._buffered -= size
+        self._buffer = [rest] if self._buffered > 0 else []
+
+        name = 'shard_%05d.npz' % len(self.shards)
+        self.shards.append(name)
+        self._queue.put((osp.join(self.out_dir, name), shard))
+
+    def _run(self):
+
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            path, shard = job
+            try:
+                np.savez(path, **shard)
+            except Exception as e:
+                self._error = e
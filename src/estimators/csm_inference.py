@@ -0,0 +1,149 @@
+import os.path as osp
+import time
+
+import torch
+import torch.utils.data
+from tqdm import tqdm
+
+from src.data.cub_dataset import CubDataset
+from src.data.imnet_dataset import ImnetDataset
+from src.data.infer_dataset import InferenceDataset
+from src.data.p3d_dataset import P3DDataset
+from src.data.utils.image import img_to_float
+from src.data.utils.shards import ShardWriter
+from src.model.csm_onnx import ONNXPredictor
+from src.model.csm_predictor import CSMPredictor
+from src.nnutils.geometry import load_mean_shape
+from src.utils.benchmark import print_table
+from src.utils.config import ConfigParser
+
+
+def load_predictor(config: ConfigParser.ConfigObject, data_cfg: ConfigParser.ConfigObject, device):
+    """
+    :param config: A config with the checkpoint, uv_to_3d_mode, return_3d and optionally the onnx file and threads
+    :param data_cfg: The dataset config, used for the mean shape of the category
+    :return: A CSMPredictor with the weights of the checkpoint on the device,
+        or an ONNXPredictor on the cpu if the config has an onnx file
+    """
+
+    onnx_path = config.get('onnx')
+    if onnx_path:
+        model = ONNXPredictor(onnx_path, config.get('threads', 0))
+        print('Loaded the onnx model %s' % onnx_path)
+        return model
+
+    if data_cfg.category == 'car':
+        mean_shape_path = P3DDataset.mean_shape_path(data_cfg)
+    elif data_cfg.category == 'bird':
+        mean_shape_path = CubDataset.mean_shape_path(data_cfg)
+    else:
+        mean_shape_path = ImnetDataset.mean_shape_path(data_cfg)
+
+    mean_shape = load_mean_shape(mean_shape_path, device)
+    model = CSMPredictor(mean_shape, config.get('uv_to_3d_mode', 'exact'), config.get('return_3d', False)).to(device)
+
+    checkpoint = config.checkpoint
+    if checkpoint is None or not osp.exists(checkpoint):
+        raise FileNotFoundError('Checkpoint %s does not exist' % checkpoint)
+    model.load_csm_state_dict(torch.load(checkpoint, map_location=device))
+    print('Loaded model weights from %s' % checkpoint)
+
+    return model.eval()
+
+
+def predict(model, img, mask, device):
+    """
+    :param model: A CSMPredictor or an ONNXPredictor returned by load_predictor
+    :param img: A (B X 3 X H X W) uint8 tensor with the images
+    :param mask: A (B X H X W) uint8 tensor with the foreground masks
+    :param device: Device of the CSMPredictor
+    :return: A tuple (uv, uv_3d) of np.ndarrays with the (B X 2 X H X W) UV values
+        and the (B X H X W X 3) 3D points or None
+    """
+
+    if isinstance(model, ONNXPredictor):
+        out = model(img.float().div_(255), mask[:, None].float())
+    else:
+        img = img_to_float(img, device)
+        mask = mask[:, None].to(device, non_blocking=True).float()
+        with torch.no_grad():
+            out = model(img, mask)
+        # Blocks until the model is done, i.e. the time of the call includes the gpu time
+        out = tuple(o.cpu().numpy() for o in out) if model.return_3d else out.cpu().numpy()
+
+    return out if model.return_3d else (out, None)
+
+
+class CSMInference:
+    """
+    Predicts the UV maps (and optionally the 3D points) of the images of a directory or a list file
+    and writes them to shards (see src.data.utils.shards). The images are decoded and cropped by the
+    data loader workers while the model runs on the previous batches and the shards are written
+    by a background thread.
+    """
+
+    def __init__(self, config: ConfigParser.ConfigObject, device):
+
+        self.config = config.infer
+        self.data_cfg = config.dataset
+        self.device = torch.device(device)
+
+        self.dataset = self._load_dataset()
+        self.data_loader = self._get_data_loader()
+        self.model = load_predictor(self.config, self.data_cfg, self.device)
+
+    def infer(self):
+        """
+        Runs the model on all the images and writes the outputs.
+        Prints the throughput of the whole pipeline and of the model alone.
+        """
+
+        writer = ShardWriter(self.config.out_dir, self.config.get('shard_size', 1024), self.data_cfg.img_size,
+                             self.config.get('uv_dtype', 'float16'))
+
+        num_images = 0
+        model_time = 0
+        start = time.perf_counter()
+
+        batch_bar = tqdm(self.data_loader, desc='Running the inference')
+        try:
+            for batch in batch_bar:
+
+                model_start = time.perf_counter()
+                uv, uv_3d = predict(self.model, batch['img'], batch['mask'], self.device)
+                model_time += time.perf_counter() - model_start
+
+                names = [self.dataset.get_name(int(i)) for i in batch['inds']]
+                writer.add(uv, batch['mask'].numpy(), batch['bbox'].numpy(), names, uv_3d)
+
+                num_images += len(names)
+                batch_bar.set_postfix({'images/s': '%.1f' % (num_images / (time.perf_counter() - start))})
+        finally:
+            writer.close()
+
+        total_time = time.perf_counter() - start
+
+        print('Wrote %d samples to %d shards in %s' % (num_images, len(writer.shards), self.config.out_dir))
+        print_table(['stage', 'time (s)', 'images/s'],
+                    [['total', '%.1f' % total_time, '%.1f' % (num_images / total_time)],
+                     ['model', '%.1f' % model_time, '%.1f' % (num_images / max(model_time, 1E-9))]])
+
+    def _load_dataset(self) -> InferenceDataset:
+
+        data_cfg = ConfigParser.ConfigObject(self.data_cfg)
+        data_cfg.input = self.config.input
+        data_cfg.mask_dir = self.config.get('mask_dir')
+
+        return InferenceDataset(data_cfg)
+
+    def _get_data_loader(self) -> torch.utils.data.DataLoader:
+        """
+        The workers decode at most prefetch_factor batches each ahead of the model
+        """
+
+        workers = self.config.get('workers', 4)
+        kwargs = {'prefetch_factor': self.config.get('prefetch_factor', 2)} if workers > 0 else {}
+
+        return torch.utils.data.DataLoader(
+            self.dataset, batch_size=self.config.batch_size, shuffle=False, num_workers=workers,
+            pin_memory=self.device.type == 'cuda', **kwargs)
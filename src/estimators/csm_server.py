@@ -0,0 +1,216 @@
+import concurrent.futures
+import io
+import json
+import queue
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import torch
+
+from src.data.infer_dataset import crop_sample
+from src.data.utils.shards import encode_uv
+from src.estimators.csm_inference import load_predictor, predict
+from src.utils.batching import DynamicBatcher
+from src.utils.config import ConfigParser
+
+
+"""
+The requests and the responses are npz files (np.savez), see encode_arrays and decode_arrays
+    POST /predict
+        request
+            img - (H X W X 3) or (H X W) uint8 image
+            mask - Optional (H X W) foreground mask, > 0 is foreground
+            bbox - Optional (4) box (x1, y1, x2, y2) of the object in the pixels of the image
+        response
+            uv - (2 X S X S) UV values as float16 or quantized to uint16 (see src.data.utils.shards)
+            uv_3d - (S X S X 3) float16 3D points of the UV values on the mean shape, with return_3d
+            mask - (S X S) uint8 mask of the crop
+            bbox - (4) square crop (x1, y1, x2, y2) in the pixels of the image
+    GET /metrics
+        JSON with the queue depth and the percentiles of the latencies, see DynamicBatcher.metrics
+    GET /health
+"""
+
+
+def encode_arrays(**arrays) -> bytes:
+
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+
+    return buffer.getvalue()
+
+
+def decode_arrays(data: bytes) -> dict:
+
+    with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+        return {key: arrays[key] for key in arrays.files}
+
+
+class CSMServer:
+    """
+    Serves the UV maps of CSMPredictor (or of the exported ONNX graph) over HTTP. The requests are decoded
+    and cropped on the threads of the HTTP server and the concurrent requests are run as batches by a
+    DynamicBatcher, i.e. one forward per batch of at most max_batch_size requests which waits at most
+    max_latency_ms for more requests.
+    """
+
+    def __init__(self, config: ConfigParser.ConfigObject, device):
+
+        self.config = config.serve
+        self.data_cfg = config.dataset
+        self.device = torch.device(device)
+        self.img_size = self.data_cfg.img_size
+        self.uv_dtype = self.config.get('uv_dtype', 'float16')
+
+        self.model = load_predictor(self.config, self.data_cfg, self.device)
+
+        self.batcher = DynamicBatcher(self._batch_call, max_batch_size=self.config.max_batch_size,
+                                      max_latency=self.config.max_latency_ms / 1000,
+                                      max_queue_size=self.config.get('max_queue_size', 0))
+
+        self.http_server = _HTTPServer((self.config.host, self.config.port), _RequestHandler)
+        self.http_server.csm_server = self
+
+    def serve(self):
+        """
+        Serves the requests until the process is interrupted. Prints the metrics at the end.
+        """
+
+        self._warm_up()
+
+        host, port = self.http_server.server_address[:2]
+        print('Serving on http://%s:%d (max batch size %d, max latency %.1f ms)' % (
+            host, port, self.batcher.max_batch_size, self.batcher.max_latency * 1000))
+
+        try:
+            self.http_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+        print(json.dumps(self.batcher.metrics(), indent=3))
+
+    def shutdown(self):
+
+        self.http_server.server_close()
+        self.batcher.close()
+
+    def predict(self, request: dict) -> dict:
+        """
+        :param request: A dict with the arrays of a request, see the format above
+        :return: A dict with the arrays of the response
+        """
+
+        img = request['img']
+        if img.dtype != np.uint8 or img.ndim not in (2, 3):
+            raise ValueError('img must be a (H X W X 3) or (H X W) uint8 array')
+        if img.ndim == 2:
+            img = np.repeat(img[:, :, None], 3, axis=2)
+        img = img[:, :, :3]
+
+        mask = request.get('mask')
+        if mask is not None:
+            if mask.shape[:2] != img.shape[:2]:
+                raise ValueError('The mask must have the size of the image')
+            mask = (mask[:, :, 0] if mask.ndim == 3 else mask) > 0
+
+        bbox = request.get('bbox')
+        if bbox is not None:
+            bbox = [float(c) for c in bbox.reshape(4)]
+
+        sample = crop_sample(img, mask, bbox, self.img_size, self.data_cfg.padding_frac)
+        uv, uv_3d = self.batcher(sample, self.config.get('request_timeout', None))
+
+        response = {'uv': encode_uv(uv, self.uv_dtype), 'mask': sample['mask'], 'bbox': sample['bbox']}
+        if uv_3d is not None:
+            response['uv_3d'] = uv_3d.astype(np.float16)
+
+        return response
+
+    def _batch_call(self, samples):
+        """
+        :param samples: A list of cropped samples
+        :return: A list of tuples (uv, uv_3d or None) for the samples
+        """
+
+        img = torch.from_numpy(np.stack([sample['img'] for sample in samples]))
+        mask = torch.from_numpy(np.stack([sample['mask'] for sample in samples]))
+
+        uv, uv_3d = predict(self.model, img, mask, self.device)
+
+        return [(uv[i], None if uv_3d is None else uv_3d[i]) for i in range(len(samples))]
+
+    def _warm_up(self):
+        """
+        Runs a batch of the maximum size before the first request, e.g. for the cudnn autotuning
+        """
+
+        sample = {'img': np.zeros((3, self.img_size, self.img_size), dtype=np.uint8),
+                  'mask': np.ones((self.img_size, self.img_size), dtype=np.uint8)}
+        self._batch_call([sample] * self.batcher.max_batch_size)
+
+
+class _HTTPServer(ThreadingHTTPServer):
+
+    # Backlog of the listening socket, the default of 5 refuses connections of many concurrent clients
+    request_queue_size = 128
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    # Keep-alive connections, every response has a Content-Length
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+
+        if self.path == '/metrics':
+            self._send(200, json.dumps(self.server.csm_server.batcher.metrics()).encode(), 'application/json')
+        elif self.path == '/health':
+            self._send(200, b'ok', 'text/plain')
+        else:
+            self._send(404, b'Unknown path %s' % self.path.encode(), 'text/plain')
+
+    def do_POST(self):
+
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length)
+
+        if self.path != '/predict':
+            self._send(404, b'Unknown path %s' % self.path.encode(), 'text/plain')
+            return
+
+        try:
+            request = decode_arrays(data)
+            if 'img' not in request:
+                raise ValueError('The request has no img')
+        except Exception as e:
+            # Not a npz file
+            self._send(400, str(e).encode(), 'text/plain')
+            return
+
+        try:
+            response = self.server.csm_server.predict(request)
+        except ValueError as e:
+            self._send(400, str(e).encode(), 'text/plain')
+        except queue.Full:
+            self._send(503, b'Too many waiting requests', 'text/plain')
+        except concurrent.futures.TimeoutError:
+            self._send(504, b'The request timed out', 'text/plain')
+        except Exception as e:
+            self._send(500, str(e).encode(), 'text/plain')
+        else:
+            self._send(200, encode_arrays(**response), 'application/octet-stream')
+
+    def _send(self, code, body: bytes, content_type):
+
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+
+        # The requests are summarized by the metrics instead
+        pass
@@ -7,12 +7,15 @@ from pytorch3d.renderer import OpenGLOrthographicCameras
 from src.data.cub_dataset import CubDataset
 from src.data.imnet_dataset import ImnetDataset
 from src.data.p3d_dataset import P3DDataset
+from src.data.utils.augmentation import BatchAugmentation
+from src.data.utils.image import img_to_float
 from src.estimators.trainer import ITrainer
 from src.model.csm import CSM
 from src.nnutils.color_transform import sample_uv_contour, draw_key_points
 from src.nnutils.geometry import get_gt_positions_grid, convert_3d_to_uv_coordinates
 from src.nnutils.losses import *
 from src.utils.config import ConfigParser
+from src.utils.summary import AsyncSummaryWriter
 from src.utils.utils import get_time
 
 
@@ -41,6 +44,9 @@ class CSMTrainer(ITrainer):
             batch_size: Batch size to be used in the dataloader
             shuffle: True or False. True if you want to shuffle the data during the training
             workers: Number of workers to be used for the data processing
+            log.async_summaries: True or False. True to compute and write the image summaries on a background
+                thread from cpu snapshots of the batch and the predictions. Default True
+            log.summary_queue_size: Maximum number of pending image summaries. Further summaries are dropped. Default 2
         :param device: Device to store the tensors. Default: cuda
         """
         self.device = torch.device(device)
@@ -60,11 +66,37 @@ class CSMTrainer(ITrainer):
                                      colors=template_mesh_colors)
         self.key_point_colors = np.random.uniform(0, 1, (len(self.dataset.kp_names), 3))
 
+        # The image summaries are computed on the cpu if they are written in the background
+        async_summaries = self.config.log.get('async_summaries', True) and self.rank == 0
+        self.summary_device = torch.device('cpu') if async_summaries else self.device
+        self.summary_texture_map = self.texture_map.to(self.summary_device)
+        self.async_summaries = AsyncSummaryWriter(self.config.log.get('summary_queue_size', 2), async_summaries)
+
         # Running losses to calculate mean loss per epoch for all types of losses
         self.running_loss = torch.tensor([0, 0, 0, 0, 0], dtype=torch.float32)
         if self.config.use_gt_cam:
             self.config.pose_warmup_epochs = 0
 
+        # Crop, scale and mirror the images on the device instead of the data loader workers
+        self.augmentation = None
+        if self.data_cfg.get('gpu_augment', False):
+            self.augmentation = BatchAugmentation(
+                self.data_cfg, self.dataset.kp_perm, self.dataset.kp_uv).to(self.device)
+
+    def train(self, **kwargs):
+
+        try:
+            super(CSMTrainer, self).train(**kwargs)
+        finally:
+            self.async_summaries.close()
+
+    def _prepare_batch(self, batch):
+
+        if self.augmentation is not None:
+            batch = self.augmentation(batch)
+
+        return batch
+
     def _calculate_loss(self, step, batch, epoch):
         """
         Calculates the total loss for the batch which is a combination of the
@@ -80,27 +112,36 @@ class CSMTrainer(ITrainer):
         img: The input image
         mask: The ground truth foreground mask
         sfm_pose: The ground truth camera pose
+        render_mask, render_depth: Optional precomputed renders of the template for the ground truth camera pose
         use_gt_cam_pos: True or False. False if you want to model to predict the camera poses as well.
 
         :return: The total loss calculated for the batch
         """
-        img = batch['img'].to(self.device, dtype=torch.float)
+        img = img_to_float(batch['img'], self.device)
         mask = batch['mask'].unsqueeze(1).to(self.device, dtype=torch.float)
         scale = batch['scale'].to(self.device, dtype=torch.float)
         trans = batch['trans'].to(self.device, dtype=torch.float)
         quat = batch['quat'].to(self.device, dtype=torch.float)
 
-        pred_out = self.model(img, mask, scale, trans, quat)
+        renders = None
+        if 'render_mask' in batch:
+            renders = (batch['render_mask'].to(self.device, dtype=torch.float),
+                       batch['render_depth'].to(self.device, dtype=torch.float))
+
+        pred_out = self.model(img, mask, scale, trans, quat, renders)
 
-        loss = self._calculate_loss_for_predictions(mask, pred_out, epoch < self.config.pose_warmup_epochs)
+        loss = self._calculate_loss_for_predictions(mask, pred_out, epoch < self.config.pose_warmup_epochs,
+                                                    self.rank == 0 and self._is_summary_step(step, epoch))
 
         return loss, pred_out
 
-    def _calculate_loss_for_predictions(self, mask: torch.tensor, pred_out: dict, pose_warmup: bool = False) -> torch.tensor:
+    def _calculate_loss_for_predictions(self, mask: torch.tensor, pred_out: dict, pose_warmup: bool = False,
+                                        loss_map: bool = False) -> torch.tensor:
         """Calculates the loss from the output
 
         :param mask: (B X 1 X H X W) foreground mask
         :param pred_out: A dictionary cotaining the output of the CSM model
+        :param loss_map: True to add the per pixel geometric loss to pred_out as 'geometric_map' for the summaries
         :return: The computed loss from the output for the batch
         """
 
@@ -116,24 +157,29 @@ class CSMTrainer(ITrainer):
             _, _, _, prob_coeffs = pred_out['pred_poses']
             prob_coeffs = torch.add(prob_coeffs, 0.1)
 
-        if self.config.loss.geometric > 0 and not pose_warmup:
-            loss[0] = self.config.loss.geometric * geometric_cycle_consistency_loss(
-                self.gt_2d_pos_grid, pred_positions, mask, coeffs=prob_coeffs)
-        
-        if self.config.loss.visibility > 0 and not pose_warmup:
-            loss[1] = self.config.loss.visibility * visibility_constraint_loss(
-                pred_depths, pred_z, mask, coeffs=prob_coeffs)
+        # The geometric, visibility and mask losses in a single pass over the camera poses
+        cycle_losses, geometric_map = fused_cycle_losses(
+            self.gt_2d_pos_grid, pred_positions, pred_z, pred_depths, mask,
+            pred_masks=None if self.config.use_gt_cam else pred_masks, coeffs=prob_coeffs,
+            geometric=self.config.loss.geometric > 0 and not pose_warmup,
+            visibility=self.config.loss.visibility > 0 and not pose_warmup,
+            reprojection=self.config.loss.mask > 0, return_map=loss_map)
+
+        loss[0] = self.config.loss.geometric * cycle_losses[0]
+        loss[1] = self.config.loss.visibility * cycle_losses[1]
+        if loss_map:
+            pred_out['geometric_map'] = geometric_map
 
         if not self.config.use_gt_cam:
             _, _, pred_quat, pred_prob = pred_out['pred_poses']
-            if self.config.loss.mask > 0: 
-                loss[2] = self.config.loss.mask * mask_reprojection_loss(mask, pred_masks, coeffs=prob_coeffs)
+            loss[2] = self.config.loss.mask * cycle_losses[2]
             if self.config.loss.diverse > 0 and not pose_warmup:
                 loss[3] = self.config.loss.diverse * diverse_loss(pred_prob)
             if self.config.loss.quat > 0 and not pose_warmup:
                 loss[4] = self.config.loss.quat * quaternion_regularization_loss(pred_quat)
 
-        self.running_loss = torch.add(self.running_loss, loss)
+        # Per batch, i.e. per micro-batch with accumulation_steps > 1. Detached to not keep the graphs
+        self.running_loss = torch.add(self.running_loss, loss.detach())
 
         return loss.sum()
 
@@ -143,7 +189,8 @@ class CSMTrainer(ITrainer):
             self._save_model(osp.join(self.checkpoint_dir,
                                       'model_%s_%d' % (get_time(), current_epoch)))
 	
-        self.running_loss = torch.true_divide(self.running_loss, total_steps)
+        # Mean over the batches of all the processes
+        self.running_loss = torch.true_divide(self._all_reduce(self.running_loss), total_steps * self.world_size)
 
         # Add loss summaries & reset the running losses
         self.summary_writer.add_scalar('loss/geometric', self.running_loss[0], current_epoch)
@@ -159,7 +206,9 @@ class CSMTrainer(ITrainer):
 
     def _batch_end_call(self, batch, loss, out, step, total_steps, epoch, total_epochs):
 
-        self._add_summaries(step, epoch, out, batch)
+        # Only rank 0 writes summaries
+        if self.rank == 0:
+            self._add_summaries(step, epoch, out, batch)
 
     def _load_dataset(self) -> torch.utils.data.Dataset:
         """
@@ -191,13 +240,16 @@ class CSMTrainer(ITrainer):
         """
 
         model = CSM(self.dataset.template_mesh, self.dataset.mean_shape, self.config.use_gt_cam, 
-                    self.config.num_cam_poses, self.config.use_sampled_cam).to(self.device)
+                    self.config.num_cam_poses, self.config.use_sampled_cam,
+                    self.config.get('uv_to_3d_mode', 'exact'),
+                    self.config.get('render')).to(self.device)
 
         return model
 
     def _add_summaries(self, step, epoch, out, batch):
         """
-        Adds image summaries to the summary writer
+        Adds image summaries to the summary writer. The training thread only snapshots the tensors,
+        the visualizations are computed and written by self.async_summaries
 
         :param step: Current optimization step number (Batch number)
         :param epoch: Current epoch
@@ -205,29 +257,38 @@ class CSMTrainer(ITrainer):
         :param batch: A dictionary containing the batched inputs to the model
         """
 
-        uv = out["uv"]
-        pred_z = out['pred_z']
-        pred_masks = out['pred_masks']
-        pred_depths = out['pred_depths']
-        pred_positions = out['pred_positions']
-        rotation = out["rotation"]
-        translation = out["translation"]
-
-        img = batch['img'].to(self.device, dtype=torch.float)
-        mask = batch['mask'].unsqueeze(1).to(self.device, dtype=torch.float)
+        if not self._is_summary_step(step, epoch):
+            return
 
         sum_step = int(step / self.config.log.image_summary_step)
 
-        if step % self.config.log.image_summary_step == 0 and epoch % self.config.log.image_epoch == 0:
-            
-            # self._add_kp_summaries(rotation, translation, batch, epoch, sum_step)
-            self._add_loss_vis(pred_positions, mask, epoch, sum_step)
-            self._add_input_vis(img, mask, epoch, sum_step)
-            self._add_pred_vis(uv, pred_z, pred_depths, pred_masks, img, mask, epoch, sum_step)
+        snapshot = {key: out[key].detach().to(self.summary_device, dtype=torch.float)
+                    for key in ['uv', 'pred_z', 'pred_masks', 'pred_depths', 'geometric_map']}
+        # Blocking copies, the snapshot is used by the background thread without synchronizing the device
+        img = batch['img'].detach().to(self.summary_device)
+        mask = batch['mask'].detach().unsqueeze(1).to(self.summary_device, dtype=torch.float)
+
+        self.async_summaries.submit(self._write_summaries, snapshot, img, mask, epoch, sum_step)
+
+    def _write_summaries(self, out, img, mask, epoch, sum_step):
+        """
+        Computes the visualizations of a snapshot from _add_summaries and adds them to the summary writer
+        """
+
+        img = img_to_float(img, img.device)
+
+        # self._add_kp_summaries(rotation, translation, batch, epoch, sum_step)
+        self._add_loss_vis(out['geometric_map'], epoch, sum_step)
+        self._add_input_vis(img, mask, epoch, sum_step)
+        self._add_pred_vis(out['uv'], out['pred_z'], out['pred_depths'], out['pred_masks'], img, mask, epoch, sum_step)
     
+    def _is_summary_step(self, step, epoch):
+
+        return step % self.config.log.image_summary_step == 0 and epoch % self.config.log.image_epoch == 0
+
     def _add_kp_summaries(self, rotation, translation, batch, epoch, sum_step):
 
-        img = batch['img'].to(self.device, dtype=torch.float)
+        img = img_to_float(batch['img'], self.device)
         camera = OpenGLOrthographicCameras(device=self.device, R=rotation.view(-1, 3, 3), T=translation.view(-1, 3))
 
         kps = batch['kp'].to(self.device, dtype=torch.float)
@@ -248,21 +309,20 @@ class CSMTrainer(ITrainer):
         # Draw key points by converting 3D kps to uv values and then back to 3D
         kp_uv = convert_3d_to_uv_coordinates(kp_3d)
         uv_flatten = kp_uv.view(-1, 2)
-        uv_3d = self.model.uv_to_3d(uv_flatten).view(1, -1, 3)
+        uv_3d = self._unwrap_model().uv_to_3d(uv_flatten).view(1, -1, 3)
         xyz = camera.transform_points(uv_3d)
         xy = (((xyz[:, :, :2] + 1) / 2) * 255).to(torch.int32)
         kp_xy = torch.cat((xy, kps[:, :, 2:]), dim=2)
         kp3d_to_uv_to_3d_to_image = draw_key_points(img, kp_xy, self.key_point_colors)
         self.summary_writer.add_images('%d/kp/kp3d_to_uv_to_3d_to_image' % epoch, kp3d_to_uv_to_3d_to_image, sum_step)
            
-    def _add_loss_vis(self, pred_positions, mask, epoch, sum_step):
+    def _add_loss_vis(self, loss_values, epoch, sum_step):
         """
         Add loss visualizations to the tensorboard summaries
+
+        :param loss_values: (B X CP X 1 X H X W) per pixel geometric loss from fused_cycle_losses
         """
 
-        loss_values = torch.mean(geometric_cycle_consistency_loss(
-            self.gt_2d_pos_grid, pred_positions, mask, reduction='none'), dim=2, keepdim=True)
-        
         loss_values = loss_values.view(-1, 1, loss_values.size(-2), loss_values.size(-2))
         loss_min, _ = loss_values.min(dim=0, keepdim=True)
         loss_max, _ = loss_values.max(dim=0, keepdim=True)
@@ -284,7 +344,7 @@ class CSMTrainer(ITrainer):
         Add predicted output (depth, uv, masks) visualizations to the tensorboard summaries
         """
 
-        uv_color, uv_blend = sample_uv_contour(img, uv.permute(0, 2, 3, 1), self.texture_map, mask)
+        uv_color, uv_blend = sample_uv_contour(img, uv.permute(0, 2, 3, 1), self.summary_texture_map, mask)
         self.summary_writer.add_images('%d/pred/uv_blend' % epoch, uv_blend, sum_step)
         self.summary_writer.add_images('%d/pred/uv' % epoch, uv_color * mask, sum_step)
         
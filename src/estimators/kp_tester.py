@@ -1,18 +1,24 @@
 import numpy as np
 import torch
+import torch.utils.data
+from torch.nn.utils.rnn import pad_sequence
+from tqdm import tqdm
 from pytorch3d.ops.cubify import unravel_index
 
 from src.data.cub_dataset import CubDataset
 from src.data.dataset import KPDataset
 from src.data.imnet_dataset import ImnetDataset
 from src.data.p3d_dataset import P3DDataset
+from src.data.utils.augmentation import BatchAugmentation
+from src.data.utils.image import img_to_float
 from src.estimators.tester import ITester
 from src.model.csm import CSM
 from src.model.unet import UNet
 from src.model.uv_to_3d import UVto3D
+from src.utils.cache import LRUCache
 from src.nnutils.color_transform import draw_key_points, sample_uv_contour
 from src.nnutils.metrics import calculate_correct_key_points
-from src.nnutils.geometry import convert_3d_to_uv_coordinates
+from src.nnutils.geometry import convert_3d_to_uv_coordinates, find_nearest_points
 from src.utils.config import ConfigParser
 from src.nnutils import pck
 
@@ -23,56 +29,154 @@ class KPTransferTester(ITester):
 
         self.device = device
         self.data_cfg = config.dataset
+        # Load and run the model on every image once and evaluate the pairs from the cached outputs
+        self.dedupe_pairs = config.test.get('dedupe_pairs', False)
+        self.sample_cache = None
+        self.cache_rows = {}
         super(KPTransferTester, self).__init__(config.test)
+
+        # LRU cache of the UV maps and 3D points of every image keyed by the dataset index.
+        # The crops of the train split are jittered on every load so that a cached
+        # UV map only matches the sample with dedupe_pairs
+        self.point_cache = None
+        cache_mb = self.config.get('point_cache_mb', 0)
+        if cache_mb > 0 and (self.dedupe_pairs or self.data_cfg.split != 'train'):
+            self.point_cache = LRUCache(cache_mb * 1024 ** 2)
+
         self.key_point_colors = np.random.uniform(0, 1, (len(self.dataset.kp_names), 3))
         self.num_kps = len(self.dataset.kp_names)
         self.kp_names = self.dataset.kp_names
 
         self.stats = {'kps1': [], 'kps2': [], 'transfer': [], 'kps_err': [], 'pair': [], }
+        self.dist_thresholds = [1e-4, 1e-3,0.25*1e-2, 0.5*1e-2, 0.75*1e-2, 1E-2, 1E-1, 0.2, 0.3, 0.4, 0.5, 0.6, 10]
+
+        # Accumulate the evaluation stats batch by batch instead of storing the stats of all the pairs
+        self.pck_stats = None
+        if self.config.get('stream_stats', False):
+            self.pck_stats = pck.PCKAccumulator(self.kp_names, self.data_cfg.img_size, self.dist_thresholds)
 
         self.acc = []
         for alpha in self.config.alpha:
             self.acc.append(torch.zeros([3]))
 
+        # Crop and scale the images on the device instead of the data loader workers
+        self.augmentation = None
+        if self.data_cfg.get('gpu_augment', False):
+            self.augmentation = BatchAugmentation(
+                self.data_cfg, self.dataset.kp_perm, self.dataset.kp_uv).to(self.device)
+
+    def _prepare_batch(self, batch_data):
+
+        # With dedupe_pairs the batches only contain the indices of the pairs
+        if self.augmentation is not None and not self.dedupe_pairs:
+            batch_data = tuple(self.augmentation(batch) for batch in batch_data)
+
+        return batch_data
+
+    def _test_start_call(self):
+
+        if self.dedupe_pairs:
+            self._build_sample_cache()
+
+    def _build_sample_cache(self):
+        """
+        Loads every image used in the pairs once and runs the model on it.
+        The samples and the predicted UV maps are stored on the cpu in self.sample_cache
+        and self.cache_rows maps the dataset index to the row in the cache.
+        """
+
+        indices = self.dataset.unique_indices()
+        data_loader = torch.utils.data.DataLoader(
+            torch.utils.data.Subset(self.dataset.dataset, indices), batch_size=self.config.batch_size,
+            shuffle=False, num_workers=self.config.workers, pin_memory=torch.cuda.is_available())
+
+        cache = {'img': [], 'mask': [], 'kp': [], 'inds': [], 'uv': []}
+        with torch.no_grad():
+            for batch in tqdm(data_loader, desc='Running the model on %d unique images' % len(indices)):
+
+                if self.augmentation is not None:
+                    batch = self.augmentation(batch)
+
+                pred_out = self._call_model(batch)
+
+                cache['img'].append(batch['img'].cpu())
+                cache['mask'].append(batch['mask'].cpu())
+                cache['kp'].append(batch['kp'].cpu())
+                cache['inds'].append(batch['inds'].cpu())
+                cache['uv'].append(pred_out['uv'].cpu())
+
+        self.sample_cache = {k: torch.cat(v) for k, v in cache.items()}
+        self.cache_rows = {index: row for row, index in enumerate(indices)}
+
+    def _get_cached_samples(self, indices):
+        """
+        :param indices: (B) tensor of dataset indices
+        :return: A tuple (batch, pred_out) for the indices from the sample cache
+        """
+
+        rows = torch.tensor([self.cache_rows[int(i)] for i in indices], dtype=torch.long)
+        batch = {k: v[rows] for k, v in self.sample_cache.items() if k != 'uv'}
+        pred_out = {'uv': self.sample_cache['uv'][rows].to(self.device)}
+
+        return batch, pred_out
+
     def _batch_call(self, step, batch_data):
 
-        batch1, batch2 = batch_data
+        if self.dedupe_pairs:
+            batch1, pred_out1 = self._get_cached_samples(batch_data[0])
+            batch2, pred_out2 = self._get_cached_samples(batch_data[1])
+        else:
+            batch1, batch2 = batch_data
+            pred_out1 = pred_out2 = None
+
+        transfer_kps12, error_kps12, transfer_kps21, error_kps21, kps1, kps2 = self._evaluate(
+            batch1, batch2, step, pred_out1, pred_out2)
 
-        transfer_kps12, error_kps12, transfer_kps21, error_kps21, kps1, kps2 = self._evaluate(batch1, batch2, step)
+        kp_mask = kps1[:, :, 2:] * kps2[:, :, 2:]
 
-        kp_mask = kps1[:, 2:] * kps2[:, 2:]
-        
-        kp_12 = torch.cat((transfer_kps12, kp_mask), dim=1)
-        kp_21 = torch.cat((transfer_kps21, kp_mask), dim=1)
+        kp_12 = torch.cat((transfer_kps12, kp_mask), dim=2)
+        kp_21 = torch.cat((transfer_kps21, kp_mask), dim=2)
+
+        img1 = img_to_float(batch1['img'], self.device)
+        img2 = img_to_float(batch2['img'], self.device)
 
-        img1 = batch1['img'].to(self.device, dtype=torch.float)
-        img2 = batch2['img'].to(self.device, dtype=torch.float)
-        
         self._add_kp_summaries(kps1, kps2, kp_12, kp_21, img1, img2, step)
 
-        self.stats['transfer'].append(self._to_numpy(transfer_kps12))
-        self.stats['kps_err'].append(self._to_numpy(error_kps12))
-        self.stats['kps1'].append(self._to_numpy(kps1))
-        self.stats['kps2'].append(self._to_numpy(kps2))
+        # Every pair adds the transfer 1 -> 2 followed by the transfer 2 -> 1
+        kps_err = self._to_numpy(self._interleave(error_kps12, error_kps21))
+        src_kps = self._to_numpy(self._interleave(kps1, kps2))
+        tar_kps = self._to_numpy(self._interleave(kps2, kps1))
 
-        self.stats['transfer'].append(self._to_numpy(transfer_kps21))
-        self.stats['kps_err'].append(self._to_numpy(error_kps21))
-        self.stats['kps1'].append(self._to_numpy(kps2))
-        self.stats['kps2'].append(self._to_numpy(kps1))
+        out = {}
+        if self.pck_stats is not None:
+            self.pck_stats.update(src_kps, tar_kps, kps_err)
+            out.update(self.pck_stats.summary())
+        else:
+            self.stats['transfer'].extend(self._to_numpy(self._interleave(transfer_kps12, transfer_kps21)))
+            self.stats['kps_err'].extend(kps_err)
+            self.stats['kps1'].extend(src_kps)
+            self.stats['kps2'].extend(tar_kps)
 
-        return {}
+        if self.point_cache is not None:
+            out['cache_hit_rate'] = self.point_cache.hit_rate
+
+        return out
 
     def _test_end_call(self):
 
         n_iter = len(self.dataset)
 
+        if self.pck_stats is not None:
+            self.pck_stats.run_evaluation(n_iter, self.out_dir)
+            return
+
         self.stats['kps1'] = np.stack(self.stats['kps1'])
         self.stats['kps2'] = np.stack(self.stats['kps2'])
         self.stats['transfer'] = np.stack(self.stats['transfer'])
         self.stats['kps_err'] = np.stack(self.stats['kps_err'])
 
-        dist_thresholds = [1e-4, 1e-3,0.25*1e-2, 0.5*1e-2, 0.75*1e-2, 1E-2, 1E-1, 0.2, 0.3, 0.4, 0.5, 0.6, 10]
-        pck.run_evaluation(self.stats, n_iter, self.out_dir, self.data_cfg.img_size, self.kp_names, dist_thresholds)
+        pck.run_evaluation(
+            self.stats, n_iter, self.out_dir, self.data_cfg.img_size, self.kp_names, self.dist_thresholds)
 
     def _calculate_acc(self, src_kp, tar_kp, tar_pred_kp, height, width):
 
@@ -90,7 +194,7 @@ class KPTransferTester(ITester):
         :return: Output from the model
         """
 
-        img = data['img'].to(self.device, dtype=torch.float)
+        img = img_to_float(data['img'], self.device)
         mask = data['mask'].unsqueeze(1).to(self.device, dtype=torch.float)
         scale = data['scale'].to(self.device, dtype=torch.float)
         trans = data['trans'].to(self.device, dtype=torch.float)
@@ -112,57 +216,138 @@ class KPTransferTester(ITester):
 
         return float_indices
 
-    def _evaluate(self, batch1, batch2, step):
+    def _evaluate(self, batch1, batch2, step, pred_out1=None, pred_out2=None):
 
         mask1 = batch1['mask'].unsqueeze(1).to(self.device, dtype=torch.float)
         mask2 = batch2['mask'].unsqueeze(1).to(self.device, dtype=torch.float)
 
-        pred_out1 = self._call_model(batch1)
-        pred_out2 = self._call_model(batch2)
-
-        uv1 = pred_out1['uv']
-        uv2 = pred_out2['uv']
+        points1, pred_out1 = self._get_image_points(batch1, mask1, pred_out1)
+        points2, pred_out2 = self._get_image_points(batch2, mask2, pred_out2)
 
         self._add_uv_summaries(pred_out1, pred_out2, batch1, batch2, step)
 
-        kps1 = self._convert_to_int_indices(batch1['kp'].to(self.device, dtype=torch.float)).view(-1 , 3).long()
-        kps2 = self._convert_to_int_indices(batch2['kp'].to(self.device, dtype=torch.float)).view(-1 , 3).long()
+        kps1 = self._convert_to_int_indices(batch1['kp'].to(self.device, dtype=torch.float)).long()
+        kps2 = self._convert_to_int_indices(batch2['kp'].to(self.device, dtype=torch.float)).long()
+
+        transfer_kps12, error_kps12 = self.map_kp_img1_to_img2(kps1, kps2, points1, points2)
+        transfer_kps21, error_kps21 = self.map_kp_img1_to_img2(kps2, kps1, points2, points1)
 
-        transfer_kps12, error_kps12 = self.map_kp_img1_to_img2(kps1, kps2, uv1, uv2, mask1, mask2)
-        transfer_kps21, error_kps21 = self.map_kp_img1_to_img2(kps2, kps1, uv2, uv1, mask2, mask1)
-        
         return transfer_kps12, error_kps12, transfer_kps21, error_kps21, kps1, kps2
 
+    def _get_image_points(self, batch, mask, pred_out=None):
+        """
+        Looks up the UV maps and 3D points of the images in the point cache. The model is called
+        only if an image of the batch is not cached or pred_out is not given.
+
+        :param batch: Batch data dictionary
+        :param mask: (B X 1 X H X W) masks of the images on the device
+        :param pred_out: Output of the model for the batch or None
+        :return: A tuple (points, pred_out). points is a list with a dict from _compute_image_points
+            for every image of the batch
+        """
+
+        indices = batch['inds'].view(-1).tolist()
+        if self.point_cache is not None:
+            points = [self.point_cache.get(index) for index in indices]
+        else:
+            points = [None] * len(indices)
+
+        if pred_out is None and all(p is not None for p in points):
+            pred_out = {'uv': torch.stack([p['uv'] for p in points])}
+        elif pred_out is None:
+            pred_out = self._call_model(batch)
+
+        for i, index in enumerate(indices):
+            if points[i] is None:
+                points[i] = self._compute_image_points(pred_out['uv'][i], mask[i, 0])
+                if self.point_cache is not None:
+                    self.point_cache.put(index, points[i])
+
+        return points, pred_out
+
+    def _compute_image_points(self, uv_map, mask):
+        """
+        :param uv_map: (2 X H X W) predicted UV map of an image
+        :param mask: (H X W) foreground mask of the image
+        :return: A dict with
+            uv - (2 X H X W) the UV map
+            fg_inds - (N) indices of the foreground pixels
+            fg_points - (N X 3) 3D points on the template for the foreground pixels
+            fg_penalty - (N) penalty of the foreground pixels for soft masks
+        """
+
+        mask = mask.reshape(-1)
+        fg_inds = torch.nonzero(mask > 0.5, as_tuple=False).squeeze(1)
+
+        # Search all the pixels if the image has no foreground
+        if len(fg_inds) == 0:
+            fg_inds = torch.arange(len(mask), device=mask.device)
+
+        with torch.no_grad():
+            fg_uv = uv_map.permute(1, 2, 0).reshape(-1, 2)[fg_inds]
+            fg_points = self.model.uv_to_3d(fg_uv).view(-1, 3)
+
+        return {
+            'uv': uv_map.detach(),
+            'fg_inds': fg_inds,
+            'fg_points': fg_points,
+            'fg_penalty': (1 - mask[fg_inds]) * 1000,
+        }
+
     def _to_numpy(self, tensor):
 
         return tensor.data.cpu().numpy()
 
-    def map_kp_img1_to_img2(self, kps1, kps2, uv_map1, uv_map2, mask1, mask2):
+    @staticmethod
+    def _interleave(tensor1, tensor2):
+        """
+        :param tensor1: A (B X ...) tensor
+        :param tensor2: A (B X ...) tensor
+        :return: A (2B X ...) tensor with the rows tensor1[0], tensor2[0], tensor1[1], tensor2[1], ...
+        """
 
-        kp_mask = kps1[:, 2] * kps2[:, 2]
-        kps1_vis = kps1[:, 2]
-        img_H = uv_map2.size(2)
-        img_W = uv_map2.size(3)
+        return torch.stack([tensor1, tensor2], dim=1).flatten(0, 1)
 
-        uv_map1 = uv_map1.reshape(-1, img_H, img_W).permute(1, 2, 0)
-        uv_map2 = uv_map2.reshape(-1, img_H, img_W).permute(1, 2, 0)
-        
-        kps1_uv = uv_map1[kps1[:, 1], kps1[:, 0], :]
+    def map_kp_img1_to_img2(self, kps1, kps2, points1, points2):
+        """
+        Transfers the key points of image 1 to the foreground pixels of image 2 with the closest 3D points
+
+        :param kps1: (B X KP X 3) integer key points of the images 1
+        :param kps2: (B X KP X 3) integer key points of the images 2
+        :param points1: A list with a dict from _compute_image_points for every image 1
+        :param points2: A list with a dict from _compute_image_points for every image 2
+        :return: A tuple (transfer_kps, error)
+            transfer_kps - (B X KP X 2) transferred key points on the images 2
+            error - (B X KP X 3) the transfer error, the common visibility and the 3D distance
+        """
+
+        batch_size = kps1.size(0)
+        img_W = points2[0]['uv'].size(2)
+
+        kp_mask = kps1[:, :, 2] * kps2[:, :, 2]
+        kps1_vis = kps1[:, :, 2]
 
-        kps1_3d = self.model.uv_to_3d(kps1_uv).view(1, 1, -1 ,3)
-        uv_points3d = self.model.uv_to_3d(uv_map2.reshape(-1, 2)).view(1, img_H, img_W, 3)
+        uv_map1 = torch.stack([p['uv'] for p in points1]).permute(0, 2, 3, 1)
+        batch_inds = torch.arange(batch_size, device=kps1.device).view(-1, 1)
+        kps1_uv = uv_map1[batch_inds, kps1[:, :, 1], kps1[:, :, 0], :]
 
-        distances3d = torch.sum((kps1_3d.view(-1, 1, 3) - uv_points3d.view(1, -1, 3))**2, -1).sqrt()
+        kps1_3d = self.model.uv_to_3d(kps1_uv.view(-1, 2)).view(batch_size, -1, 3)
+
+        # Only the foreground pixels of the images 2 are searched
+        fg_points = pad_sequence([p['fg_points'] for p in points2], batch_first=True)
+        fg_penalty = pad_sequence([p['fg_penalty'] for p in points2], batch_first=True)
+        fg_inds = pad_sequence([p['fg_inds'] for p in points2], batch_first=True)
+        lengths = torch.tensor([len(p['fg_inds']) for p in points2], device=kps1.device)
+
+        min_dist, min_indices = find_nearest_points(kps1_3d, fg_points, lengths, fg_penalty)
+        min_indices = torch.gather(fg_inds, 1, min_indices)
 
-        distances3d = distances3d + (1 - mask2.view(1, -1)) * 1000
-        distances = distances3d
-        min_dist, min_indices = torch.min(distances.view(len(kps1), -1), dim=1)
         min_dist = min_dist + (1 - kps1_vis).float() * 1000
-        transfer_kps = torch.stack([min_indices % img_W, min_indices // img_W], dim=1)
+        transfer_kps = torch.stack([min_indices % img_W, min_indices // img_W], dim=2)
 
-        kp_transfer_error = torch.norm((transfer_kps.float() - kps2[:, 0:2]), dim=1)
+        kp_transfer_error = torch.norm((transfer_kps.float() - kps2[:, :, 0:2]), dim=2)
 
-        return transfer_kps, torch.stack([kp_transfer_error, kp_mask.float(), min_dist], dim=1)
+        return transfer_kps, torch.stack([kp_transfer_error, kp_mask.float(), min_dist], dim=2)
 
     def _load_dataset(self) -> KPDataset:
 
@@ -173,7 +358,7 @@ class KPTransferTester(ITester):
         else:
             dataset = ImnetDataset(self.data_cfg, self.device)
 
-        return KPDataset(dataset, self.data_cfg.num_pairs)
+        return KPDataset(dataset, self.data_cfg.num_pairs, return_indices=self.dedupe_pairs)
 
     def _get_model(self) -> CSM:
 
@@ -181,7 +366,9 @@ class KPTransferTester(ITester):
                     self.dataset.mean_shape,
                     self.config.use_gt_cam,
                     self.config.num_cam_poses,
-                    self.config.use_sampled_cam).to(self.device)
+                    self.config.use_sampled_cam,
+                    self.config.get('uv_to_3d_mode', 'exact'),
+                    self.config.get('render')).to(self.device)
 
         return model
 
@@ -202,11 +389,6 @@ class KPTransferTester(ITester):
         if not self.config.add_summaries:
             return
 
-        kps1 = kps1.unsqueeze(0)
-        kps2 = kps2.unsqueeze(0)
-        pred_kp12 = pred_kp12.unsqueeze(0)
-        pred_kp21 = pred_kp21.unsqueeze(0)
-
         kp_img1 = draw_key_points(img1, kps1, self.key_point_colors)
         kp_img2 = draw_key_points(img2, kps2, self.key_point_colors)
         pred_kp_img1 = draw_key_points(img1, pred_kp21, self.key_point_colors)
@@ -227,12 +409,12 @@ class KPTransferTester(ITester):
         if not self.config.add_summaries:
             return
 
-        src_img = src['img'].to(self.device, dtype=torch.float)
+        src_img = img_to_float(src['img'], self.device)
         src_mask = src['mask'].unsqueeze(1).to(self.device, dtype=torch.float)
         src_uv = src_pred_out['uv']
         src_uv_color, src_uv_blend = sample_uv_contour(src_img, src_uv.permute(0, 2, 3, 1), self.dataset.texture_map, src_mask)
 
-        tar_img = tar['img'].to(self.device, dtype=torch.float)
+        tar_img = img_to_float(tar['img'], self.device)
         tar_mask = tar['mask'].unsqueeze(1).to(self.device, dtype=torch.float)
         tar_uv = tar_pred_out['uv']
         tar_uv_color, tar_uv_blend = sample_uv_contour(tar_img, tar_uv.permute(0, 2, 3, 1), self.dataset.texture_map, tar_mask)
@@ -6,6 +6,7 @@ from src.data.cub_dataset import CubDataset
 from src.data.dataset import KPDataset
 from src.data.imnet_dataset import ImnetDataset
 from src.data.p3d_dataset import P3DDataset
+from src.data.utils.image import img_to_float
 from src.estimators.tester import ITester
 from src.model.csm import CSM
 from src.model.unet import UNet
@@ -86,7 +87,7 @@ class KPTransferTester(ITester):
         :return: Output from the model
         """
 
-        img = data['img'].to(self.device, dtype=torch.float)
+        img = img_to_float(data['img'], self.device)
         mask = data['mask'].unsqueeze(1).to(self.device, dtype=torch.float)
         
         unet_output = self.model(img)
@@ -194,11 +195,11 @@ class KPTransferTester(ITester):
         if not self.config.add_summaries:
             return
 
-        src_img = src['img'].to(self.device, dtype=torch.float)
+        src_img = img_to_float(src['img'], self.device)
         src_mask = src['mask'].unsqueeze(1).to(self.device, dtype=torch.float)
         src_uv_color, src_uv_blend = sample_uv_contour(src_img, src_uv.permute(0, 2, 3, 1), self.dataset.texture_map, src_mask)
 
-        tar_img = tar['img'].to(self.device, dtype=torch.float)
+        tar_img = img_to_float(tar['img'], self.device)
         tar_mask = tar['mask'].unsqueeze(1).to(self.device, dtype=torch.float)
         tar_uv_color, tar_uv_blend = sample_uv_contour(tar_img, tar_uv.permute(0, 2, 3, 1), self.dataset.texture_map, tar_mask)
 
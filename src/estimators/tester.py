@@ -46,6 +46,7 @@ class ITester:
         for step, batch_data in enumerate(batch_bar):
 
             batch_bar.set_description('Testing %sth batch' % step)
+            batch_data = self._prepare_batch(batch_data)
             stats = self._batch_call(step, batch_data)
             batch_bar.set_postfix(stats)
 
@@ -69,7 +70,8 @@ class ITester:
 
         return torch.utils.data.DataLoader(
             self.dataset, batch_size=self.config.batch_size,
-            shuffle=self.config.shuffle, num_workers=self.config.workers)
+            shuffle=self.config.shuffle, num_workers=self.config.workers,
+            pin_memory=torch.cuda.is_available())
 
     def _test_start_call(self):
         """
@@ -86,6 +88,16 @@ class ITester:
 
         return {}
 
+    def _prepare_batch(self, batch_data):
+        """
+        This function is called for every batch before _batch_call.
+        Use this function to transform the batch on the device. Eg. batched augmentations
+        :param batch_data: Current batch data
+        :return: The transformed batch data
+        """
+
+        return batch_data
+
     def _batch_call(self, step, batch_data):
         """
         This function is called for every batch. Child class must implement the testing logic
@@ -1,8 +1,13 @@
+import contextlib
 import os.path as osp
+import time
 
 import torch
+import torch.distributed as dist
 import torch.utils.data
 from tqdm import tqdm
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data.distributed import DistributedSampler
 from torch.utils.tensorboard import SummaryWriter
 
 from src.data.dataset import IDataset
@@ -10,11 +15,25 @@ from src.utils.config import ConfigParser
 from src.utils.utils import get_date, get_time, create_dir_if_not_exists
 
 
+class NullSummaryWriter:
+    """
+    Summary writer of the processes other than rank 0 in the distributed training. Ignores all the summaries
+    """
+
+    def __getattr__(self, name):
+
+        return lambda *args, **kwargs: None
+
+
 class ITrainer:
     """
     An interface for any trainer which performs training using the given model and data
     Any trainers that inherits this class should implement the get_model, get_dataloader
     and calculate_loss functions for the trainer to work.
+
+    If torch.distributed is initialized (see src.scripts.train.start_train) the model is wrapped in a
+    DistributedDataParallel, every process trains on its part of the dataset and only rank 0 writes
+    the summaries and the checkpoints.
     """
 
     def __init__(self, config: ConfigParser.ConfigObject):
@@ -28,25 +47,70 @@ class ITrainer:
         optim.beta1: Beta1 value for the optimizer
         out_dir: Path to the directory where the summaries and the checkpoints should be stored
             the summaries are stored in out_dir/summaries/{date}/{timestamp}/.
+        accumulation_steps: Number of batches (micro-batches) whose gradients are accumulated for every
+            optimization step. The effective batch size is batch_size * accumulation_steps. Default 1
+        amp: True or False. True to compute the loss under autocast, float16 with gradient scaling
+            on cuda and bfloat16 on the cpu. Default False
+        debug: Optional instrumentation of the training, everything is off by default
+            debug.detect_anomaly: True to enable torch.autograd anomaly detection. Slows down the training severalfold
+            debug.profile: True to profile debug.profile_steps steps (default 5) after the first two steps
+                with torch.profiler. The trace is written to the summaries
+            debug.timing: True to add the data loading and the step time of every step to the summaries
+        distributed.find_unused_parameters: Passed to DistributedDataParallel. Default True since the
+            parts of the model which are used depend on the losses, e.g. during the pose warmup
         """
 
         self.config = config
 
+        self.distributed = dist.is_available() and dist.is_initialized()
+        self.rank = dist.get_rank() if self.distributed else 0
+        self.world_size = dist.get_world_size() if self.distributed else 1
+
         self.dataset = self._load_dataset()
         self.model = self._get_model()
         self._load_model(config.checkpoint)
 
+        self.model_device = next(self.model.parameters()).device
+        if self.distributed:
+            dist_cfg = config.get('distributed') or {}
+
+            # The buffers which are not in the state dict, e.g. the lookup tables of UVto3D, are constants built
+            # by every process. Only the other buffers such as the batch norm statistics need to be broadcast.
+            # The private helper of DistributedDataParallel was checked with torch 2.14. Without it all the
+            # buffers are broadcast, which is correct but slower
+            if hasattr(DistributedDataParallel, '_set_params_and_buffers_to_ignore_for_model'):
+                state_dict = self.model.state_dict()
+                DistributedDataParallel._set_params_and_buffers_to_ignore_for_model(
+                    self.model, [name for name, _ in self.model.named_buffers() if name not in state_dict])
+
+            self.model = DistributedDataParallel(
+                self.model, device_ids=[self.model_device] if self.model_device.type == 'cuda' else None,
+                find_unused_parameters=dist_cfg.get('find_unused_parameters', True))
+
+        # Mixed precision. The model is responsible to keep the precision sensitive parts in float32
+        self.amp = config.get('amp', False)
+        self.amp_device_type = self.model_device.type
+        self.amp_dtype = torch.float16 if self.amp_device_type == 'cuda' else torch.bfloat16
+        self.grad_scaler = torch.cuda.amp.GradScaler(enabled=self.amp and self.amp_device_type == 'cuda')
+
         self.data_loader = self._get_data_loader()
         self.optimizer = self._get_optimizer(config)
+        self.accumulation_steps = config.get('accumulation_steps', 1)
 
         time = get_time()
         date = get_date()
         self.summary_dir = osp.join(self.config.out_dir, date, time, 'summaries', 'train')
         self.checkpoint_dir = osp.join(self.config.out_dir, date, time, 'checkpoints')
-        create_dir_if_not_exists(self.checkpoint_dir)
 
-        self.summary_writer = SummaryWriter(self.summary_dir)
-        torch.autograd.set_detect_anomaly(True)
+        if self.rank == 0:
+            create_dir_if_not_exists(self.checkpoint_dir)
+            self.summary_writer = SummaryWriter(self.summary_dir)
+        else:
+            self.summary_writer = NullSummaryWriter()
+
+        self.debug = config.get('debug') or {}
+        if self.debug.get('detect_anomaly', False):
+            torch.autograd.set_detect_anomaly(True)
 
     def train(self, **kwargs):
         """
@@ -55,17 +119,30 @@ class ITrainer:
 
         self.config.update(kwargs)
 
-        epoch_bar = tqdm(range(self.config.epochs), position=0, dynamic_ncols=True)
+        with self._get_profiler() as profiler:
+            self._train_epochs(profiler)
+
+    def _train_epochs(self, profiler):
+
+        timing = self.debug.get('timing', False)
+
+        epoch_bar = tqdm(range(self.config.epochs), position=0, dynamic_ncols=True, disable=self.rank != 0)
         for epoch in epoch_bar:
 
             epoch_bar.set_description('Running %sth epoch' % epoch)
             running_loss = 0
             self._epoch_start_call(epoch, self.config.epochs)
 
-            batch_bar = tqdm(self.data_loader, position=1, leave=False, dynamic_ncols=True)
+            if isinstance(self.data_loader.sampler, DistributedSampler):
+                self.data_loader.sampler.set_epoch(epoch)
+
+            batch_bar = tqdm(self.data_loader, position=1, leave=False, dynamic_ncols=True, disable=self.rank != 0)
+            step_end = time.perf_counter()
             for step, batch in enumerate(batch_bar):
 
+                step_start = time.perf_counter()
                 batch_bar.set_description('Training with %sth batch' % step)
+                batch = self._prepare_batch(batch)
                 self._batch_start_call(batch, step, len(self.data_loader), epoch, self.config.epochs)
                 
                 loss, out = self._train_step(step, batch, epoch)
@@ -74,8 +151,19 @@ class ITrainer:
                 self._batch_end_call(batch, loss, out, step, len(self.data_loader),
                                      epoch, self.config.epochs)
                 batch_bar.set_postfix_str('loss %f' % loss)
+
+                if profiler is not None:
+                    profiler.step()
+
+                # loss.item() above has synchronized the device
+                now = time.perf_counter()
+                if timing:
+                    global_step = epoch * len(self.data_loader) + step
+                    self.summary_writer.add_scalar('time/data', step_start - step_end, global_step)
+                    self.summary_writer.add_scalar('time/step', now - step_start, global_step)
+                step_end = now
             
-            epoch_loss = running_loss / len(self.data_loader)
+            epoch_loss = self._all_reduce(torch.tensor(running_loss)).item() / (len(self.data_loader) * self.world_size)
             epoch_bar.set_postfix_str('%dth epoch loss %f' % (epoch, epoch_loss))
             self.summary_writer.add_scalar('loss/train', epoch_loss, epoch)
             
@@ -84,19 +172,57 @@ class ITrainer:
     def _train_step(self, step, batch, epoch) -> (torch.Tensor, None):
         """
         Optimization step for each batch of data
-        Calculating the loss and perform gradient optimization for the batch
+        Calculating the loss and perform gradient optimization for the batch.
+        With accumulation_steps > 1 the gradients of accumulation_steps consecutive batches are
+        averaged and the optimizer steps after the last batch of every group
 
         :param batch: Batch data from the dataloader
         :return: The loss for the batch
         """
 
-        self.model.zero_grad()
-        loss, out = self._calculate_loss(step, batch, epoch)
-        loss.backward()
-        self.optimizer.step()
+        total_steps = len(self.data_loader)
+        group_start = step - step % self.accumulation_steps
+        group_size = min(self.accumulation_steps, total_steps - group_start)
+
+        last_in_group = step == group_start + group_size - 1
+
+        if step == group_start:
+            self.model.zero_grad()
+
+        # The gradients are only synchronized between the processes for the last batch of the group
+        sync = contextlib.nullcontext() if last_in_group or not self.distributed else self.model.no_sync()
+
+        with sync:
+            with torch.autocast(self.amp_device_type, dtype=self.amp_dtype, enabled=self.amp):
+                loss, out = self._calculate_loss(step, batch, epoch)
+
+            # The scaler is a no-op without amp on cuda. The gradients are the mean over the group
+            self.grad_scaler.scale(loss / group_size).backward()
+
+        if last_in_group:
+            self.grad_scaler.step(self.optimizer)
+            self.grad_scaler.update()
 
         return loss, out
 
+    def _get_profiler(self):
+        """
+        :return: A torch.profiler.profile context for debug.profile or a context returning None
+        """
+
+        if not self.debug.get('profile', False):
+            return contextlib.nullcontext()
+
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.amp_device_type == 'cuda':
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+        return torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(wait=1, warmup=1, active=self.debug.get('profile_steps', 5), repeat=1),
+            on_trace_ready=torch.profiler.tensorboard_trace_handler(osp.join(self.summary_dir, 'profile')),
+            record_shapes=True)
+
     def _save_model(self, path):
         """
         Saves the model at the path provided
@@ -104,8 +230,8 @@ class ITrainer:
         :param path: Path where the model weights should be stored
         """
 
-        if path is not None and path != '':
-            torch.save(self.model.state_dict(), path)
+        if path is not None and path != '' and self.rank == 0:
+            torch.save(self._unwrap_model().state_dict(), path)
 
     def _load_model(self, path):
         """
@@ -115,9 +241,32 @@ class ITrainer:
         """
 
         if path is not None and path != '' and osp.exists(path):
-            self.model.load_state_dict(torch.load(path))
+            device = next(self.model.parameters()).device
+            self.model.load_state_dict(torch.load(path, map_location=device))
             print('Loaded model weights from %s' % path)
 
+    def _unwrap_model(self) -> torch.nn.Module:
+        """
+        :return: The model without the DistributedDataParallel wrapper
+        """
+
+        return self.model.module if isinstance(self.model, DistributedDataParallel) else self.model
+
+    def _all_reduce(self, tensor: torch.Tensor) -> torch.Tensor:
+        """
+        :param tensor: A tensor with the same shape on all the processes
+        :return: The sum of the tensor over all the processes, on the device of the tensor
+        """
+
+        if not self.distributed:
+            return tensor
+
+        # nccl only reduces cuda tensors
+        reduced = tensor.detach().to(self.model_device, dtype=torch.float)
+        dist.all_reduce(reduced)
+
+        return reduced.to(tensor.device)
+
     def _get_optimizer(self, config):
         """
         Returns the optimizer to be used for the training
@@ -138,12 +287,18 @@ class ITrainer:
 
     def _get_data_loader(self) -> torch.utils.data.DataLoader:
         """
-        Creates a torch.utils.data.DataLoader from the dataset
+        Creates a torch.utils.data.DataLoader from the dataset.
+        In the distributed training every process loads batch_size samples of its part of the dataset
         """
 
+        sampler = None
+        if self.distributed:
+            sampler = DistributedSampler(self.dataset, shuffle=self.config.shuffle)
+
         return torch.utils.data.DataLoader(
             self.dataset, batch_size=self.config.batch_size,
-            shuffle=self.config.shuffle, num_workers=self.config.workers)
+            shuffle=self.config.shuffle and sampler is None, sampler=sampler, num_workers=self.config.workers,
+            pin_memory=torch.cuda.is_available())
 
     def _load_dataset(self) -> IDataset:
         """
@@ -170,6 +325,17 @@ class ITrainer:
 
         return NotImplementedError
 
+    def _prepare_batch(self, batch):
+        """
+        This function is called for each batch before it is used for the optimization.
+        Use this function to transform the batch on the device. Eg. batched augmentations
+
+        :param batch: Batch data from the dataloader
+        :return: The transformed batch
+        """
+
+        return batch
+
     def _batch_start_call(self, batch, step, total_steps, epoch, total_epochs):
         """
         This function will be called before each optimizin the model for the batch
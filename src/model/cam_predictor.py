@@ -137,18 +137,20 @@ class MultiCameraPredictor(nn.Module):
         """
         # make camera pose predictions
         pred_pose = [cpp(x, as_vec=True) for cpp in self.cam_preds]
-        pred_pose = torch.stack(pred_pose, dim=1)
+        pred_pose = torch.stack(pred_pose, dim=1).float()
 
-        # apply softmax to probabilities
-        prob_logits = pred_pose[..., 7]
-        probs = F.softmax(prob_logits, dim=1)
+        # The probabilities and the quaternions are computed in float32 also under autocast
+        with torch.autocast(x.device.type, enabled=False):
+            # apply softmax to probabilities
+            prob_logits = pred_pose[..., 7]
+            probs = F.softmax(prob_logits, dim=1)
 
-        quats = pred_pose[..., 3:7]
+            quats = pred_pose[..., 3:7]
 
-        bias_quats = self.cam_biases.unsqueeze(0).repeat(quats.size(0), 1, 1)
-        new_quats = quaternion_multiply(quats, bias_quats)
-        pred_pose_new = torch.cat(
-            (pred_pose[..., :3], new_quats, probs.unsqueeze(-1)), dim=-1)
+            bias_quats = self.cam_biases.unsqueeze(0).repeat(quats.size(0), 1, 1)
+            new_quats = quaternion_multiply(quats, bias_quats)
+            pred_pose_new = torch.cat(
+                (pred_pose[..., :3], new_quats, probs.unsqueeze(-1)), dim=-1)
 
         # taken from the original repo
         dist = torch.distributions.multinomial.Multinomial(probs=probs)
@@ -192,7 +194,6 @@ def get_encoder(trainable=False):
     resnet = torch.hub.load(
         'pytorch/vision:v0.6.0', 'resnet18', pretrained=True)
     encoder = nn.Sequential(*([*resnet.children()][:-1]))
-    if not trainable:
-        for param in encoder.parameters():
-            param.requires_grad = True
+    for param in encoder.parameters():
+        param.requires_grad = trainable
     return encoder
@@ -1,6 +1,5 @@
 import torch
 from pytorch3d.structures import Meshes
-from pytorch3d.renderer import OpenGLOrthographicCameras
 
 from src.model.cam_predictor import CameraPredictor, MultiCameraPredictor
 from src.model.unet import UNet
@@ -27,7 +26,7 @@ class CSM(torch.nn.Module):
 
     def __init__(self, template_mesh: Meshes, mean_shape: dict,
                  use_gt_cam: bool = False, num_cam_poses: int = 8, 
-                 use_sampled_cam=False):
+                 use_sampled_cam=False, uv_to_3d_mode='exact', render_settings=None):
         """
         :param template_mesh: A pytorch3d.structures.Meshes object which will used for
         rendering depth and mask for a given camera pose
@@ -43,22 +42,31 @@ class CSM(torch.nn.Module):
         :use_sampled_cam: True of False. True if you want the output from the camera pose sampled according 
             to the probabilities. False if you want output for all the predicted camera poses. 
             Should be used in with use_gt_cam=False
+        :param uv_to_3d_mode: Mode of UVto3D. One of UVto3D.modes
+        :param render_settings: Optional dict with the rasterization settings of the 'mask' and the 'depth'
+            pass of the renderer. See MaskAndDepthRenderer. If 'hard' is True (default) and use_gt_cam is True,
+            the masks and depths are rasterized without the soft shader and without gradients since the
+            ground truth camera poses and the template are fixed
         :param device: Device to store the tensor. Default: cuda
         """
         super(CSM, self).__init__()
 
         self.unet = UNet(4, 3, num_downs=5)
-        self.uv_to_3d = UVto3D(mean_shape)
-        self.renderer = MaskAndDepthRenderer(meshes=template_mesh)
+        self.uv_to_3d = UVto3D(mean_shape, uv_to_3d_mode)
+        render_settings = render_settings or {}
+        self.renderer = MaskAndDepthRenderer(meshes=template_mesh,
+                                             mask_settings=render_settings.get('mask'),
+                                             depth_settings=render_settings.get('depth'))
 
         self.use_gt_cam = use_gt_cam
         self.use_sampled_cam = use_sampled_cam
+        self.hard_render = use_gt_cam and render_settings.get('hard', True)
 
         if not self.use_gt_cam:
             self.multi_cam_pred = MultiCameraPredictor(num_hypotheses=num_cam_poses,device=template_mesh.device)
 
     def forward(self, img: torch.Tensor, mask: torch.Tensor,
-                scale: torch.Tensor, trans: torch.Tensor, quat: torch.Tensor):
+                scale: torch.Tensor, trans: torch.Tensor, quat: torch.Tensor, renders=None):
         """
         For the given img and mask
         - uses the unet to predict sphere coordinates
@@ -68,12 +76,16 @@ class CSM(torch.nn.Module):
         - perform scaled orthographic projection onto the 3D points to
             project them back to image plane
         - use the renderer to render pred_depth and mask for the predicted/gt camera poses
+            (or use the precomputed renders for the gt camera poses)
 
         :param img: A (B X 3 X H X W) tensor of input image
         :param mask: A (B X 1 X H X W) tensor of input image
         :param scale: A (B X 1) tensor of input image
         :param trans: A (B X 2) tensor of translations (tx, ty)
         :param quat: A (B X 3) tensor of quaternions
+        :param renders: Optional tuple (masks, depths) of (B X H X W) tensors with the precomputed renders
+            of the template for the gt camera poses (see src.data.utils.pack.render_pack).
+            Only used if use_gt_cam is True
         :return: A dictionary containing following values
             - pred_positions: A (B X CP X 2 X H X W) tensor containing predicted position of each pixel
                 after transforming them to 3D and then projecting back to image plane
@@ -88,22 +100,30 @@ class CSM(torch.nn.Module):
         """
 
         sphere_points = self.unet(torch.cat((img, mask), 1))
-        sphere_points = torch.tanh(sphere_points)
-        sphere_points = torch.nn.functional.normalize(sphere_points, dim=1)
 
         rotation, translation, pred_poses = self._get_camera_extrinsics(img, scale, trans, quat)
 
-        # Project the sphere points onto the template and project them back to image plane
-        pred_pos, pred_z, uv, uv_3d = self._get_projected_positions_of_sphere_points(
-            sphere_points, rotation, translation)
+        # Under autocast only the unet and the camera predictor run in reduced precision.
+        # The UV values, the 3D points, the projections and the renders are computed in float32
+        with torch.autocast(img.device.type, enabled=False):
+            sphere_points = torch.tanh(sphere_points.float())
+            sphere_points = torch.nn.functional.normalize(sphere_points, dim=1)
 
-        # Render depth and mask of the template for the cam pose
-        pred_mask, pred_depth = self._render(rotation, translation)
+            # Project the sphere points onto the template and project them back to image plane
+            pred_pos, pred_z, uv, uv_3d = self._get_projected_positions_of_sphere_points(
+                sphere_points, rotation, translation)
+
+            # Render depth and mask of the template for the cam pose
+            if self.use_gt_cam and renders is not None:
+                pred_mask, pred_depth = self._get_precomputed_renders(*renders)
+            else:
+                pred_mask, pred_depth = self._render(rotation, translation)
+                pred_mask, pred_depth = torch.flip(pred_mask, (-1, -2)), torch.flip(pred_depth, (-1, -2))
 
         out = {
             "pred_positions": pred_pos,
-            "pred_depths": torch.flip(pred_depth, (-1, -2)),
-            "pred_masks": torch.flip(pred_mask, (-1, -2)),
+            "pred_depths": pred_depth,
+            "pred_masks": pred_mask,
             "pred_z": pred_z,
             "rotation": rotation,
             "translation": translation,
@@ -120,14 +140,16 @@ class CSM(torch.nn.Module):
 
         batch_size = img.size(0)
         pred_poses = None
-        
-        if self.use_gt_cam:
-            rotation, translation = get_scaled_orthographic_projection(
-                scale, trans, quat, True)
-        else:
+
+        if not self.use_gt_cam:
             cam_pred, sample_idx, pred_poses = self.multi_cam_pred(img)
-            
-            if self.use_sampled_cam:
+
+        # The projections are computed in float32 also under autocast
+        with torch.autocast(img.device.type, enabled=False):
+            if self.use_gt_cam:
+                rotation, translation = get_scaled_orthographic_projection(
+                    scale, trans, quat, True)
+            elif self.use_sampled_cam:
                 pred_scale, pred_trans, pred_quat, _ = cam_pred
                 rotation, translation = get_scaled_orthographic_projection(
                     pred_scale, pred_trans, pred_quat)
@@ -169,17 +191,18 @@ class CSM(torch.nn.Module):
 
         uv_flatten = uv.view(-1, 2)
         uv_3d = self.uv_to_3d(uv_flatten).view(batch_size, 1, -1, 3)
-        uv_3d = uv_3d.repeat(1, num_poses, 1, 1).view(batch_size*num_poses, -1, 3)
 
-        cameras = OpenGLOrthographicCameras(device=sphere_points.device, R=rotation.view(-1, 3, 3), T=translation.view(-1, 3))
-        xyz_cam = cameras.get_world_to_view_transform().transform_points(uv_3d)
-        z = xyz_cam[:, :, 2:].view(batch_size, num_poses, height, width, 1)
-        xy = cameras.transform_points(uv_3d)[:, :, :2].view(batch_size, num_poses, height, width, 2)
+        # Pytorch3d cameras use row vectors, i.e. view = X * R + T. The points of every image are
+        # broadcast against the CP camera poses. With the default OpenGLOrthographicCameras the
+        # projected x, y (NDC) are the x, y in the view space
+        xyz_cam = torch.matmul(uv_3d, rotation) + translation.unsqueeze(2)
+        z = xyz_cam[:, :, :, 2:].view(batch_size, num_poses, height, width, 1)
+        xy = xyz_cam[:, :, :, :2].view(batch_size, num_poses, height, width, 2)
 
         xy = xy.permute(0, 1, 4, 2, 3).flip(2)
         z = z.permute(0, 1, 4, 2, 3)
         uv = uv.permute(0, 3, 1, 2)
-        uv_3d = uv_3d.view(batch_size, num_poses, height, width, 3)[:, 0, :, :, :].squeeze()
+        uv_3d = uv_3d.view(batch_size, height, width, 3).squeeze()
 
         return xy, z, uv, uv_3d
 
@@ -188,9 +211,15 @@ class CSM(torch.nn.Module):
         batch_size = rotation.size(0)
         cam_poses = rotation.size(1)
 
-        pred_mask, pred_depth = self.renderer(
-            rotation.view(-1, 3, 3),
-            translation.view(-1, 3))
+        if self.hard_render:
+            with torch.no_grad():
+                pred_mask, pred_depth = self.renderer.render_hard(
+                    rotation.view(-1, 3, 3),
+                    translation.view(-1, 3))
+        else:
+            pred_mask, pred_depth = self.renderer(
+                rotation.view(-1, 3, 3),
+                translation.view(-1, 3))
 
         height = pred_mask.size(1)
         width = pred_mask.size(2)
@@ -198,8 +227,23 @@ class CSM(torch.nn.Module):
         pred_mask = pred_mask.view(batch_size, cam_poses, 1, height, width)
         pred_depth = pred_depth.view(batch_size, cam_poses, 1, height, width)
 
+        return pred_mask, self._fill_empty_depths(pred_mask, pred_depth)
+
+    def _get_precomputed_renders(self, masks: torch.Tensor, depths: torch.Tensor) -> (torch.Tensor, torch.Tensor):
+        """
+        :param masks: (B X H X W) precomputed masks
+        :param depths: (B X H X W) precomputed depths
+        :return: A tuple (pred_mask, pred_depth) of (B X 1 X 1 X H X W) tensors like _render
+        """
+
+        pred_mask = masks.unsqueeze(1).unsqueeze(1)
+        pred_depth = depths.unsqueeze(1).unsqueeze(1)
+
+        return pred_mask, self._fill_empty_depths(pred_mask, pred_depth)
+
+    @staticmethod
+    def _fill_empty_depths(pred_mask: torch.Tensor, pred_depth: torch.Tensor) -> torch.Tensor:
+
         # Pytorch renderer returns -1 values for the empty pixels which
         # when directly used results in wrong loss calculation so changing the values to the max + 1
-        pred_depth = pred_depth * torch.ceil(pred_mask) + (1 - torch.ceil(pred_mask)) * pred_depth.max()
-
-        return pred_mask, pred_depth
+        return pred_depth * torch.ceil(pred_mask) + (1 - torch.ceil(pred_mask)) * pred_depth.max()
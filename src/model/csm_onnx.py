@@ -0,0 +1,84 @@
+import inspect
+
+import numpy as np
+import torch
+
+from src.model.csm_predictor import CSMPredictor
+
+
+def export_onnx(predictor: CSMPredictor, path, img_size, opset_version=16):
+    """
+    Exports the UNet -> tanh -> normalize -> convert_3d_to_uv_coordinates graph of the predictor,
+    and the UVto3D lookup if predictor.return_3d is True, to ONNX. The indexing of the UVto3D tables
+    is exported as Gather ops on the flattened tables, which are stored as initializers of the graph.
+    The batch size of the graph is dynamic, the image size is fixed.
+
+    :param predictor: A CSMPredictor, e.g. with the weights of a CSM checkpoint
+    :param path: Path of the onnx file
+    :param img_size: A tuple (H, W) with the size of the images
+    :param opset_version: ONNX opset. The bilinear UVto3D mode needs GridSample, i.e. opset >= 16
+    """
+
+    device = next(predictor.parameters()).device
+    img = torch.rand(1, 3, *img_size, device=device)
+    mask = torch.ones(1, 1, *img_size, device=device)
+
+    output_names = ['uv', 'uv_3d'] if predictor.return_3d else ['uv']
+    dynamic_axes = {name: {0: 'batch'} for name in ['img', 'mask'] + output_names}
+
+    # The TorchScript based exporter. Newer pytorch versions default to the dynamo exporter
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        kwargs['dynamo'] = False
+
+    with torch.no_grad():
+        torch.onnx.export(predictor.eval(), (img, mask), path, input_names=['img', 'mask'],
+                          output_names=output_names, dynamic_axes=dynamic_axes,
+                          opset_version=opset_version, **kwargs)
+
+
+class ONNXPredictor:
+    """
+    Runs a CSMPredictor exported by export_onnx with the CPU execution provider of onnxruntime.
+    Takes and returns numpy arrays with the shapes of CSMPredictor
+    """
+
+    def __init__(self, path, num_threads=0):
+        """
+        :param path: Path of the onnx file
+        :param num_threads: Number of threads used within the operators. 0 lets onnxruntime decide
+        """
+
+        # Optional dependency, see the onnx extra in pyproject.toml
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.output_names = [output.name for output in self.session.get_outputs()]
+        self.return_3d = 'uv_3d' in self.output_names
+
+    def __call__(self, img, mask):
+        """
+        :param img: A (B X 3 X H X W) float array or tensor with the image (0-1)
+        :param mask: A (B X 1 X H X W) float array or tensor with the foreground mask
+        :return: A (B X 2 X H X W) array with the UV values, or a tuple (uv, uv_3d) with a
+            (B X H X W X 3) array of the 3D points if the graph was exported with return_3d
+        """
+
+        inputs = {'img': self._to_numpy(img), 'mask': self._to_numpy(mask)}
+        outputs = self.session.run(self.output_names, inputs)
+
+        return tuple(outputs) if self.return_3d else outputs[0]
+
+    @staticmethod
+    def _to_numpy(array):
+
+        if isinstance(array, torch.Tensor):
+            array = array.detach().cpu().numpy()
+
+        return np.ascontiguousarray(array, dtype=np.float32)
@@ -0,0 +1,78 @@
+import torch
+
+from src.model.unet import UNet
+from src.model.uv_to_3d import UVto3D
+from src.nnutils.geometry import convert_3d_to_uv_coordinates
+
+
+class CSMPredictor(torch.nn.Module):
+    """
+    Inference only part of CSM which predicts the UV values (and optionally their 3D points on the template)
+    for an image and its foreground mask. Unlike CSM it has no cameras, no renderer and no data dependent
+    python branches and returns tensors instead of a dict, so that it can be exported with torch.jit.trace
+    or compiled with torch.compile. The outputs have static shapes for a given input shape.
+
+    The names of the parameters are the ones of CSM, i.e. it loads the unet and the uv_to_3d weights
+    of a CSM checkpoint with load_csm_state_dict.
+
+    B - batch size
+    H - height of the image
+    W - with of the image
+    """
+
+    def __init__(self, mean_shape: dict, uv_to_3d_mode='exact', return_3d=False):
+        """
+        :param mean_shape: The mean shape dictionary used by UVto3D (see src.nnutils.geometry.load_mean_shape)
+        :param uv_to_3d_mode: Mode of UVto3D. One of UVto3D.modes
+        :param return_3d: True to also return the 3D points of the UV values on the mean shape
+        """
+
+        super(CSMPredictor, self).__init__()
+
+        self.unet = UNet(4, 3, num_downs=5)
+        self.uv_to_3d = UVto3D(mean_shape, uv_to_3d_mode)
+        self.return_3d = return_3d
+
+    def forward(self, img: torch.Tensor, mask: torch.Tensor):
+        """
+        :param img: A (B X 3 X H X W) float tensor with the image (0-1)
+        :param mask: A (B X 1 X H X W) float tensor with the foreground mask
+        :return: A (B X 2 X H X W) tensor with the UV values, or a tuple (uv, uv_3d) with a
+            (B X H X W X 3) tensor of the 3D points if return_3d is True
+        """
+
+        sphere_points = self.unet(torch.cat((img, mask), 1))
+        sphere_points = torch.nn.functional.normalize(torch.tanh(sphere_points), dim=1)
+
+        uv = convert_3d_to_uv_coordinates(sphere_points.permute(0, 2, 3, 1))
+
+        if not self.return_3d:
+            return uv.permute(0, 3, 1, 2)
+
+        uv_3d = self.uv_to_3d(uv.reshape(-1, 2)).view(uv.size(0), uv.size(1), uv.size(2), 3)
+
+        return uv.permute(0, 3, 1, 2), uv_3d
+
+    def load_csm_state_dict(self, state_dict: dict):
+        """
+        Loads the unet and the uv_to_3d weights from the state dict of a CSM
+
+        :param state_dict: The state dict of a CSM, e.g. a checkpoint saved by CSMTrainer
+        """
+
+        state_dict = {key: value for key, value in state_dict.items() if key.split('.')[0] in ['unet', 'uv_to_3d']}
+        self.load_state_dict(state_dict)
+
+    def trace(self, img_size, batch_size=1):
+        """
+        :param img_size: A tuple (H, W) with the size of the images
+        :param batch_size: The batch size of the example inputs. The traced module works for other batch sizes
+        :return: A torch.jit.ScriptModule of the predictor in the eval mode traced with random inputs
+        """
+
+        device = next(self.parameters()).device
+        img = torch.rand(batch_size, 3, *img_size, device=device)
+        mask = torch.ones(batch_size, 1, *img_size, device=device)
+
+        with torch.no_grad():
+            return torch.jit.trace(self.eval(), (img, mask))
@@ -1,16 +1,26 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
-from src.nnutils.geometry import compute_barycentric_coordinates
+from src.nnutils.geometry import compute_barycentric_coordinates, convert_uv_to_3d
 
 
 class UVto3D(nn.Module):
 
     """
     Module to calculate 3D points from UV values
+
+    The mode selects how the points are calculated
+    - exact: barycentric coordinates from the areas of the sub triangles on the sphere
+    - planar: barycentric coordinates of the sphere point projected onto the plane of the face,
+        a single 3 X 3 product with the precomputed inverse of the face's sphere vertices
+    - bilinear: bilinear interpolation of the precomputed 3D points of the uv_map grid
+    - nearest: the precomputed 3D point of the closest uv_map grid cell. Has no gradients w.r.t. the UV values
     """
 
-    def __init__(self, mean_shape):
+    modes = ('exact', 'planar', 'bilinear', 'nearest')
+
+    def __init__(self, mean_shape, mode='exact'):
 
         """
         :param mean_shape: is a dictionary containing the following parameters
@@ -22,20 +32,41 @@ class UVto3D(nn.Module):
         Eg. if uv_map[25, 75] is (0.2, 0.6) then face_inds[25, 75]
         stores the index of the face which corresponds to UV values (0.2, 0.6)
         - uv_verts: A None, 2 tensor of UV values of the vertices of the mean shape
+        - bary_cord: A R X R X 3 tensor of barycentric coordinates of the uv_map values
+        w.r.t the faces in face_inds. Used by the bilinear and nearest modes
+        :param mode: One of UVto3D.modes
         """
 
+        if mode not in self.modes:
+            raise ValueError('Unknown mode %s. Should be one of %s' % (mode, self.modes))
+
         super(UVto3D, self).__init__()
 
-        self.face_inds = mean_shape['face_inds']
-        self.verts_uv = mean_shape['uv_verts']
-        self.verts_3d = mean_shape['verts']
-        self.faces = mean_shape['faces']
+        # Buffers move with the module but are not part of the state dict, i.e. the checkpoints are unchanged
+        self.register_buffer('face_inds', mean_shape['face_inds'], persistent=False)
+        self.register_buffer('verts_uv', mean_shape['uv_verts'], persistent=False)
+        self.register_buffer('verts_3d', mean_shape['verts'], persistent=False)
+        self.register_buffer('faces', mean_shape['faces'], persistent=False)
 
         self.uv_res = mean_shape['uv_map'].shape
         self.uv_map_size = torch.nn.Parameter(torch.tensor(
             [self.uv_res[1] - 1, self.uv_res[0] - 1], dtype=torch.float32).view(1, 2), 
             requires_grad=False)
 
+        self.mode = mode
+
+        if mode == 'planar':
+            # Packed per face tensor (F X 3 X 6). The first 3 columns are the inverse of the matrix
+            # with the sphere coordinates of the vertices as columns, the last 3 the 3D vertices
+            sphere_verts = convert_uv_to_3d(self.verts_uv[self.faces]).transpose(1, 2)
+            self.register_buffer('face_pack', torch.cat([torch.inverse(sphere_verts), self.verts_3d[self.faces]], dim=2),
+                                 persistent=False)
+        elif mode in ['bilinear', 'nearest']:
+            # A R X R X 3 table with the 3D points of the uv_map grid
+            face_verts = self.verts_3d[self.faces[self.face_inds]]
+            self.register_buffer('grid_points', torch.sum(face_verts * mean_shape['bary_cord'][:, :, :, None], dim=2),
+                                 persistent=False)
+
     def forward(self, uv: torch.Tensor) -> torch.Tensor:
 
         """
@@ -50,6 +81,13 @@ class UVto3D(nn.Module):
         :return: A [B, 3] tensor with the 3D coordinates fot the corresponding UV values
         """
 
+        if self.mode == 'planar':
+            return self._planar(uv)
+        elif self.mode == 'bilinear':
+            return self._bilinear(uv)
+        elif self.mode == 'nearest':
+            return self._nearest(uv)
+
         # Find the closest UV value as per the UV resolution in 'uv_map'
         uv_inds = (self.uv_map_size * uv).round().long().detach()
 
@@ -77,3 +115,29 @@ class UVto3D(nn.Module):
 
         return points3d
 
+    def _planar(self, uv: torch.Tensor) -> torch.Tensor:
+
+        uv_inds = (self.uv_map_size * uv).round().long().detach()
+        face_pack = self.face_pack[self.face_inds[uv_inds[:, 1], uv_inds[:, 0]]]
+
+        # Solve point = [A B C] * bary_cord and normalize it to sum up to 1. This is the
+        # barycentric coordinate of the point projected onto the plane of the face
+        bary_cord = torch.bmm(face_pack[:, :, :3], convert_uv_to_3d(uv).unsqueeze(2)).squeeze(2)
+        bary_cord = bary_cord / bary_cord.sum(1, keepdim=True)
+
+        return torch.bmm(bary_cord.unsqueeze(1), face_pack[:, :, 3:]).squeeze(1)
+
+    def _bilinear(self, uv: torch.Tensor) -> torch.Tensor:
+
+        # The rows of the grid are along V and the columns along U
+        grid = (2 * uv - 1).view(1, 1, -1, 2)
+        points3d = F.grid_sample(self.grid_points.permute(2, 0, 1).unsqueeze(0), grid,
+                                 mode='bilinear', padding_mode='border', align_corners=True)
+
+        return points3d.view(3, -1).t()
+
+    def _nearest(self, uv: torch.Tensor) -> torch.Tensor:
+
+        uv_inds = (self.uv_map_size * uv).round().long().detach()
+
+        return self.grid_points[uv_inds[:, 1], uv_inds[:, 0]]
@@ -129,6 +129,48 @@ def compute_barycentric_coordinates(uv_vertices, uv_points):
     return barycentric_coordinates
 
 
+def find_nearest_points(queries, points, lengths=None, penalty=None, chunk_size=4096):
+    """
+    Batched top-1 search of the closest point for every query. The distances are computed
+    with torch.cdist over chunks of the points so that the memory stays bounded by B X Q X chunk_size.
+    Ties are resolved to the lowest point index.
+
+    :param queries: [B, Q, 3] tensor with the query points
+    :param points: [B, N, 3] tensor with the points to be searched, padded to the same length N
+    :param lengths: [B] tensor with the number of valid points of every batch element. Default all N.
+        The queries of batch elements without any point get an infinite distance
+    :param penalty: [B, N] tensor added to the distances of the points
+    :param chunk_size: Number of points for which the distances are computed at once
+    :return: A tuple (distances, indices) of [B, Q] tensors with the distance to and
+        index of the closest point for every query
+    """
+
+    batch_size, num_points = points.shape[:2]
+
+    min_dist = queries.new_full(queries.shape[:2], float('inf'))
+    min_inds = torch.zeros(queries.shape[:2], dtype=torch.long, device=queries.device)
+
+    for start in range(0, num_points, chunk_size):
+        end = min(start + chunk_size, num_points)
+
+        dist = torch.cdist(queries, points[:, start:end], compute_mode='donot_use_mm_for_euclid_dist')
+
+        if penalty is not None:
+            dist = dist + penalty[:, None, start:end]
+        if lengths is not None:
+            padded = torch.arange(start, end, device=points.device).view(1, -1) >= lengths.view(-1, 1)
+            dist = dist.masked_fill(padded.unsqueeze(1), float('inf'))
+
+        chunk_dist, chunk_inds = torch.min(dist, dim=2)
+
+        # Strictly smaller so that the first of equally close points is kept
+        closer = chunk_dist < min_dist
+        min_dist = torch.where(closer, chunk_dist, min_dist)
+        min_inds = torch.where(closer, chunk_inds + start, min_inds)
+
+    return min_dist, min_inds
+
+
 def get_gt_positions_grid(img_size):
     """
     Generates a positions grid W X H X 2 which contains the indices in the grid
@@ -97,6 +97,132 @@ def mask_reprojection_loss(mask, pred_masks, coeffs=None, reduction='mean'):
         return loss
 
 
+class _FusedCycleLosses(torch.autograd.Function):
+    """
+    Geometric cycle consistency, visibility and mask re-projection loss computed one camera hypothesis at a time.
+    The backward recomputes the gradients from the inputs so that no (B X CP X C X H X W) intermediate is saved.
+    See fused_cycle_losses
+    """
+
+    @staticmethod
+    def forward(ctx, gt_2d_pos_grid, pred_positions, pred_z, pred_depths, pred_masks, mask, coeffs,
+                terms, return_map):
+
+        batch_size, num_poses = pred_positions.shape[:2]
+        geometric, visibility, reprojection = terms
+
+        mask_sq = mask * mask
+        sums = pred_positions.new_zeros(batch_size, num_poses, 3)
+        loss_map = pred_positions.new_empty(batch_size, num_poses, 1, *mask.shape[-2:]) if return_map else None
+
+        for cp in range(num_poses):
+            if geometric or return_map:
+                diff = torch.sub(pred_positions[:, cp], gt_2d_pos_grid[:, 0]).square_().mul_(mask_sq)
+                sums[:, cp, 0] = diff.sum((1, 2, 3))
+                if return_map:
+                    loss_map[:, cp] = diff.mean(1, keepdim=True)
+            if visibility:
+                diff = torch.sub(pred_z[:, cp], pred_depths[:, cp]).clamp_(min=0).square_().mul_(mask)
+                sums[:, cp, 1] = diff.sum((1, 2, 3))
+            if reprojection:
+                diff = torch.sub(mask, pred_masks[:, cp]).square_()
+                sums[:, cp, 2] = diff.sum((1, 2, 3))
+
+        # The mean over all the elements of the broadcast (B X CP X C X H X W) loss tensors
+        numel = batch_size * num_poses * mask.size(-2) * mask.size(-1)
+        norms = sums.new_tensor([2 * numel, numel, numel])
+
+        weighted = sums if coeffs is None else sums * coeffs.unsqueeze(-1)
+        losses = weighted.sum((0, 1)) / norms
+        losses = losses * sums.new_tensor(terms, dtype=torch.float)
+
+        ctx.terms = terms
+        ctx.has_coeffs = coeffs is not None
+        ctx.save_for_backward(gt_2d_pos_grid, pred_positions, pred_z, pred_depths, pred_masks, mask,
+                              coeffs, sums, norms)
+        ctx.mark_non_differentiable(*([loss_map] if return_map else []))
+
+        return losses, loss_map
+
+    @staticmethod
+    @torch.autograd.function.once_differentiable
+    def backward(ctx, grad_losses, grad_map):
+
+        gt_2d_pos_grid, pred_positions, pred_z, pred_depths, pred_masks, mask, coeffs, sums, norms = ctx.saved_tensors
+        geometric, visibility, reprojection = ctx.terms
+        batch_size, num_poses = pred_positions.shape[:2]
+        needs_grad = ctx.needs_input_grad
+
+        scales = grad_losses * grad_losses.new_tensor(ctx.terms, dtype=torch.float) / norms
+        if coeffs is None:
+            coeffs = sums.new_ones(batch_size, num_poses)
+
+        grad_positions = torch.zeros_like(pred_positions) if needs_grad[1] else None
+        grad_z = torch.zeros_like(pred_z) if needs_grad[2] else None
+        grad_depths = torch.zeros_like(pred_depths) if needs_grad[3] else None
+        grad_masks = torch.zeros_like(pred_masks) if needs_grad[4] else None
+
+        mask_sq = mask * mask
+        for cp in range(num_poses):
+            weights = coeffs[:, cp].view(-1, 1, 1, 1) * 2
+
+            if geometric and grad_positions is not None:
+                grad_positions[:, cp] = torch.sub(
+                    pred_positions[:, cp], gt_2d_pos_grid[:, 0]).mul_(mask_sq).mul_(weights * scales[0])
+
+            if visibility and (grad_z is not None or grad_depths is not None):
+                grad = torch.sub(pred_z[:, cp], pred_depths[:, cp]).clamp_(min=0).mul_(mask).mul_(weights * scales[1])
+                if grad_z is not None:
+                    grad_z[:, cp] = grad
+                if grad_depths is not None:
+                    grad_depths[:, cp] = -grad
+
+            if reprojection and grad_masks is not None:
+                grad_masks[:, cp] = torch.sub(pred_masks[:, cp], mask).mul_(weights * scales[2])
+
+        grad_coeffs = None
+        if ctx.has_coeffs and needs_grad[6]:
+            grad_coeffs = (sums * scales).sum(-1)
+
+        return None, grad_positions, grad_z, grad_depths, grad_masks, None, grad_coeffs, None, None
+
+
+def fused_cycle_losses(gt_2d_pos_grid, pred_positions, pred_z, pred_depths, mask, pred_masks=None, coeffs=None,
+                       geometric=True, visibility=True, reprojection=True, return_map=False):
+    """
+    Calculates geometric_cycle_consistency_loss, visibility_constraint_loss and mask_reprojection_loss
+    (with reduction='mean') in a single pass over the camera hypotheses. Unlike the separate functions
+    the masked copies and the per-term temporaries are only allocated for one hypothesis at a time and
+    nothing but the inputs is kept for the backward pass.
+
+    :param gt_2d_pos_grid: (1 X 1 X 2 X H X W) The ground truth positions with values between -1 to 1
+    :param pred_positions: (B X CP X 2 X H X W) The predicted 2D positions in camera frame
+    :param pred_z: (B X CP X 1 X H X W) Z values for the predicted positions in camera frame
+    :param pred_depths: (B X CP X 1 X H X W) or (B X 1 X 1 X H X W) Depths rendered for the camera poses
+    :param mask: (B X 1 X H X W) The ground truth foreground mask
+    :param pred_masks: (B X CP X 1 X H X W) Masks rendered for the camera poses. Only used for the reprojection loss
+    :param coeffs: (B X CP) coefficients for the camera poses. If None all the coefficients are set to 1
+    :param geometric, visibility, reprojection: False to skip the respective loss, it is returned as 0
+    :param return_map: True to also return the per pixel geometric loss without the coefficients,
+        i.e. the mean over the channels of geometric_cycle_consistency_loss(..., reduction='none')
+    :return: A tuple (losses, loss_map)
+        losses - A (3) tensor with the geometric, visibility and reprojection losses
+        loss_map - A (B X CP X 1 X H X W) tensor if return_map else None
+    """
+
+    pred_depths = pred_depths.expand_as(pred_z)
+    if pred_masks is None:
+        reprojection = False
+        pred_masks = pred_z.new_empty(0)
+    else:
+        pred_masks = pred_masks.expand_as(pred_z)
+
+    terms = (bool(geometric), bool(visibility), bool(reprojection))
+
+    return _FusedCycleLosses.apply(gt_2d_pos_grid, pred_positions, pred_z, pred_depths, pred_masks, mask,
+                                   coeffs, terms, return_map)
+
+
 def quaternion_regularization_loss(quats: torch.tensor):
     """
     A regularization loss for the quaternions. Only if number of camera poses per batch is > 1
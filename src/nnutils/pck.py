@@ -16,8 +16,8 @@ def inst_bench_evaluate(pred_labels, gt_labels , scores, ):
     count = 100
     score_max = scores.max()
     score_min = scores.min()
-    score_intervals = np.array(list(range(0,count))).astype(np.float)*(score_max-score_min)/100.0 + score_min
-    score_ins  = np.linspace(1, len(scores)-1,100).astype(np.int)
+    score_intervals = np.array(list(range(0,count))).astype(float)*(score_max-score_min)/100.0 + score_min
+    score_ins  = np.linspace(1, len(scores)-1,100).astype(int)
     # pdb.set_trace()
     scores_sort = scores.copy()
     scores_sort.sort()
@@ -158,77 +158,49 @@ def benchmark_vis_instances(intervals, dist_thresholds, kpnames, bench_stats, im
     stats['eval_params'] ={}
     stats['pck'] ={}
     stats['interval'] = intervals
-    bench_stats_kps_error = 1*bench_stats['kps_err']
-    bench_stats_kps_error[:,:,0] = bench_stats_kps_error[:,:,0]/img_size
-    ndata_points, nkps, _ = bench_stats['kps_err'].shape
-    
+
+    # N x KP transfer errors, common visibility and 3D distances
+    kps_error = bench_stats['kps_err'][:, :, 0] / img_size
+    common = bench_stats['kps_err'][:, :, 1] > 0.5
+    dist = bench_stats['kps_err'][:, :, 2]
+
     kps_vis1 =  bench_stats['kps1'][:,:,2] > 0.5 
     kps_vis2 =  bench_stats['kps2'][:,:,2] > 0.5
+    # Key points visible only in the source image
+    src_only = kps_vis1 & ~kps_vis2
     stats['eval_params']['total'] = np.sum(kps_vis1, axis=0) + 1E-10
+
+    ck = kps_error[:, :, None] < np.asarray(intervals)  ## N x KP x len(intervals)
     for dx, dist_thresh in enumerate(dist_thresholds):
         stats['eval_params'][dx] = {}
-        stats['eval_params'][dx]['correct'] = np.zeros((len(kpnames),len(intervals)))
-        for kpx, kp_name in enumerate(kpnames):
-            valid_inds = np.where(bench_stats_kps_error[:,kpx,2] < dist_thresh)[0].tolist()
-            common_inds = np.where(bench_stats_kps_error[:, kpx, 1] > 0.5)[0].tolist()
-            valid_inds = set(valid_inds)
-            common_inds = set(common_inds)
-            ck = ck_at_interval(intervals, bench_stats_kps_error[:,kpx,0])
-            ck = np.stack(ck, axis=1)
-            ex = np.array(list(common_inds & valid_inds))
-            if len(ex) > 0:
-                stats['eval_params'][dx]['correct'][kpx] += np.sum(ck[ex,:], axis=0)
-
-            kps_vis1_ind = np.where(kps_vis1[:,kpx])[0]
-            kps_vis2_ind = np.where(kps_vis2[:,kpx])[0]
-            ex = np.array(list(set(kps_vis1_ind) - set(kps_vis2_ind))).astype(np.int)
-            if len(ex) > 0:
-                stats['eval_params'][dx]['correct'][kpx] += np.sum(bench_stats_kps_error[ex,kpx,2] > dist_thresh)
+        valid = common & (dist < dist_thresh)
+        correct = np.sum(ck & valid[:, :, None], axis=0).astype(np.float64)
+        correct += np.sum(src_only & (dist > dist_thresh), axis=0)[:, None]
+        stats['eval_params'][dx]['correct'] = correct
         stats['eval_params'][dx]['acc'] =  stats['eval_params'][dx]['correct'] / stats['eval_params']['total'].reshape(-1,1)
     return stats
 
 
 def collate_all_instances(intervals, kp_names , bench_stats, img_size):
-    bench_stats_kps_error  = bench_stats['kps_err']*1
-    bench_stats_kps_error[:,:,0] = bench_stats_kps_error[:,:,0]/img_size
-    prediction_error = []  # N x 1
-    prediction_score = []  # N x 1 
-    prediction_label = []  # N x len(intervals)
-    gt_label = []
+    kps_error = bench_stats['kps_err'][:, :, 0] / img_size
+    common = bench_stats['kps_err'][:, :, 1] > 0.5
+    dist = bench_stats['kps_err'][:, :, 2]
 
     kps_vis1 =  bench_stats['kps1'][:,:,2] > 0.5 
     kps_vis2 =  bench_stats['kps2'][:,:,2] > 0.5
+    src_only = kps_vis1 & ~kps_vis2
 
-    for kpx, kp_name in enumerate(kp_names):
-        common_inds = np.where(bench_stats_kps_error[:, kpx, 1] > 0.5)[0].tolist()
-        ck = ck_at_interval(intervals, bench_stats_kps_error[:,kpx,0])
-        ck = np.stack(ck, axis=1)
-        ex = np.array(list(common_inds))
-        if len(ex) > 0:
-            prediction_error.append(bench_stats_kps_error[ex,kpx,0])
-            prediction_score.append(bench_stats_kps_error[ex,kpx,2])
-            prediction_label.append(ck[ex,:]*1)
-            gt_label.append(ck[ex,:]*0 + 1)
-
-        kps_vis1_ind = np.where(kps_vis1[:,kpx])[0]
-        kps_vis2_ind = np.where(kps_vis2[:,kpx])[0]
-        ex = np.array(list(set(kps_vis1_ind) - set(kps_vis2_ind))).astype(np.int)
-        if len(ex) > 0:
-            prediction_error.append(bench_stats_kps_error[ex,kpx,0])
-            prediction_score.append(bench_stats_kps_error[ex,kpx,2])
-            prediction_label.append(ck[ex,:]*0)
-            gt_label.append(ck[ex,:]*0)
+    # The rows are ordered by key point, then the common key points before
+    # the ones visible only in the source image, then by instance
+    kpx, group, ex = np.nonzero(np.stack([common, src_only]).transpose(2, 0, 1))
+    positive = (group == 0)[:, None]
 
-    
-    prediction_error = np.concatenate(prediction_error,axis=0)
-    prediction_score = np.concatenate(prediction_score, axis=0)
-    prediction_label = np.concatenate(prediction_label, axis=0)
-    gt_label = np.concatenate(gt_label, axis=0)
+    ck = kps_error[ex, kpx][:, None] < np.asarray(intervals)
 
     stats = {}
-    stats['pred_label'] = prediction_label
-    stats['gt_label'] = gt_label
-    stats['score'] = prediction_score ## lower the score better it is.
+    stats['pred_label'] = (ck & positive) * 1  # N x len(intervals)
+    stats['gt_label'] = np.repeat(positive, len(intervals), axis=1) * 1
+    stats['score'] = dist[ex, kpx] ## lower the score better it is.
     return stats
 
 
@@ -238,10 +210,7 @@ import json
 kp_eval_thresholds = [0.07, 0.1, 0.13]
 # kp_eval_thresholds = [0.05, 1.0]
 
-def run_evaluation(bench_stats, n_iter, results_dir, img_size, kp_names, dist_thresholds ):
-    json_file = osp.join(results_dir, 'stats_m1_{}.json'.format(n_iter))
-    stats_m1 = benchmark_all_instances_2(kp_eval_thresholds, kp_names, bench_stats, img_size)
-    stats = stats_m1
+def print_instance_stats(stats, kp_names):
     print(' Method 1 | Keypoint | Median Err | Mean Err | STD Err')
     pprint.pprint(zip(stats['kp_names'], stats['median_kp_err'], stats['mean_kp_err'], stats['std_kp_err']))
     print('PCK Values')
@@ -261,14 +230,9 @@ def run_evaluation(bench_stats, n_iter, results_dir, img_size, kp_names, dist_th
     print('Instance Average **** ')
     pprint.pprint(stats['eval_params']['acc'])
     print('########################## ')
-    
-    with open(json_file, 'w') as f:
-        json.dump(stats, f)
 
-    stats_m1 = benchmark_vis_instances(
-        kp_eval_thresholds, dist_thresholds, kp_names, bench_stats, img_size)
-    stats = stats_m1
 
+def print_vis_stats(stats, kp_names, dist_thresholds):
     mean_pck = {}
     # points_per_kp = {k: v for k, v in zip(kp_names, stats['eval_params'][0]['npoints'])}
     # points_per_thresh = np.sum(np.array(points_per_kp.values()))
@@ -287,9 +251,269 @@ def run_evaluation(bench_stats, n_iter, results_dir, img_size, kp_names, dist_th
     pprint.pprint(mean_pck)
     # pprint.pprint(points_per_kp)
 
+
+def run_evaluation(bench_stats, n_iter, results_dir, img_size, kp_names, dist_thresholds ):
+    json_file = osp.join(results_dir, 'stats_m1_{}.json'.format(n_iter))
+    stats_m1 = benchmark_all_instances_2(kp_eval_thresholds, kp_names, bench_stats, img_size)
+    stats = stats_m1
+    print_instance_stats(stats, kp_names)
+    
+    with open(json_file, 'w') as f:
+        json.dump(stats, f)
+
+    stats_m1 = benchmark_vis_instances(
+        kp_eval_thresholds, dist_thresholds, kp_names, bench_stats, img_size)
+    stats = stats_m1
+    print_vis_stats(stats, kp_names, dist_thresholds)
+
     stats = collate_all_instances(kp_eval_thresholds, kp_names, bench_stats, img_size)
     pr_stats = inst_bench_evaluate(stats['pred_label'], stats['gt_label'], stats['score'])
     pr_mat_file = osp.join(results_dir, 'pr_{}.mat'.format(n_iter))
 
     sio.savemat(pr_mat_file, pr_stats)
     return stats_m1
+
+
+class PCKAccumulator:
+    """
+    Accumulates the stats of run_evaluation batch by batch with constant memory.
+
+    The PCK values, the mean and std errors and the counts of benchmark_vis_instances are exact.
+    The median errors and the precision/recall of inst_bench_evaluate are interpolated from
+    fixed size histograms of the errors and the scores. Accumulators can be merged with merge.
+    """
+
+    def __init__(self, kp_names, img_size, dist_thresholds, intervals=None,
+                 num_bins=2000, max_error=2.0, max_score=4.0):
+        """
+        :param kp_names: Names of the key points
+        :param img_size: Size of the images. The transfer errors are normalized with it
+        :param dist_thresholds: Thresholds of the 3D distances for benchmark_vis_instances
+        :param intervals: PCK thresholds. Default kp_eval_thresholds
+        :param num_bins: Number of bins of the histograms
+        :param max_error: Upper limit of the normalized error histogram. Larger errors go to an overflow bin
+        :param max_score: Upper limit of the score histogram. Larger scores go to an overflow bin
+        """
+
+        self.kp_names = kp_names
+        self.img_size = img_size
+        self.dist_thresholds = np.asarray(dist_thresholds)
+        self.intervals = np.asarray(kp_eval_thresholds if intervals is None else intervals)
+        self.plot_intervals = np.asarray([0.025*i for i in range(40)])
+        self.num_bins = num_bins
+        self.error_edges = np.linspace(0, max_error, num_bins + 1)
+        self.score_edges = np.linspace(0, max_score, num_bins + 1)
+
+        nkps = len(kp_names)
+        nintervals = len(self.intervals)
+        self.counts = {
+            # benchmark_all_instances_2
+            'valid': np.zeros(nkps),
+            'err_sum': np.zeros(nkps),
+            'err_sq_sum': np.zeros(nkps),
+            'err_hist': np.zeros((nkps, num_bins + 1)),
+            'pck': np.zeros((nkps, nintervals)),
+            'pck_plot': np.zeros((nkps, len(self.plot_intervals))),
+            # benchmark_vis_instances
+            'vis_total': np.zeros(nkps),
+            'vis_correct': np.zeros((len(self.dist_thresholds), nkps, nintervals)),
+            # collate_all_instances and inst_bench_evaluate
+            'score_hist': np.zeros(num_bins + 1),
+            'score_tp': np.zeros((num_bins + 1, nintervals)),
+            'positives': np.zeros(1),
+        }
+
+    @staticmethod
+    def _bin(values, edges):
+        return np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 1)
+
+    def update(self, kps1, kps2, kps_err):
+        """
+        :param kps1: (N X KP X 3) source key points with the visibility in the last column
+        :param kps2: (N X KP X 3) target key points with the visibility in the last column
+        :param kps_err: (N X KP X 3) transfer errors, common visibility and 3D distances
+        """
+
+        c = self.counts
+
+        kps_error = kps_err[:, :, 0] / self.img_size
+        common = kps_err[:, :, 1] > 0.5
+        dist = kps_err[:, :, 2]
+
+        kps_vis1 = kps1[:, :, 2] > 0.5
+        kps_vis2 = kps2[:, :, 2] > 0.5
+        src_only = kps_vis1 & ~kps_vis2
+
+        ck = kps_error[:, :, None] < self.intervals
+
+        valid = common & ~np.isnan(kps_error)
+        error = np.where(valid, kps_error, 0)
+        c['valid'] += np.sum(valid, axis=0)
+        c['err_sum'] += np.sum(error, axis=0)
+        c['err_sq_sum'] += np.sum(error ** 2, axis=0)
+        c['pck'] += np.sum(ck & valid[:, :, None], axis=0)
+        c['pck_plot'] += np.sum((kps_error[:, :, None] < self.plot_intervals) & valid[:, :, None], axis=0)
+
+        kpx = np.nonzero(valid)[1]
+        bins = kpx * (self.num_bins + 1) + self._bin(kps_error[valid], self.error_edges)
+        c['err_hist'] += np.bincount(bins, minlength=c['err_hist'].size).reshape(c['err_hist'].shape)
+
+        c['vis_total'] += np.sum(kps_vis1, axis=0)
+        for dx, dist_thresh in enumerate(self.dist_thresholds):
+            c['vis_correct'][dx] += np.sum(ck & (common & (dist < dist_thresh))[:, :, None], axis=0)
+            c['vis_correct'][dx] += np.sum(src_only & (dist > dist_thresh), axis=0)[:, None]
+
+        rows = common | src_only
+        bins = self._bin(dist[rows], self.score_edges)
+        labels = (ck & common[:, :, None])[rows]
+        c['score_hist'] += np.bincount(bins, minlength=self.num_bins + 1)
+        for i in range(len(self.intervals)):
+            c['score_tp'][:, i] += np.bincount(bins, weights=labels[:, i], minlength=self.num_bins + 1)
+        c['positives'] += np.sum(common)
+
+    def merge(self, other):
+        """
+        Adds the counts of another accumulator with the same parameters
+        """
+
+        for k, v in other.counts.items():
+            self.counts[k] += v
+
+    def _hist_median(self, hist, total):
+        """
+        :return: The median interpolated from a histogram of the errors with total values
+        """
+
+        if total == 0:
+            return np.nan
+
+        cum = np.cumsum(hist)
+        b = min(np.searchsorted(cum, total / 2.0), self.num_bins - 1)
+        frac = (total / 2.0 - (cum[b] - hist[b])) / max(hist[b], 1)
+
+        return self.error_edges[b] + frac * (self.error_edges[b + 1] - self.error_edges[b])
+
+    def _median(self):
+
+        return np.array([self._hist_median(hist, total)
+                         for hist, total in zip(self.counts['err_hist'], self.counts['valid'])])
+
+    def summary(self):
+        """
+        :return: A dict with the mean and the (approximate) median of the normalized transfer errors of all
+            the key points and the mean PCK over the key points for every interval. Used as the live metrics
+        """
+
+        c = self.counts
+        valid = np.maximum(c['valid'], 1)[:, None]
+        pck = np.mean(c['pck'] / valid, axis=0)
+
+        total = np.sum(c['valid'])
+        summary = {
+            'mean_err': float(np.sum(c['err_sum']) / total) if total > 0 else np.nan,
+            'median_err': float(self._hist_median(np.sum(c['err_hist'], axis=0), total)),
+        }
+        summary.update({'pck@%g' % t: float(p) for t, p in zip(self.intervals, pck)})
+
+        return summary
+
+    def instance_stats(self):
+        """
+        :return: The stats of benchmark_all_instances_2 without the per instance data
+        """
+
+        c = self.counts
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = c['err_sum'] / c['valid']
+            std = np.sqrt(np.maximum(c['err_sq_sum'] / c['valid'] - mean ** 2, 0))
+            pck = np.round(c['pck'] / c['valid'][:, None], 3)
+            pck_plot = np.round(c['pck_plot'] / c['valid'][:, None], 3)
+            acc = np.round(np.sum(c['pck'], axis=0) / np.sum(c['valid']), 3)
+
+        stats = {
+            'mean_kp_err': [float(t) for t in np.round(mean, 4)],
+            'median_kp_err': [float(t) for t in np.round(self._median(), 4)],
+            'std_kp_err': [float(t) for t in np.round(std, 4)],
+            'pck': {},
+            'interval': [float(t) for t in self.intervals],
+            'kp_names': self.kp_names,
+            'eval_params': {},
+        }
+
+        for kpx, kp_name in enumerate(self.kp_names):
+            stats['pck'][kp_name] = [float(t) for t in pck[kpx]]
+            stats['eval_params'][kp_name] = {}
+            stats['eval_params'][kp_name]['thresh'] = [float(t) for t in self.plot_intervals]
+            stats['eval_params'][kp_name]['acc'] = [float(t) for t in pck_plot[kpx]]
+
+        stats['eval_params']['acc'] = [float(t) for t in acc]
+        return stats
+
+    def vis_stats(self):
+        """
+        :return: The stats of benchmark_vis_instances
+        """
+
+        stats = {'data': {}, 'pck': {}, 'interval': [float(t) for t in self.intervals], 'eval_params': {}}
+        stats['eval_params']['total'] = self.counts['vis_total'] + 1E-10
+        for dx in range(len(self.dist_thresholds)):
+            stats['eval_params'][dx] = {}
+            stats['eval_params'][dx]['correct'] = self.counts['vis_correct'][dx].copy()
+            stats['eval_params'][dx]['acc'] = \
+                stats['eval_params'][dx]['correct'] / stats['eval_params']['total'].reshape(-1, 1)
+
+        return stats
+
+    def pr_stats(self, count=100):
+        """
+        :return: The precision/recall stats of inst_bench_evaluate
+        """
+
+        hist = self.counts['score_hist']
+        tp = self.counts['score_tp']
+        cum_hist = np.cumsum(hist)
+        cum_tp = np.cumsum(tp, axis=0)
+
+        num_rows = int(cum_hist[-1])
+        prec = []
+        rec = []
+        for end_ind in np.ceil(np.linspace(0, num_rows - 1, count)).astype(int):
+            if end_ind <= 0:
+                continue
+
+            # Interpolate the true positives of the first end_ind rows sorted by the score
+            b = np.searchsorted(cum_hist, end_ind)
+            true_positives = cum_tp[b] - tp[b] + tp[b] * (end_ind - cum_hist[b] + hist[b]) / hist[b]
+
+            prec.append(true_positives / end_ind)
+            rec.append(true_positives / self.counts['positives'])
+
+        prec = np.stack(prec)
+        rec = np.stack(rec)
+        ap_score = prec[0:-1,:]*(rec[1:,:] - rec[0:-1,:])
+        ap_score = ap_score.sum(0)
+
+        return {'prec': prec, 'rec': rec, 'ap': ap_score, 'ap_str': 'APK'}
+
+    def run_evaluation(self, n_iter, results_dir):
+        """
+        Prints and saves the stats like run_evaluation
+
+        :param n_iter: Number of pairs. Used in the file names
+        :param results_dir: Directory of the json and mat files
+        :return: The stats of benchmark_vis_instances
+        """
+
+        json_file = osp.join(results_dir, 'stats_m1_{}.json'.format(n_iter))
+        stats = self.instance_stats()
+        print_instance_stats(stats, self.kp_names)
+
+        with open(json_file, 'w') as f:
+            json.dump(stats, f)
+
+        stats_m1 = self.vis_stats()
+        print_vis_stats(stats_m1, self.kp_names, self.dist_thresholds)
+
+        pr_mat_file = osp.join(results_dir, 'pr_{}.mat'.format(n_iter))
+        sio.savemat(pr_mat_file, self.pr_stats())
+        return stats_m1
@@ -25,30 +25,86 @@ from pytorch3d.structures import Meshes
 class MaskAndDepthRenderer(nn.Module):
     """Pytorch Module combining the mask and the depth renderer."""
 
-    def __init__(self, meshes: Meshes, image_size=256):
+    def __init__(self, meshes: Meshes, image_size=256, mask_settings=None, depth_settings=None):
         """
         Initialization of the Renderer Class. Instances of the mask and depth renderer are create on corresponding
         device.
 
+        The mask and the depth are rasterized in one pass if both use the same settings, else in separate passes.
+        Passes rasterized at a lower resolution are upsampled to image_size, bilinear for the mask and
+        nearest for the depth. render_hard rasterizes only the closest face for a binary mask and the depth,
+        it is used if no gradients w.r.t. the cameras are needed.
+
         :param device: The device, on which the computation is done.
-        :param image_size: Image size for the rasterization. Default is 256.
+        :param image_size: Image size of the rendered mask and depth. Default is 256.
+        :param mask_settings: A dict with the rasterization settings of the mask pass. Any of
+            image_size (default image_size), faces_per_pixel (default 100), bin_size (default None, heuristic)
+            and blur_radius (default 0.0)
+        :param depth_settings: A dict with the rasterization settings of the depth pass. Same keys as mask_settings.
+            Only the closest face is used for the depth, i.e. faces_per_pixel 1 is enough
         """
         super().__init__()
         self.meshes = meshes
+        self.image_size = image_size
         device = meshes.device
 
+        # The template is fixed. Only its vertices and faces are kept and the batches of
+        # the template for every number of cameras are created once
+        self._verts = meshes.verts_padded()
+        self._faces = meshes.faces_padded()
+        self._meshes_batches = {}
+
+        mask_settings = self._get_raster_settings(image_size, mask_settings)
+        depth_settings = self._get_raster_settings(image_size, depth_settings)
+
         # TODO: check how to implement weak perspective (scaled orthographic).
         cameras = OpenGLOrthographicCameras(device=device)
 
         self._rasterizer = MeshRasterizer(
             cameras=cameras,
-            raster_settings=RasterizationSettings(
-                image_size=image_size,
-                faces_per_pixel=100)
+            raster_settings=RasterizationSettings(**mask_settings)
+        )
+
+        self._depth_rasterizer = None
+        if depth_settings != mask_settings:
+            self._depth_rasterizer = MeshRasterizer(
+                cameras=cameras,
+                raster_settings=RasterizationSettings(**depth_settings)
+            )
+
+        self._hard_rasterizer = MeshRasterizer(
+            cameras=cameras,
+            raster_settings=RasterizationSettings(**dict(depth_settings, faces_per_pixel=1, blur_radius=0.0))
         )
 
         self._shader = SoftSilhouetteShader(blend_params=(BlendParams(sigma=1e-4, gamma=1e-4)))
 
+    @staticmethod
+    def _get_raster_settings(image_size, settings=None):
+
+        raster_settings = {'image_size': image_size, 'faces_per_pixel': 100, 'bin_size': None, 'blur_radius': 0.0}
+        if settings is not None:
+            raster_settings.update({k: v for k, v in settings.items() if k in raster_settings})
+
+        return raster_settings
+
+    def _get_meshes_batch(self, batch_size: int) -> Meshes:
+        """
+        :param batch_size: Number of cameras
+        :return: A Meshes batch with the template for every camera. The batches are cached
+            per batch size, share the vertices and faces of the template and have no textures.
+            Only the construction of the batch and its packed vertices, faces and index tensors are
+            saved per call. The batch size copies are still transformed and rasterized for every call
+            and the bins of the coarse rasterization depend on the cameras, so they are not cached
+        """
+
+        if batch_size not in self._meshes_batches:
+            self._meshes_batches[batch_size] = Meshes(
+                verts=self._verts.expand(batch_size, -1, -1),
+                faces=self._faces.expand(batch_size, -1, -1))
+
+        return self._meshes_batches[batch_size]
+
     def forward(self, R: torch.Tensor, T: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
         """
         Combines the forward functions of mask and depth renderer. Argument are equal to both renderers parameters.
@@ -56,17 +112,61 @@ class MaskAndDepthRenderer(nn.Module):
                 with N = batch size, W = width of image, H = height of image, C = Channels. usually W=H.
         """
         batch_size = R.size(0)
-        meshes_batch = self.meshes.extend(batch_size)
+        meshes_batch = self._get_meshes_batch(batch_size)
         # retrieve depth  map
         fragments = self._rasterizer(meshes_batch, R=R, T=T)
         # output is not used here, but calling the shader is necessary
         silhouettes = self._shader(fragments, meshes_batch)
-        depth_maps = fragments.zbuf
+
+        if self._depth_rasterizer is not None:
+            fragments = self._depth_rasterizer(meshes_batch, R=R, T=T)
+        depth_maps = fragments.zbuf[..., 0]
 
         # extract masks from alpha channel of rgba image
         masks = silhouettes[..., 3]
 
-        return masks, depth_maps[..., 0]
+        return self._upsample(masks, depth_maps, fragments.pix_to_face[..., 0] < 0)
+
+    def render_hard(self, R: torch.Tensor, T: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Rasterizes only the closest face of every pixel without the soft silhouette shader.
+        The mask is binary and is not differentiable w.r.t. the cameras. The depth is the same as in forward.
+        Should be called under torch.no_grad.
+
+        :return: Tuple with [N X W X H] masks and depths like forward
+        """
+        meshes_batch = self._get_meshes_batch(R.size(0))
+        fragments = self._hard_rasterizer(meshes_batch, R=R, T=T)
+
+        empty = fragments.pix_to_face[..., 0] < 0
+        masks = (~empty).float()
+        depth_maps = fragments.zbuf[..., 0]
+
+        return self._upsample(masks, depth_maps, empty)
+
+    def _upsample(self, masks: torch.Tensor, depth_maps: torch.Tensor,
+                  empty: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Upsamples the masks and the depths rasterized at a lower resolution to image_size
+
+        :param masks: [N X W' X H'] masks
+        :param depth_maps: [N X W'' X H''] depths
+        :param empty: [N X W'' X H''] True for the pixels of the depths without a face
+        :return: Tuple with [N X W X H] masks and depths
+        """
+
+        if masks.size(-1) != self.image_size:
+            masks = nn.functional.interpolate(
+                masks.unsqueeze(1), size=self.image_size, mode='bilinear', align_corners=False).squeeze(1)
+
+        if depth_maps.size(-1) != self.image_size:
+            # Move the empty pixels (-1) to the back so that they are not in front of the
+            # template at the borders of the upsampled mask
+            depth_maps = torch.where(empty, depth_maps.max(), depth_maps)
+            depth_maps = nn.functional.interpolate(
+                depth_maps.unsqueeze(1), size=self.image_size, mode='nearest').squeeze(1)
+
+        return masks, depth_maps
 
 
 class MaskRenderer(nn.Module):
@@ -0,0 +1,86 @@
+import argparse
+import copy
+
+import torch
+from pytorch3d.structures import Meshes
+
+from src.model.csm import CSM
+from src.nnutils.geometry import get_gt_positions_grid, load_mean_shape
+from src.nnutils.losses import geometric_cycle_consistency_loss, visibility_constraint_loss
+from src.utils.benchmark import format_bytes, peak_memory, print_table, synthetic_batch, time_it
+
+
+def load_model(mean_shape_path, device, img_size):
+    """
+    :return: A tuple (model, gt_2d_pos_grid) with a CSM for the ground truth cameras and
+        the ground truth positions grid as in CSMTrainer
+    """
+
+    mean_shape = load_mean_shape(mean_shape_path, device)
+    template = Meshes(verts=[mean_shape['verts']], faces=[mean_shape['faces']]).to(device)
+    gt_2d_pos_grid = get_gt_positions_grid((img_size, img_size)).to(device).permute(2, 0, 1)
+    gt_2d_pos_grid = gt_2d_pos_grid.unsqueeze(0).unsqueeze(0)
+
+    torch.manual_seed(0)
+    model = CSM(template, mean_shape, use_gt_cam=True).to(device)
+
+    return model, gt_2d_pos_grid
+
+
+def make_train_step(model, batch, gt_2d_pos_grid, amp=False, amp_dtype=torch.bfloat16):
+    """
+    :return: A function without arguments which runs one optimization step of the model
+        for the batch like ITrainer._train_step and returns the loss
+    """
+
+    device = batch[0].device
+    mask = batch[1]
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    scaler = torch.cuda.amp.GradScaler(enabled=amp and device.type == 'cuda')
+
+    def train_step():
+        model.zero_grad()
+        with torch.autocast(device.type, dtype=amp_dtype, enabled=amp):
+            out = model(*batch)
+            loss = geometric_cycle_consistency_loss(gt_2d_pos_grid, out['pred_positions'], mask) + \
+                visibility_constraint_loss(out['pred_depths'], out['pred_z'], mask)
+        scaler.scale(loss).backward()
+        scaler.step(optimizer)
+        scaler.update()
+        return loss
+
+    return train_step
+
+
+def bench_amp(mean_shape_path, device, batch_size, img_size, repeats):
+
+    device = torch.device(device)
+    amp_dtype = torch.float16 if device.type == 'cuda' else torch.bfloat16
+
+    model, gt_2d_pos_grid = load_model(mean_shape_path, device, img_size)
+    batch = synthetic_batch(batch_size, img_size, device)
+
+    rows = []
+    for name, amp in [('float32', False), (str(amp_dtype).split('.')[-1], True)]:
+        train_step = make_train_step(copy.deepcopy(model), batch, gt_2d_pos_grid, amp, amp_dtype)
+        loss = train_step().item()
+
+        mean, std = time_it(train_step, device, repeats, warmup=1)
+        memory = peak_memory(train_step, device)
+        rows.append([name, '%.1f +- %.1f' % (mean * 1000, std * 1000), format_bytes(memory), '%.6f' % loss])
+
+    print('Batch size %d, %d X %d images on %s' % (batch_size, img_size, img_size, device))
+    print_table(['precision', 'step time (ms)', 'peak memory', 'first loss'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark of a training step of CSM with and without autocast')
+    parser.add_argument('-m', '--mean_shape', required=True, help='Path to the mean shape mat file')
+    parser.add_argument('-d', '--device', default='cuda:0')
+    parser.add_argument('-b', '--batch_size', type=int, default=8)
+    parser.add_argument('-s', '--img_size', type=int, default=256)
+    parser.add_argument('-r', '--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    bench_amp(args.mean_shape, args.device, args.batch_size, args.img_size, args.repeats)
@@ -0,0 +1,87 @@
+import argparse
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+from src.data.cub_dataset import CubDataset
+from src.data.imnet_dataset import ImnetDataset
+from src.data.p3d_dataset import P3DDataset
+from src.data.utils.image import img_to_float
+from src.utils.benchmark import batch_nbytes, format_bytes, print_table, synchronize
+from src.utils.config import ConfigParser
+
+
+def _load_dataset(data_cfg, device):
+
+    if data_cfg.category == 'car':
+        return P3DDataset(data_cfg, device)
+    elif data_cfg.category == 'bird':
+        return CubDataset(data_cfg, device)
+    else:
+        return ImnetDataset(data_cfg, device)
+
+
+def run_loader(dataset, batch_size, workers, num_batches, device):
+    """
+    Loads num_batches batches and moves the images and masks to the device
+
+    :return: A tuple (bytes per batch, samples per second)
+    """
+
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=workers,
+                        pin_memory=torch.device(device).type == 'cuda', drop_last=True)
+
+    nbytes = 0
+    num_samples = 0
+    start = None
+
+    for step, batch in enumerate(loader):
+
+        img = img_to_float(batch['img'], device)
+        batch['mask'].unsqueeze(1).to(device, dtype=torch.float)
+
+        # Do not count the start up of the workers
+        if step == 0:
+            synchronize(device)
+            start = time.perf_counter()
+            nbytes = batch_nbytes(batch)
+            continue
+
+        num_samples += img.size(0)
+        if step == num_batches:
+            break
+
+    synchronize(device)
+
+    return nbytes, num_samples / (time.perf_counter() - start)
+
+
+def bench_data(config_path, device, batch_size, workers, num_batches):
+
+    config = ConfigParser(config_path, None).config
+    batch_size = batch_size or config.train.batch_size
+    workers = workers if workers is not None else config.train.workers
+
+    rows = []
+    for img_dtype in ['float64', 'uint8']:
+        config.dataset.img_dtype = img_dtype
+        dataset = _load_dataset(config.dataset, device)
+        nbytes, samples_per_sec = run_loader(dataset, batch_size, workers, num_batches, device)
+        rows.append([img_dtype, format_bytes(nbytes), '%.1f' % samples_per_sec])
+
+    print('Batch size %d, %d workers, pack: %s' % (batch_size, workers, config.dataset.dir.get('pack')))
+    print_table(['img_dtype', 'bytes/batch', 'samples/sec'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark of the data pipeline for float64 and uint8 images')
+    parser.add_argument('-c', '--config', default='config/bird_train.yml')
+    parser.add_argument('-d', '--device', default='cuda:0')
+    parser.add_argument('-b', '--batch_size', type=int, default=None)
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    parser.add_argument('-n', '--num_batches', type=int, default=50)
+    args = parser.parse_args()
+
+    bench_data(args.config, args.device, args.batch_size, args.workers, args.num_batches)
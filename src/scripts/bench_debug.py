@@ -0,0 +1,45 @@
+import argparse
+import copy
+
+import torch
+
+from src.scripts.bench_amp import load_model, make_train_step
+from src.utils.benchmark import print_table, synthetic_batch, time_it
+
+
+def bench_debug(mean_shape_path, device, batch_size, img_size, repeats):
+    """
+    Compares the step time of the default training path with the one with
+    anomaly detection (train.debug.detect_anomaly), which was always on before
+    """
+
+    device = torch.device(device)
+
+    model, gt_2d_pos_grid = load_model(mean_shape_path, device, img_size)
+    batch = synthetic_batch(batch_size, img_size, device)
+
+    times = {}
+    for name, anomaly in [('default', False), ('detect_anomaly', True)]:
+        train_step = make_train_step(copy.deepcopy(model), batch, gt_2d_pos_grid)
+
+        with torch.autograd.set_detect_anomaly(anomaly):
+            times[name] = time_it(train_step, device, repeats, warmup=1)
+
+    rows = [[name, '%.1f +- %.1f' % (mean * 1000, std * 1000), '%.2fx' % (times['detect_anomaly'][0] / mean)]
+            for name, (mean, std) in times.items()]
+
+    print('Batch size %d, %d X %d images on %s' % (batch_size, img_size, img_size, device))
+    print_table(['mode', 'step time (ms)', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark of a training step of CSM with and without anomaly detection')
+    parser.add_argument('-m', '--mean_shape', required=True, help='Path to the mean shape mat file')
+    parser.add_argument('-d', '--device', default='cuda:0')
+    parser.add_argument('-b', '--batch_size', type=int, default=8)
+    parser.add_argument('-s', '--img_size', type=int, default=256)
+    parser.add_argument('-r', '--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    bench_debug(args.mean_shape, args.device, args.batch_size, args.img_size, args.repeats)
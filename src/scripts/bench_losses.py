@@ -0,0 +1,116 @@
+import argparse
+
+import torch
+
+from src.nnutils.geometry import get_gt_positions_grid
+from src.nnutils.losses import geometric_cycle_consistency_loss, visibility_constraint_loss, \
+    mask_reprojection_loss, fused_cycle_losses
+from src.utils.benchmark import format_bytes, peak_memory, print_table, time_it
+
+
+def synthetic_predictions(batch_size, num_poses, img_size, device):
+    """
+    :return: A dict with random predictions of the shapes returned by CSM and a mask
+    """
+
+    def leaf(*shape):
+        return torch.rand(*shape, device=device).requires_grad_()
+
+    return {
+        'pred_positions': leaf(batch_size, num_poses, 2, img_size, img_size),
+        'pred_z': leaf(batch_size, num_poses, 1, img_size, img_size),
+        'pred_depths': leaf(batch_size, num_poses, 1, img_size, img_size),
+        'pred_masks': leaf(batch_size, num_poses, 1, img_size, img_size),
+        'coeffs': leaf(batch_size, num_poses),
+        'mask': (torch.rand(batch_size, 1, img_size, img_size, device=device) > 0.5).float(),
+    }
+
+
+def separate_losses(gt_2d_pos_grid, p, loss_map):
+    """
+    The separate loss functions as previously called by CSMTrainer._calculate_loss_for_predictions and _add_loss_vis
+    """
+
+    loss = geometric_cycle_consistency_loss(gt_2d_pos_grid, p['pred_positions'], p['mask'], coeffs=p['coeffs']) + \
+        visibility_constraint_loss(p['pred_depths'], p['pred_z'], p['mask'], coeffs=p['coeffs']) + \
+        mask_reprojection_loss(p['mask'], p['pred_masks'], coeffs=p['coeffs'])
+
+    if loss_map:
+        with torch.no_grad():
+            torch.mean(geometric_cycle_consistency_loss(
+                gt_2d_pos_grid, p['pred_positions'], p['mask'], reduction='none'), dim=2, keepdim=True)
+
+    return loss
+
+
+def fused_losses(gt_2d_pos_grid, p, loss_map):
+
+    losses, _ = fused_cycle_losses(gt_2d_pos_grid, p['pred_positions'], p['pred_z'], p['pred_depths'], p['mask'],
+                                   p['pred_masks'], p['coeffs'], return_map=loss_map)
+
+    return losses.sum()
+
+
+def saved_memory(fn, inputs):
+    """
+    :return: Bytes of the tensors other than the inputs which autograd keeps for the backward pass of fn
+    """
+
+    input_ptrs = {t.data_ptr() for t in inputs}
+    saved = {}
+
+    def pack(tensor):
+        if tensor.data_ptr() not in input_ptrs:
+            saved[tensor.data_ptr()] = tensor.element_size() * tensor.nelement()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        fn()
+
+    return sum(saved.values())
+
+
+def bench_losses(device, batch_size, num_poses, img_size, loss_map, repeats):
+
+    gt_2d_pos_grid = get_gt_positions_grid((img_size, img_size)).to(device).permute(2, 0, 1)[None, None]
+
+    rows = []
+    for cp in num_poses:
+        p = synthetic_predictions(batch_size, cp, img_size, device)
+        inputs = [p[key] for key in ['pred_positions', 'pred_z', 'pred_depths', 'pred_masks', 'coeffs']]
+        tensors = inputs + [p['mask'], gt_2d_pos_grid]
+
+        values = []
+        for name, loss_fn in [('separate', separate_losses), ('fused', fused_losses)]:
+
+            def step():
+                loss = loss_fn(gt_2d_pos_grid, p, loss_map)
+                torch.autograd.grad(loss, inputs)
+                return loss
+
+            values.append(step().item())
+            mean, std = time_it(step, device, repeats, warmup=1)
+            memory = peak_memory(step, device)
+            saved = saved_memory(lambda: loss_fn(gt_2d_pos_grid, p, loss_map), tensors)
+            rows.append([cp, name, '%.1f +- %.1f' % (mean * 1000, std * 1000), format_bytes(memory),
+                         format_bytes(saved)])
+
+        rows[-1].append('%.2e' % abs(values[0] - values[1]))
+        rows[-2].append('')
+
+    print('Batch size %d, image size %d, loss map %s' % (batch_size, img_size, loss_map))
+    print_table(['CP', 'losses', 'forward + backward (ms)', 'peak memory', 'saved for backward', 'loss abs diff'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark of the fused cycle, visibility and mask losses')
+    parser.add_argument('-d', '--device', default='cuda:0')
+    parser.add_argument('-b', '--batch_size', type=int, default=8)
+    parser.add_argument('-p', '--num_poses', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('-s', '--img_size', type=int, default=256)
+    parser.add_argument('--loss_map', action='store_true', help='Include the per pixel map of the summary steps')
+    parser.add_argument('-r', '--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    bench_losses(args.device, args.batch_size, args.num_poses, args.img_size, args.loss_map, args.repeats)
@@ -0,0 +1,68 @@
+import argparse
+
+import torch
+
+from src.model.csm_predictor import CSMPredictor
+from src.model.uv_to_3d import UVto3D
+from src.nnutils.geometry import load_mean_shape
+from src.utils.benchmark import print_table, time_it
+
+
+def bench_predictor(mean_shape_path, checkpoint, device, batch_size, img_size, uv_to_3d_mode, return_3d,
+                    use_compile, repeats):
+    """
+    Compares the inference latency of the eager CSMPredictor to the traced (and compiled) one
+    """
+
+    mean_shape = load_mean_shape(mean_shape_path, device)
+
+    torch.manual_seed(0)
+    predictor = CSMPredictor(mean_shape, uv_to_3d_mode, return_3d).to(device).eval()
+    if checkpoint is not None:
+        predictor.load_csm_state_dict(torch.load(checkpoint, map_location=device))
+
+    img = torch.rand(batch_size, 3, img_size, img_size, device=device)
+    mask = torch.ones(batch_size, 1, img_size, img_size, device=device)
+
+    variants = [('eager', predictor), ('traced', predictor.trace((img_size, img_size)))]
+    if use_compile:
+        variants.append(('compiled', torch.compile(predictor)))
+
+    rows = []
+    with torch.no_grad():
+        reference = predictor(img, mask)
+
+        for name, model in variants:
+            out = model(img, mask)
+            mean, std = time_it(lambda: model(img, mask), device, repeats)
+
+            errors = [(o - r).abs().max().item() for o, r in zip(out, reference)] if return_3d else \
+                [(out - reference).abs().max().item()]
+            rows.append([name, '%.1f +- %.1f' % (mean * 1000, std * 1000), '%.1f' % (batch_size / mean)] +
+                        ['%.2e' % e for e in errors])
+
+    print('Batch size %d, image size %d, threads %d, uv_to_3d %s' % (
+        batch_size, img_size, torch.get_num_threads(), uv_to_3d_mode if return_3d else '-'))
+    print_table(['predictor', 'time (ms)', 'images/s', 'uv max diff'] + (['3d max diff'] if return_3d else []), rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark of the eager, traced and compiled CSMPredictor')
+    parser.add_argument('-m', '--mean_shape', required=True, help='Path to the mean shape mat file')
+    parser.add_argument('-c', '--checkpoint', default=None, help='Optional CSM checkpoint. Default random weights')
+    parser.add_argument('-d', '--device', default='cpu')
+    parser.add_argument('-b', '--batch_size', type=int, default=1)
+    parser.add_argument('-s', '--img_size', type=int, default=256)
+    parser.add_argument('--uv_to_3d_mode', default='exact', choices=UVto3D.modes)
+    parser.add_argument('--return_3d', action='store_true', help='Also predict the 3D points of the UV values')
+    parser.add_argument('--compile', action='store_true', help='Also benchmark torch.compile (pytorch >= 2.0)')
+    parser.add_argument('-t', '--threads', type=int, default=None, help='Number of cpu threads of pytorch')
+    parser.add_argument('-r', '--repeats', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    bench_predictor(args.mean_shape, args.checkpoint, args.device, args.batch_size, args.img_size,
+                    args.uv_to_3d_mode, args.return_3d, args.compile, args.repeats)
@@ -0,0 +1,127 @@
+import argparse
+
+import numpy as np
+import torch
+import trimesh
+from pytorch3d.structures import Meshes
+
+from src.data.utils.image import get_template_texture
+from src.nnutils.geometry import get_scaled_orthographic_projection
+from src.nnutils.rendering import MaskAndDepthRenderer
+from src.utils.benchmark import format_bytes, peak_memory, print_table, time_it
+
+
+def load_template(template_path, device):
+    """
+    :param template_path: Path to the template obj file. An icosphere is used if it is None
+    :return: A textured pytorch3d.structures.Meshes like IDataset.template_mesh
+    """
+
+    if template_path is None:
+        mesh = trimesh.creation.icosphere(subdivisions=4)
+    else:
+        mesh = trimesh.load(template_path, 'obj')
+
+    vertices = torch.from_numpy(np.asarray(mesh.vertices)).to(device, dtype=torch.float)
+    faces = torch.from_numpy(np.asarray(mesh.faces)).to(device, dtype=torch.long)
+    texture = get_template_texture(vertices, faces, torch.rand(3, 256, 256, device=device))
+
+    return Meshes(verts=[vertices], faces=[faces], textures=texture).to(device)
+
+
+def random_cameras(num_cameras, device):
+
+    scale = 0.5 + 0.2 * torch.rand(num_cameras, device=device)
+    trans = 0.1 * torch.randn(num_cameras, 2, device=device)
+    quat = torch.nn.functional.normalize(torch.randn(num_cameras, 4, device=device), dim=1)
+
+    return get_scaled_orthographic_projection(scale, trans, quat, True)
+
+
+def bench_render(template_path, device, batch_size, num_poses, repeats):
+
+    template = load_template(template_path, device)
+    renderer = MaskAndDepthRenderer(template)
+
+    def render_extend(rotation, translation):
+        # The previous forward which extended the textured template for every call
+        meshes_batch = template.extend(rotation.size(0))
+        fragments = renderer._rasterizer(meshes_batch, R=rotation, T=translation)
+        renderer._shader(fragments, meshes_batch)
+
+    rows = []
+    for cp in num_poses:
+        rotation, translation = random_cameras(batch_size * cp, device)
+
+        for name, fn in [('extend', lambda: render_extend(rotation, translation)),
+                         ('cached', lambda: renderer(rotation, translation))]:
+            mean, std = time_it(fn, device, repeats, warmup=1)
+            memory = peak_memory(fn, device)
+            rows.append([batch_size * cp, name, '%.1f +- %.1f' % (mean * 1000, std * 1000), format_bytes(memory)])
+
+    print('Template with %d vertices and %d faces' % (template.verts_packed().size(0), template.faces_packed().size(0)))
+    print_table(['B * CP', 'meshes', 'time (ms)', 'peak memory'], rows)
+
+
+# (name, mask settings, depth settings, hard) compared to the default settings
+RENDER_SETTINGS = [
+    ('default', None, None),
+    ('hard, no grad', None, None, True),
+    ('depth fpp 1', None, {'faces_per_pixel': 1}),
+    ('mask fpp 10, depth fpp 1', {'faces_per_pixel': 10}, {'faces_per_pixel': 1}),
+    ('128 upsampled', {'image_size': 128, 'faces_per_pixel': 10}, {'image_size': 128, 'faces_per_pixel': 1}),
+    ('64 upsampled', {'image_size': 64, 'faces_per_pixel': 10}, {'image_size': 64, 'faces_per_pixel': 1}),
+]
+
+
+def bench_settings(template_path, device, num_cameras, repeats):
+    """
+    Compares the speed of the renderer settings and the accuracy of their masks and depths to the default settings
+    """
+
+    template = load_template(template_path, device)
+    rotation, translation = random_cameras(num_cameras, device)
+
+    ref_mask, ref_depth = MaskAndDepthRenderer(template)(rotation, translation)
+    ref_mask = ref_mask > 0.5
+
+    rows = []
+    for name, mask_settings, depth_settings, *hard in RENDER_SETTINGS:
+        renderer = MaskAndDepthRenderer(template, mask_settings=mask_settings, depth_settings=depth_settings)
+
+        def render():
+            if hard:
+                with torch.no_grad():
+                    return renderer.render_hard(rotation, translation)
+            return renderer(rotation, translation)
+
+        mean, std = time_it(render, device, repeats, warmup=1)
+        mask, depth = render()
+        mask = mask > 0.5
+
+        iou = (mask & ref_mask).sum().item() / max((mask | ref_mask).sum().item(), 1)
+        common = mask & ref_mask
+        depth_error = (depth - ref_depth).abs()[common].mean().item()
+
+        rows.append([name, '%.1f +- %.1f' % (mean * 1000, std * 1000), '%.4f' % iou, '%.2e' % depth_error])
+
+    print('%d cameras' % num_cameras)
+    print_table(['settings', 'time (ms)', 'mask IoU', 'depth abs error'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark of the mask and depth renderer over the number of cameras')
+    parser.add_argument('-t', '--template', default=None, help='Path to the template obj. Default an icosphere')
+    parser.add_argument('-d', '--device', default='cpu')
+    parser.add_argument('-b', '--batch_size', type=int, default=4)
+    parser.add_argument('-p', '--num_poses', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('-r', '--repeats', type=int, default=3)
+    parser.add_argument('--settings', action='store_true',
+                        help='Compare the rasterization settings instead of the number of cameras')
+    args = parser.parse_args()
+
+    if args.settings:
+        bench_settings(args.template, args.device, args.batch_size * args.num_poses[-1], args.repeats)
+    else:
+        bench_render(args.template, args.device, args.batch_size, args.num_poses, args.repeats)
@@ -0,0 +1,67 @@
+import argparse
+
+import torch
+
+from src.nnutils.geometry import find_nearest_points
+from src.utils.benchmark import format_bytes, peak_memory, print_table, time_it
+
+
+def dense_transfer(kps_3d, points_3d, mask):
+    """
+    The distance matrix over all the pixels as in the original KPTransferTester.map_kp_img1_to_img2
+
+    :param kps_3d: (B X KP X 3) 3D points of the key points
+    :param points_3d: (B X H * W X 3) 3D points of all the pixels
+    :param mask: (B X H * W) foreground mask
+    """
+
+    for b in range(kps_3d.size(0)):
+        distances = torch.sum((kps_3d[b].view(-1, 1, 3) - points_3d[b].view(1, -1, 3)) ** 2, -1).sqrt()
+        distances = distances + (1 - mask[b].view(1, -1)) * 1000
+        torch.min(distances, dim=1)
+
+
+def masked_transfer(kps_3d, points_3d, mask, chunk_size):
+    """
+    The batched search over the foreground pixels used by KPTransferTester.map_kp_img1_to_img2
+    """
+
+    fg_points = [points_3d[b][mask[b] > 0.5] for b in range(kps_3d.size(0))]
+    lengths = torch.tensor([len(p) for p in fg_points], device=kps_3d.device)
+    fg_points = torch.nn.utils.rnn.pad_sequence(fg_points, batch_first=True)
+
+    find_nearest_points(kps_3d, fg_points, lengths, chunk_size=chunk_size)
+
+
+def bench_transfer(device, batch_size, num_kps, img_sizes, fg_frac, chunk_size, repeats):
+
+    rows = []
+    for img_size in img_sizes:
+        kps_3d = torch.rand(batch_size, num_kps, 3, device=device)
+        points_3d = torch.rand(batch_size, img_size * img_size, 3, device=device)
+        mask = (torch.rand(batch_size, img_size * img_size, device=device) < fg_frac).float()
+
+        for name, fn in [('dense', lambda: dense_transfer(kps_3d, points_3d, mask)),
+                         ('masked', lambda: masked_transfer(kps_3d, points_3d, mask, chunk_size))]:
+            mean, std = time_it(fn, device, repeats)
+            memory = peak_memory(fn, device)
+            rows.append([img_size, name, '%.2f +- %.2f' % (mean * 1000, std * 1000), format_bytes(memory)])
+
+    print('Batch size %d, %d key points, foreground fraction %.2f' % (batch_size, num_kps, fg_frac))
+    print_table(['img_size', 'search', 'time (ms)', 'peak memory'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark of the key point transfer search')
+    parser.add_argument('-d', '--device', default='cuda:0')
+    parser.add_argument('-b', '--batch_size', type=int, default=32)
+    parser.add_argument('-k', '--num_kps', type=int, default=15)
+    parser.add_argument('-s', '--img_sizes', type=int, nargs='+', default=[256, 512, 1024])
+    parser.add_argument('-f', '--fg_frac', type=float, default=0.3)
+    parser.add_argument('--chunk_size', type=int, default=4096)
+    parser.add_argument('-r', '--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    bench_transfer(args.device, args.batch_size, args.num_kps, args.img_sizes, args.fg_frac,
+                   args.chunk_size, args.repeats)
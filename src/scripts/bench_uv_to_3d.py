@@ -0,0 +1,52 @@
+import argparse
+
+import torch
+
+from src.model.uv_to_3d import UVto3D
+from src.nnutils.geometry import load_mean_shape
+from src.utils.benchmark import format_bytes, peak_memory, print_table, time_it
+
+
+def bench_uv_to_3d(mean_shape_path, device, img_size, num_poses, repeats):
+
+    mean_shape = load_mean_shape(mean_shape_path, device)
+
+    uv = torch.rand(num_poses * img_size * img_size, 2, device=device)
+    exact = UVto3D(mean_shape, 'exact')(uv)
+
+    rows = []
+    for mode in UVto3D.modes:
+        uv_to_3d = UVto3D(mean_shape, mode)
+        uv_grad = uv.clone().requires_grad_(True)
+
+        points3d = uv_to_3d(uv)
+        error = torch.norm(points3d - exact, dim=1)
+
+        forward, _ = time_it(lambda: uv_to_3d(uv), device, repeats)
+        memory = peak_memory(lambda: uv_to_3d(uv), device)
+
+        # The nearest mode has no gradients w.r.t. the UV values
+        backward = '-'
+        if mode != 'nearest':
+            backward, _ = time_it(lambda: uv_to_3d(uv_grad).sum().backward(), device, repeats)
+            backward = '%.2f' % (backward * 1000)
+
+        rows.append([mode, '%.2f' % (forward * 1000), backward, format_bytes(memory),
+                     '%.2e' % error.mean().item(), '%.2e' % error.max().item()])
+
+    print('%d points (%d X %d X %d)' % (len(uv), img_size, img_size, num_poses))
+    print_table(['mode', 'forward (ms)', 'forward + backward (ms)', 'peak memory',
+                 'mean error', 'max error'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark of the UVto3D modes')
+    parser.add_argument('-m', '--mean_shape', required=True, help='Path to the mean shape mat file')
+    parser.add_argument('-d', '--device', default='cuda:0')
+    parser.add_argument('-s', '--img_size', type=int, default=256)
+    parser.add_argument('-p', '--num_poses', type=int, default=8)
+    parser.add_argument('-r', '--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    bench_uv_to_3d(args.mean_shape, args.device, args.img_size, args.num_poses, args.repeats)
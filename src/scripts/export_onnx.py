@@ -0,0 +1,110 @@
+import argparse
+
+import numpy as np
+import torch
+from pytorch3d.structures import Meshes
+
+from src.model.csm import CSM
+from src.model.csm_onnx import ONNXPredictor, export_onnx
+from src.model.csm_predictor import CSMPredictor
+from src.model.uv_to_3d import UVto3D
+from src.nnutils.geometry import load_mean_shape
+from src.utils.benchmark import print_table, synthetic_batch, time_it
+
+
+def load_csm(mean_shape, state_dict, uv_to_3d_mode):
+    """
+    :return: A CSM for the ground truth cameras on the cpu with the weights of the state dict (random if None).
+        The camera predictor of a checkpoint trained without the ground truth cameras is skipped
+    """
+
+    template = Meshes(verts=[mean_shape['verts']], faces=[mean_shape['faces']])
+
+    torch.manual_seed(0)
+    model = CSM(template, mean_shape, use_gt_cam=True, uv_to_3d_mode=uv_to_3d_mode)
+    if state_dict is not None:
+        missing, unexpected = model.load_state_dict(state_dict, strict=False)
+        unexpected = [key for key in unexpected if not key.startswith('multi_cam_pred.')]
+        if len(missing) > 0 or len(unexpected) > 0:
+            raise RuntimeError('Error loading the CSM checkpoint. Missing keys: %s, unexpected keys: %s' % (
+                missing, unexpected))
+
+    return model.eval()
+
+
+def check_parity(model: CSM, predictor: CSMPredictor, onnx_predictor: ONNXPredictor, batch_size, img_size, repeats):
+    """
+    Compares the UV values (and 3D points) of the onnxruntime predictor to the outputs of CSM for random images
+    and prints the latency of onnxruntime and of the eager CSMPredictor
+    """
+
+    img, mask, scale, trans, quat = synthetic_batch(batch_size, img_size, 'cpu')
+
+    # Precomputed renders, the renderer is not needed for the UV values
+    renders = (mask[:, 0], torch.ones_like(mask[:, 0]))
+    with torch.no_grad():
+        out = model(img, mask, scale, trans, quat, renders)
+    onnx_out = onnx_predictor(img, mask)
+
+    uv, onnx_uv = out['uv'].numpy(), onnx_out[0] if onnx_predictor.return_3d else onnx_out
+    rows = [['uv', '%.2e' % np.abs(uv - onnx_uv).max(), '%.2e' % np.abs(uv - onnx_uv).mean(), '-']]
+
+    if onnx_predictor.return_3d:
+        # The 3D points can differ by a face where the UV values are on the border of a uv_map cell
+        uv_3d = out['uv_3d'].reshape(onnx_out[1].shape).numpy()
+        distances = np.linalg.norm(uv_3d - onnx_out[1], axis=-1)
+        rows.append(['uv_3d', '%.2e' % distances.max(), '%.2e' % distances.mean(),
+                     '%.4f' % (distances > 1E-4).mean()])
+
+    print('Batch size %d, %d X %d images' % (batch_size, img_size, img_size))
+    print_table(['output', 'max diff', 'mean diff', 'fraction > 1e-4'], rows)
+
+    with torch.no_grad():
+        torch_time, _ = time_it(lambda: predictor(img, mask), 'cpu', repeats)
+    onnx_time, _ = time_it(lambda: onnx_predictor(img, mask), 'cpu', repeats)
+
+    print_table(['runtime', 'time (ms)', 'images/s'],
+                [['pytorch (eager)', '%.1f' % (torch_time * 1000), '%.1f' % (batch_size / torch_time)],
+                 ['onnxruntime', '%.1f' % (onnx_time * 1000), '%.1f' % (batch_size / onnx_time)]])
+
+
+def start_export(mean_shape_path, checkpoint, output, img_size, uv_to_3d_mode, return_3d, opset_version,
+                 check, num_threads, batch_size, repeats):
+
+    mean_shape = load_mean_shape(mean_shape_path, 'cpu')
+    state_dict = torch.load(checkpoint, map_location='cpu') if checkpoint is not None else None
+
+    predictor = CSMPredictor(mean_shape, uv_to_3d_mode, return_3d).eval()
+    model = load_csm(mean_shape, state_dict, uv_to_3d_mode) if check else None
+    if state_dict is not None:
+        predictor.load_csm_state_dict(state_dict)
+    elif model is not None:
+        # The random weights of the CSM of the check
+        predictor.load_csm_state_dict(model.state_dict())
+
+    export_onnx(predictor, output, (img_size, img_size), opset_version)
+    print('Exported the predictor to %s' % output)
+
+    if check:
+        check_parity(model, predictor, ONNXPredictor(output, num_threads), batch_size, img_size, repeats)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Export of the UV prediction of CSM to ONNX')
+    parser.add_argument('-m', '--mean_shape', required=True, help='Path to the mean shape mat file')
+    parser.add_argument('-c', '--checkpoint', default=None, help='CSM checkpoint. Default random weights')
+    parser.add_argument('-o', '--output', required=True, help='Path of the onnx file')
+    parser.add_argument('-s', '--img_size', type=int, default=256)
+    parser.add_argument('--uv_to_3d_mode', default='exact', choices=UVto3D.modes)
+    parser.add_argument('--return_3d', action='store_true', help='Also export the UVto3D lookup')
+    parser.add_argument('--opset', type=int, default=16)
+    parser.add_argument('--check', action='store_true',
+                        help='Compare the outputs of onnxruntime to CSM for random images')
+    parser.add_argument('-t', '--threads', type=int, default=0, help='Number of onnxruntime threads of the check')
+    parser.add_argument('-b', '--batch_size', type=int, default=4, help='Batch size of the check')
+    parser.add_argument('-r', '--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    start_export(args.mean_shape, args.checkpoint, args.output, args.img_size, args.uv_to_3d_mode, args.return_3d,
+                 args.opset, args.check, args.threads, args.batch_size, args.repeats)
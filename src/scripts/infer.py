@@ -0,0 +1,17 @@
+import json
+
+from src.estimators.csm_inference import CSMInference
+from src.utils.config import ConfigParser
+
+
+def start_infer(config_path, params, device):
+
+    config = ConfigParser(config_path, params).config
+    print(json.dumps(config, indent=3))
+
+    inference = CSMInference(config, device)
+    inference.infer()
+
+
+if __name__ == '__main__':
+    start_infer('config/infer/bird.yml', {'infer.input': 'images', 'infer.checkpoint': 'csm.pth'}, 'cuda:0')
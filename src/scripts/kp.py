@@ -8,6 +8,7 @@ from torch.utils.data import DataLoader
 
 from src.data.cub_dataset import CubDataset
 from src.data.p3d_dataset import P3DDataset
+from src.data.utils.image import img_to_float
 from src.model.uv_to_3d import UVto3D
 from src.nnutils.color_transform import draw_key_points
 from src.nnutils.geometry import get_scaled_orthographic_projection, load_mean_shape, convert_3d_to_uv_coordinates
@@ -32,7 +33,7 @@ if __name__ == '__main__':
 
     for i, data in enumerate(data_loader):
 
-        img = data['img'].to(device, dtype=torch.float)
+        img = img_to_float(data['img'], device)
         scale = data['scale'].to(device, dtype=torch.float)
         trans = data['trans'].to(device, dtype=torch.float)
         quat = data['quat'].to(device, dtype=torch.float)
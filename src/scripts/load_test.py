@@ -0,0 +1,127 @@
+import argparse
+import http.client
+import json
+import threading
+import time
+
+import numpy as np
+
+from src.estimators.csm_server import decode_arrays, encode_arrays
+from src.utils.benchmark import print_table
+
+
+def synthetic_request(rng, height, width):
+    """
+    :return: The encoded request of a random image with an elliptic foreground mask
+    """
+
+    img = rng.randint(0, 256, (height, width, 3), dtype=np.uint8)
+
+    ys, xs = np.mgrid[:height, :width]
+    mask = ((ys - height / 2) / (0.3 * height)) ** 2 + ((xs - width / 2) / (0.4 * width)) ** 2 < 1
+
+    return encode_arrays(img=img, mask=mask.astype(np.uint8))
+
+
+def _client(host, port, requests, num_requests, counter, latencies, errors, lock):
+
+    connection = http.client.HTTPConnection(host, port)
+    while True:
+        with lock:
+            if counter[0] >= num_requests:
+                break
+            index = counter[0]
+            counter[0] += 1
+
+        start = time.perf_counter()
+        try:
+            connection.request('POST', '/predict', body=requests[index % len(requests)],
+                               headers={'Content-Type': 'application/octet-stream'})
+            response = connection.getresponse()
+            body = response.read()
+            if response.status != 200:
+                raise RuntimeError('%d %s' % (response.status, body.decode(errors='replace')))
+            decode_arrays(body)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+            connection.close()
+            connection = http.client.HTTPConnection(host, port)
+            continue
+
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    connection.close()
+
+
+def get_metrics(host, port):
+
+    connection = http.client.HTTPConnection(host, port)
+    connection.request('GET', '/metrics')
+    metrics = json.loads(connection.getresponse().read())
+    connection.close()
+
+    return metrics
+
+
+def load_test(host, port, concurrency, num_requests, height, width):
+    """
+    Sends num_requests requests from concurrency clients, each waiting for its response before sending
+    the next request, and prints the throughput and the latencies seen by the clients and by the server
+    """
+
+    rng = np.random.RandomState(0)
+    requests = [synthetic_request(rng, height, width) for _ in range(min(num_requests, 16))]
+
+    before = get_metrics(host, port)
+
+    counter, latencies, errors, lock = [0], [], [], threading.Lock()
+    threads = [threading.Thread(target=_client, args=(host, port, requests, num_requests, counter, latencies,
+                                                      errors, lock)) for _ in range(concurrency)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total_time = time.perf_counter() - start
+
+    metrics = get_metrics(host, port)
+
+    latencies = np.array(latencies) * 1000
+    print('%d clients, %d requests of %d X %d images in %.1f s, %d errors' % (
+        concurrency, num_requests, height, width, total_time, len(errors)))
+    if len(errors) > 0:
+        print('First error: %s' % errors[0])
+
+    num_batches = metrics['num_batches'] - before['num_batches']
+    print_table(['requests/s', 'mean batch size', 'max queue depth'],
+                [['%.1f' % (len(latencies) / total_time),
+                  '%.2f' % ((metrics['num_requests'] - before['num_requests']) / max(num_batches, 1)),
+                  '%d' % metrics['max_queue_depth']]])
+
+    # The percentiles of the server are the ones of its window, which can include earlier requests
+    rows = []
+    if len(latencies) > 0:
+        rows.append(['client latency (ms)'] + ['%.1f' % np.percentile(latencies, p) for p in (50, 90, 99)])
+    for name in ['latency_ms', 'queue_ms', 'batch_ms', 'batch_size']:
+        if metrics[name]['p50'] is not None:
+            rows.append(['server %s' % name] + ['%.1f' % metrics[name]['p%d' % p] for p in (50, 90, 99)])
+    print_table(['', 'p50', 'p90', 'p99'], rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Load test of the CSM server (run.py serve)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=8080)
+    parser.add_argument('-c', '--concurrency', type=int, nargs='+', default=[1, 4, 16, 64],
+                        help='Numbers of concurrent clients, one test per number')
+    parser.add_argument('-n', '--num_requests', type=int, default=512, help='Number of requests per test')
+    parser.add_argument('--height', type=int, default=300, help='Height of the random images')
+    parser.add_argument('--width', type=int, default=400, help='Width of the random images')
+    args = parser.parse_args()
+
+    for concurrency in args.concurrency:
+        load_test(args.host, args.port, concurrency, args.num_requests, args.height, args.width)
@@ -0,0 +1,59 @@
+import json
+
+from src.data.cub_dataset import CubDataset
+from src.data.imnet_dataset import ImnetDataset
+from src.data.p3d_dataset import P3DDataset
+from src.data.utils.pack import pack_dataset, render_pack
+from src.utils.config import ConfigParser
+
+
+def start_pack(config_path, params, device):
+
+    config = ConfigParser(config_path, params).config
+    print(json.dumps(config, indent=3))
+
+    data_cfg = config.dataset
+    pack_path = data_cfg.dir.pack
+
+    # The samples must be decoded from the original images while packing
+    data_cfg.dir.pack = None
+
+    if data_cfg.category == 'car':
+        dataset = P3DDataset(data_cfg, device)
+    elif data_cfg.category == 'bird':
+        dataset = CubDataset(data_cfg, device)
+    else:
+        dataset = ImnetDataset(data_cfg, device)
+
+    pack_dataset(dataset, pack_path, data_cfg.get('pack_size'))
+    print('Packed %d samples to %s' % (len(dataset), pack_path))
+
+
+def start_render_pack(config_path, params, device):
+
+    config = ConfigParser(config_path, params).config
+    print(json.dumps(config, indent=3))
+
+    data_cfg = config.dataset
+    renders_path = data_cfg.dir.renders
+
+    # The renders are written for the samples of the pack
+    data_cfg.dir.renders = None
+
+    if data_cfg.category == 'car':
+        dataset = P3DDataset(data_cfg, device)
+    elif data_cfg.category == 'bird':
+        dataset = CubDataset(data_cfg, device)
+    else:
+        dataset = ImnetDataset(data_cfg, device)
+
+    render_cfg = data_cfg.get('render_pack', {})
+    render_pack(dataset.packed, dataset.template_mesh, renders_path,
+                batch_size=render_cfg.get('batch_size', 32),
+                depth_dtype=render_cfg.get('depth_dtype', 'float16'),
+                packbits=render_cfg.get('packbits', True))
+    print('Rendered %d samples to %s' % (len(dataset.packed), renders_path))
+
+
+if __name__ == '__main__':
+    start_pack('config/bird_train.yml', {'dataset.dir.pack': 'datasets/packs/cub_train'}, 'cuda:0')
@@ -5,6 +5,7 @@ from torch.utils.data import DataLoader
 from src.data.cub_dataset import CubDataset
 from src.data.p3d_dataset import P3DDataset
 from src.data.imnet_dataset import ImnetDataset
+from src.data.utils.image import img_to_float
 from src.nnutils.geometry import get_scaled_orthographic_projection
 from src.nnutils.rendering import MaskAndDepthRenderer, ColorRenderer
 from src.utils.config import ConfigParser
@@ -24,7 +25,7 @@ def check_rendering():
 
     for i, data in enumerate(data_loader):
 
-        img = data['img'].to(device, dtype=torch.float)
+        img = img_to_float(data['img'], device)
         mask = data['mask'].unsqueeze(1).to(device, dtype=torch.float)
         scale = data['scale'].to(device, dtype=torch.float)
         trans = data['trans'].to(device, dtype=torch.float)
@@ -0,0 +1,17 @@
+import json
+
+from src.estimators.csm_server import CSMServer
+from src.utils.config import ConfigParser
+
+
+def start_serve(config_path, params, device):
+
+    config = ConfigParser(config_path, params).config
+    print(json.dumps(config, indent=3))
+
+    server = CSMServer(config, device)
+    server.serve()
+
+
+if __name__ == '__main__':
+    start_serve('config/serve/bird.yml', {'serve.checkpoint': 'csm.pth'}, 'cuda:0')
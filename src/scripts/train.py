@@ -1,6 +1,12 @@
 import json
+import os
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
 
 from src.estimators.csm_trainer import CSMTrainer
+from src.model.cam_predictor import get_encoder
 from src.utils.config import ConfigParser
 
 
@@ -9,8 +15,48 @@ def start_train(config_path, params, device):
     config = ConfigParser(config_path, params).config
     print(json.dumps(config, indent=3))
 
-    trainer = CSMTrainer(config, device)
-    trainer.train()
+    world_size = (config.train.get('distributed') or {}).get('world_size', 1)
+
+    if world_size > 1:
+        # Download the pretrained encoder of the camera predictor to the torch.hub cache once
+        # instead of in every process at the same time
+        if not config.train.use_gt_cam:
+            get_encoder()
+
+        # Every process parses the config itself
+        mp.spawn(_train_worker, args=(world_size, config_path, params, device), nprocs=world_size)
+    else:
+        trainer = CSMTrainer(config, device)
+        trainer.train()
+
+
+def _train_worker(rank, world_size, config_path, params, device):
+    """
+    Trains in one of the processes of the distributed training. Uses the cuda device with the index rank
+    for cuda devices and gloo as the default backend on the cpu
+
+    :param rank: Rank of the process
+    :param world_size: Number of processes
+    """
+
+    config = ConfigParser(config_path, params).config
+    dist_cfg = config.train.distributed
+
+    os.environ.setdefault('MASTER_ADDR', str(dist_cfg.get('master_addr', 'localhost')))
+    os.environ.setdefault('MASTER_PORT', str(dist_cfg.get('master_port', 29500)))
+
+    if torch.device(device).type == 'cuda':
+        device = 'cuda:%d' % rank
+        torch.cuda.set_device(device)
+
+    backend = dist_cfg.get('backend') or ('nccl' if torch.device(device).type == 'cuda' else 'gloo')
+    dist.init_process_group(backend, rank=rank, world_size=world_size)
+
+    try:
+        trainer = CSMTrainer(config, device)
+        trainer.train()
+    finally:
+        dist.destroy_process_group()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,165 @@
+import collections
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class DynamicBatcher:
+    """
+    Coalesces the requests of concurrent callers into batches which are run by a single background thread.
+    A batch is run as soon as it has max_batch_size requests or max_latency seconds after its first request
+    was taken from the queue, whichever comes first. Requests arriving while a batch runs wait in the queue
+    for the next batch.
+
+    The latencies of the last window requests are kept for the metrics, see metrics().
+    """
+
+    def __init__(self, batch_fn, max_batch_size=16, max_latency=0.01, max_queue_size=0, window=10000):
+        """
+        :param batch_fn: Function which takes a list of requests and returns a list with a result per request
+        :param max_batch_size: Maximum number of requests in a batch
+        :param max_latency: Maximum time in seconds a batch waits for more requests
+        :param max_queue_size: Maximum number of waiting requests, submit raises queue.Full beyond. 0 for no limit
+        :param window: Number of the last requests and batches used for the metrics
+        """
+
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+
+        self.num_requests = 0
+        self.num_batches = 0
+        self.num_errors = 0
+        self.max_queue_depth = 0
+
+        self._queue_times = collections.deque(maxlen=window)
+        self._latencies = collections.deque(maxlen=window)
+        self._batch_sizes = collections.deque(maxlen=window)
+        self._batch_times = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(target=self._run, name='DynamicBatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, request) -> Future:
+        """
+        :param request: A request passed to batch_fn
+        :return: A concurrent.futures.Future with the result of the request
+        """
+
+        future = Future()
+        self._queue.put_nowait((request, future, time.perf_counter()))
+
+        with self._lock:
+            self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+
+        return future
+
+    def __call__(self, request, timeout=None):
+        """
+        Submits the request and waits for its result
+        """
+
+        return self.submit(request).result(timeout)
+
+    def close(self):
+        """
+        Runs the waiting requests and stops the background thread
+        """
+
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def metrics(self):
+        """
+        :return: A dict with the current queue depth, the counters and the 50/90/99 percentiles of the time
+            in the queue and of the latency of the requests (ms) and of the batch sizes of the window
+        """
+
+        with self._lock:
+            queue_times = np.array(self._queue_times) * 1000
+            latencies = np.array(self._latencies) * 1000
+            batch_sizes = np.array(self._batch_sizes)
+            batch_times = np.array(self._batch_times) * 1000
+
+            metrics = {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'num_requests': self.num_requests,
+                'num_batches': self.num_batches,
+                'num_errors': self.num_errors,
+                'max_batch_size': self.max_batch_size,
+                'max_latency_ms': self.max_latency * 1000,
+            }
+
+        for name, values in [('queue_ms', queue_times), ('latency_ms', latencies),
+                             ('batch_size', batch_sizes), ('batch_ms', batch_times)]:
+            metrics[name] = {'p%d' % p: float(np.percentile(values, p)) if len(values) > 0 else None
+                             for p in (50, 90, 99)}
+            metrics[name]['mean'] = float(values.mean()) if len(values) > 0 else None
+
+        return metrics
+
+    def _next_batch(self):
+        """
+        :return: A list of (request, future, submit time) with at least one request or None to stop
+        """
+
+        job = self._queue.get()
+        if job is None:
+            return None
+
+        batch = [job]
+        deadline = time.perf_counter() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                job = self._queue.get_nowait() if timeout <= 0 else self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if job is None:
+                # Run the last batch before stopping
+                self._queue.put(None)
+                break
+            batch.append(job)
+
+        return batch
+
+    def _run(self):
+
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+
+            requests, futures, submit_times = zip(*batch)
+            start = time.perf_counter()
+            try:
+                results = self.batch_fn(list(requests))
+                error = None
+            except Exception as e:
+                traceback.print_exc()
+                results, error = None, e
+            end = time.perf_counter()
+
+            for i, future in enumerate(futures):
+                if error is None:
+                    future.set_result(results[i])
+                else:
+                    future.set_exception(error)
+
+            with self._lock:
+                self.num_requests += len(batch)
+                self.num_batches += 1
+                self.num_errors += len(batch) if error is not None else 0
+                self._batch_sizes.append(len(batch))
+                self._batch_times.append(end - start)
+                self._queue_times.extend(start - t for t in submit_times)
+                self._latencies.extend(end - t for t in submit_times)
@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+
+import numpy as np
+import torch
+
+from src.nnutils.geometry import get_gt_positions_grid
+from src.utils.cache import nbytes
+
+"""
+Helpers shared by the benchmark scripts in src/scripts/bench_*.py
+"""
+
+
+def synchronize(device):
+
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def time_it(fn, device='cpu', repeats=10, warmup=2):
+    """
+    Measures the run time of fn
+
+    :param fn: Function without arguments to be measured
+    :param device: Device on which fn runs. Cuda devices are synchronized before reading the clock
+    :param repeats: Number of measured runs
+    :param warmup: Number of runs before the measurement
+    :return: A tuple (mean, std) of the run time in seconds
+    """
+
+    for _ in range(warmup):
+        fn()
+    synchronize(device)
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        times.append(time.perf_counter() - start)
+
+    return float(np.mean(times)), float(np.std(times))
+
+
+def _current_rss():
+
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def peak_memory(fn, device='cpu'):
+    """
+    Measures the peak memory used while running fn
+
+    On cuda devices the peak allocated memory of the caching allocator is returned.
+    On the cpu the resident set size is sampled in a background thread and
+    the peak increase over the size before the call is returned (Linux only).
+
+    :param fn: Function without arguments to be measured
+    :param device: Device on which fn runs
+    :return: Peak memory in bytes
+    """
+
+    device = torch.device(device)
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        start = torch.cuda.memory_allocated(device)
+        fn()
+        torch.cuda.synchronize(device)
+        return torch.cuda.max_memory_allocated(device) - start
+
+    start = _current_rss()
+    peak = [start]
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], _current_rss())
+            time.sleep(1E-4)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        fn()
+    finally:
+        done.set()
+        sampler.join()
+
+    return max(peak[0], _current_rss()) - start
+
+
+def batch_nbytes(batch):
+    """
+    :param batch: A tensor or a (nested) dict/list/tuple of tensors as returned by a data loader
+    :return: Total number of bytes of all the tensors in the batch
+    """
+
+    return nbytes(batch)
+
+
+def format_bytes(num_bytes):
+
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(num_bytes) < 1024 or unit == 'GB':
+            return '%.1f %s' % (num_bytes, unit)
+        num_bytes /= 1024.0
+
+
+def print_table(header, rows):
+    """
+    Prints the rows as a table with aligned columns
+
+    :param header: A list of column names
+    :param rows: A list of lists with the values of the columns
+    """
+
+    rows = [[str(v) for v in row] for row in [header] + rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+
+    for i, row in enumerate(rows):
+        print(' | '.join(v.ljust(w) for v, w in zip(row, widths)))
+        if i == 0:
+            print('-+-'.join('-' * w for w in widths))
+
+
+def synthetic_batch(batch_size, img_size, device):
+    """
+    :return: A tuple (img, mask, scale, trans, quat) with random images, elliptic foreground masks
+        and random ground truth camera poses
+    """
+
+    img = torch.rand(batch_size, 3, img_size, img_size, device=device)
+
+    grid = get_gt_positions_grid((img_size, img_size)).to(device)
+    radius = 0.4 + 0.4 * torch.rand(batch_size, 1, 1, 2, device=device)
+    mask = (((grid.unsqueeze(0) / radius) ** 2).sum(-1) < 1).float().unsqueeze(1)
+
+    scale = 0.5 + 0.2 * torch.rand(batch_size, device=device)
+    trans = 0.1 * torch.randn(batch_size, 2, device=device)
+    quat = torch.nn.functional.normalize(torch.randn(batch_size, 4, device=device), dim=1)
+
+    return img, mask, scale, trans, quat
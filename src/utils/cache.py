@@ -0,0 +1,96 @@
+from collections import OrderedDict
+
+import torch
+
+
+def nbytes(value):
+    """
+    :param value: A tensor, np.ndarray or a (nested) dict/list/tuple of them
+    :return: Total number of bytes of all the tensors and arrays in value
+    """
+
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    elif isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    elif isinstance(value, (list, tuple)):
+        return sum(nbytes(v) for v in value)
+
+    return getattr(value, 'nbytes', 0)
+
+
+class LRUCache:
+    """
+    A least recently used cache with a memory budget.
+    The least recently used entries are evicted once the size of all the entries exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: Memory budget of the cache in bytes
+        """
+
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+
+    def __len__(self):
+
+        return len(self._entries)
+
+    def __contains__(self, key):
+
+        return key in self._entries
+
+    def get(self, key):
+        """
+        :param key: Key of the entry
+        :return: The entry for the key or None if it is not cached
+        """
+
+        if key not in self._entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+
+        return self._entries[key][0]
+
+    def put(self, key, value):
+        """
+        Adds the value to the cache and evicts the least recently used entries to stay within the budget.
+        Values larger than the budget are not cached.
+
+        :param key: Key of the entry
+        :param value: Value to be cached
+        """
+
+        size = nbytes(value)
+
+        if key in self._entries:
+            self.num_bytes -= self._entries.pop(key)[1]
+
+        if size > self.max_bytes:
+            return
+
+        self._entries[key] = (value, size)
+        self.num_bytes += size
+
+        while self.num_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.num_bytes -= evicted_size
+
+    def clear(self):
+
+        self._entries.clear()
+        self.num_bytes = 0
+
+    @property
+    def hit_rate(self):
+
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
@@ -0,0 +1,78 @@
+import queue
+import threading
+import traceback
+
+import torch
+
+
+class AsyncSummaryWriter:
+    """
+    Runs summary functions, e.g. the image visualizations of a trainer, on a background thread.
+    The jobs are kept in a bounded queue. A job is dropped instead of blocking the caller if the queue is full.
+    The arguments of the jobs should be snapshots (detached, on the cpu) since they are used after the caller continues.
+    """
+
+    def __init__(self, max_queue_size=2, enabled=True):
+        """
+        :param max_queue_size: Maximum number of pending jobs
+        :param enabled: False to run the jobs on the calling thread, e.g. for debugging
+        """
+
+        self.enabled = enabled
+        self.submitted = 0
+        self.dropped = 0
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        if enabled:
+            self._thread = threading.Thread(target=self._run, name='AsyncSummaryWriter', daemon=True)
+            self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedules fn(*args, **kwargs)
+
+        :return: False if the job was dropped because the queue is full
+        """
+
+        self.submitted += 1
+        if not self.enabled:
+            with torch.no_grad():
+                fn(*args, **kwargs)
+            return True
+
+        try:
+            self._queue.put_nowait((fn, args, kwargs))
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        return True
+
+    def close(self):
+        """
+        Waits for the pending jobs and stops the background thread
+        """
+
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+        if self.dropped > 0:
+            print('Dropped %d of %d summaries' % (self.dropped, self.submitted))
+
+    def _run(self):
+
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+
+            # A failing summary should not stop the training
+            fn, args, kwargs = job
+            try:
+                with torch.no_grad():
+                    fn(*args, **kwargs)
+            except Exception:
+                traceback.print_exc()
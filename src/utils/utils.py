@@ -51,15 +51,31 @@ def str2bool(v):
 def add_train_arguments(sub_parser: argparse.ArgumentParser):
 
     sub_parser.add_argument('-b', '--train.batch_size', required=False, type=int)
+    sub_parser.add_argument('--train.accumulation_steps', required=False, type=int)
+    sub_parser.add_argument('--train.distributed.world_size', required=False, type=int)
+    sub_parser.add_argument('--train.distributed.backend', required=False, type=str, choices=['gloo', 'nccl'])
+    sub_parser.add_argument('--train.distributed.master_addr', required=False, type=str)
+    sub_parser.add_argument('--train.distributed.master_port', required=False, type=int)
     sub_parser.add_argument('-e', '--train.epochs', required=False, type=int)
     sub_parser.add_argument('-s', '--train.shuffle', required=False, type=str2bool)
     sub_parser.add_argument('-w', '--train.workers', required=False, type=int)
     sub_parser.add_argument('-ck', '--train.checkpoint', required=False, type=str)
     sub_parser.add_argument('--train.out_dir', required=False, type=str)
 
+    sub_parser.add_argument('--train.amp', required=False, type=str2bool)
     sub_parser.add_argument('--train.use_gt_cam', required=False, type=str2bool)
     sub_parser.add_argument('--train.num_cam_poses', required=False, type=int)
     sub_parser.add_argument('--train.use_sampled_cam', required=False, type=str2bool)
+    sub_parser.add_argument('--train.uv_to_3d_mode', required=False, type=str, choices=['exact', 'planar', 'bilinear', 'nearest'])
+    sub_parser.add_argument('--train.render.hard', required=False, type=str2bool)
+    sub_parser.add_argument('--train.render.mask.image_size', required=False, type=int)
+    sub_parser.add_argument('--train.render.mask.faces_per_pixel', required=False, type=int)
+    sub_parser.add_argument('--train.render.mask.bin_size', required=False, type=int)
+    sub_parser.add_argument('--train.render.mask.blur_radius', required=False, type=float)
+    sub_parser.add_argument('--train.render.depth.image_size', required=False, type=int)
+    sub_parser.add_argument('--train.render.depth.faces_per_pixel', required=False, type=int)
+    sub_parser.add_argument('--train.render.depth.bin_size', required=False, type=int)
+    sub_parser.add_argument('--train.render.depth.blur_radius', required=False, type=float)
     sub_parser.add_argument('--train.pose_warmup_epochs', required=False, type=int)
 
     sub_parser.add_argument('--train.loss.geometric', required=False, type=float)
@@ -71,6 +87,14 @@ def add_train_arguments(sub_parser: argparse.ArgumentParser):
     sub_parser.add_argument('-lr', '--train.optim.lr', required=False, type=float)
     sub_parser.add_argument('-b1', '--train.optim.beta1', required=False, type=float)
 
+    sub_parser.add_argument('--train.log.async_summaries', required=False, type=str2bool)
+    sub_parser.add_argument('--train.log.summary_queue_size', required=False, type=int)
+
+    sub_parser.add_argument('--train.debug.detect_anomaly', required=False, type=str2bool)
+    sub_parser.add_argument('--train.debug.profile', required=False, type=str2bool)
+    sub_parser.add_argument('--train.debug.profile_steps', required=False, type=int)
+    sub_parser.add_argument('--train.debug.timing', required=False, type=str2bool)
+
 
 def add_kp_test_arguments(sub_parser: argparse.ArgumentParser):
 
@@ -81,8 +105,69 @@ def add_kp_test_arguments(sub_parser: argparse.ArgumentParser):
     sub_parser.add_argument('--test.use_gt_cam', required=False, type=str2bool)
     sub_parser.add_argument('--test.num_cam_poses', required=False, type=int)
     sub_parser.add_argument('--test.use_sampled_cam', required=False, type=str2bool)
+    sub_parser.add_argument('--test.uv_to_3d_mode', required=False, type=str, choices=['exact', 'planar', 'bilinear', 'nearest'])
     sub_parser.add_argument('-ck', '--test.checkpoint', required=False, type=str)
     sub_parser.add_argument('--test.alpha', required=False, type=float, nargs='+')
     sub_parser.add_argument('--test.add_summaries', required=False, type=str2bool)
+    sub_parser.add_argument('--test.dedupe_pairs', required=False, type=str2bool)
+    sub_parser.add_argument('--test.point_cache_mb', required=False, type=int)
+    sub_parser.add_argument('--test.stream_stats', required=False, type=str2bool)
     
     sub_parser.add_argument('--dataset.num_pairs', required=False, type=int)
+
+
+def add_pack_arguments(sub_parser: argparse.ArgumentParser):
+
+    sub_parser.add_argument('-p', '--dataset.dir.pack', required=True, type=str,
+                            help='Path of the pack without the extension')
+    sub_parser.add_argument('--dataset.split', required=False, type=str)
+    sub_parser.add_argument('--dataset.pack_size', required=False, type=int)
+
+
+def add_render_pack_arguments(sub_parser: argparse.ArgumentParser):
+
+    sub_parser.add_argument('-p', '--dataset.dir.pack', required=True, type=str,
+                            help='Path of the pack without the extension')
+    sub_parser.add_argument('-r', '--dataset.dir.renders', required=True, type=str,
+                            help='Path of the renders without the extension')
+    sub_parser.add_argument('--dataset.split', required=False, type=str)
+    sub_parser.add_argument('--dataset.render_pack.batch_size', required=False, type=int)
+    sub_parser.add_argument('--dataset.render_pack.depth_dtype', required=False, type=str,
+                            choices=['float16', 'float32'])
+    sub_parser.add_argument('--dataset.render_pack.packbits', required=False, type=str2bool)
+
+
+def add_infer_arguments(sub_parser: argparse.ArgumentParser):
+
+    sub_parser.add_argument('-i', '--infer.input', required=False, type=str,
+                            help='Directory with the images or list file with the samples')
+    sub_parser.add_argument('--infer.mask_dir', required=False, type=str)
+    sub_parser.add_argument('-ck', '--infer.checkpoint', required=False, type=str)
+    sub_parser.add_argument('-o', '--infer.out_dir', required=False, type=str)
+    sub_parser.add_argument('-b', '--infer.batch_size', required=False, type=int)
+    sub_parser.add_argument('-w', '--infer.workers', required=False, type=int)
+    sub_parser.add_argument('--infer.prefetch_factor', required=False, type=int)
+    sub_parser.add_argument('--infer.shard_size', required=False, type=int)
+    sub_parser.add_argument('--infer.uv_dtype', required=False, type=str, choices=['float16', 'uint16'])
+    sub_parser.add_argument('--infer.return_3d', required=False, type=str2bool)
+    sub_parser.add_argument('--infer.uv_to_3d_mode', required=False, type=str, choices=['exact', 'planar', 'bilinear', 'nearest'])
+    sub_parser.add_argument('--infer.onnx', required=False, type=str)
+    sub_parser.add_argument('--infer.threads', required=False, type=int)
+
+
+def add_serve_arguments(sub_parser: argparse.ArgumentParser):
+
+    sub_parser.add_argument('-ck', '--serve.checkpoint', required=False, type=str)
+    sub_parser.add_argument('--serve.host', required=False, type=str)
+    sub_parser.add_argument('-p', '--serve.port', required=False, type=int)
+    sub_parser.add_argument('-b', '--serve.max_batch_size', required=False, type=int)
+    sub_parser.add_argument('--serve.max_latency_ms', required=False, type=float,
+                            help='Maximum time a batch waits for more requests')
+    sub_parser.add_argument('--serve.max_queue_size', required=False, type=int,
+                            help='Maximum number of waiting requests, 0 for no limit')
+    sub_parser.add_argument('--serve.request_timeout', required=False, type=float)
+    sub_parser.add_argument('--serve.uv_dtype', required=False, type=str, choices=['float16', 'uint16'])
+    sub_parser.add_argument('--serve.return_3d', required=False, type=str2bool)
+    sub_parser.add_argument('--serve.uv_to_3d_mode', required=False, type=str, choices=['exact', 'planar', 'bilinear', 'nearest'])
+    sub_parser.add_argument('--serve.onnx', required=False, type=str)
+    sub_parser.add_argument('--serve.threads', required=False, type=int)
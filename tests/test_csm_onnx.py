@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip('pytorch3d')
+pytest.importorskip('onnxruntime')
+spatial = pytest.importorskip('scipy.spatial')
+
+from pytorch3d.structures import Meshes
+
+from src.model.csm import CSM
+from src.model.csm_onnx import ONNXPredictor, export_onnx
+from src.model.csm_predictor import CSMPredictor
+from src.nnutils.geometry import compute_barycentric_coordinates, convert_3d_to_uv_coordinates, convert_uv_to_3d
+from src.utils.benchmark import synthetic_batch
+
+
+IMG_SIZE = 64
+
+
+def synthetic_mean_shape(num_verts=200, uv_res=65, seed=0):
+    """
+    :return: A mean shape dictionary like load_mean_shape of an ellipsoid with random vertices. The faces are the
+        convex hull of the vertices on the sphere and face_inds the face of the largest minimal barycentric
+        coordinate for every uv_map point
+    """
+
+    rng = np.random.default_rng(seed)
+    points = rng.normal(size=(num_verts, 3))
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    faces = torch.from_numpy(spatial.ConvexHull(points).simplices).long()
+
+    uv_verts = convert_3d_to_uv_coordinates(torch.from_numpy(points).float())
+    sphere_verts = convert_uv_to_3d(uv_verts)
+    verts = sphere_verts * torch.tensor([1.0, 0.5, 0.3])
+
+    grid = torch.linspace(0, 1, uv_res)
+    v, u = torch.meshgrid(grid, grid, indexing='ij')
+    uv_map = torch.stack([u, v], dim=-1)
+
+    # Barycentric coordinates of the grid points on the sphere w.r.t. the faces of the other hemisphere are < 0
+    inverse = torch.inverse(sphere_verts[faces].transpose(1, 2))
+    bary = torch.einsum('fij,nj->nfi', inverse, convert_uv_to_3d(uv_map.view(-1, 2)))
+    score = bary.min(dim=-1).values
+    score[bary.sum(dim=-1) < 0] = -np.inf
+    face_inds = score.argmax(dim=1)
+
+    bary_cord = compute_barycentric_coordinates(uv_verts[faces[face_inds]], uv_map.view(-1, 2))
+
+    return {'uv_map': uv_map, 'uv_verts': uv_verts, 'verts': verts, 'sphere_verts': sphere_verts,
+            'faces': faces, 'face_inds': face_inds.view(uv_res, uv_res), 'bary_cord': bary_cord.view(uv_res, uv_res, 3)}
+
+
+@pytest.mark.parametrize('uv_to_3d_mode', ['exact', 'bilinear'])
+def test_onnx_parity(uv_to_3d_mode, tmp_path):
+
+    mean_shape = synthetic_mean_shape()
+    template = Meshes(verts=[mean_shape['verts']], faces=[mean_shape['faces']])
+
+    torch.manual_seed(0)
+    model = CSM(template, mean_shape, use_gt_cam=True, uv_to_3d_mode=uv_to_3d_mode).eval()
+
+    predictor = CSMPredictor(mean_shape, uv_to_3d_mode, return_3d=True).eval()
+    predictor.load_csm_state_dict(model.state_dict())
+
+    # Exported with a batch of one, run with other batch sizes
+    path = str(tmp_path / 'csm.onnx')
+    export_onnx(predictor, path, (IMG_SIZE, IMG_SIZE))
+    onnx_predictor = ONNXPredictor(path, num_threads=1)
+
+    face_verts = mean_shape['verts'][mean_shape['faces']]
+    max_edge = (face_verts - face_verts.roll(1, dims=1)).norm(dim=-1).max().item()
+
+    torch.manual_seed(1)
+    for batch_size in [3, 5]:
+        img, mask, scale, trans, quat = synthetic_batch(batch_size, IMG_SIZE, 'cpu')
+
+        # Precomputed renders, the renderer is not needed for the UV values
+        renders = (mask[:, 0], torch.ones_like(mask[:, 0]))
+        with torch.no_grad():
+            out = model(img, mask, scale, trans, quat, renders)
+        uv, uv_3d = onnx_predictor(img, mask)
+
+        assert uv.shape == (batch_size, 2, IMG_SIZE, IMG_SIZE)
+        np.testing.assert_allclose(uv, out['uv'].numpy(), atol=1E-4)
+
+        # The 3D points can differ by a face where the UV values are on the border of a uv_map cell,
+        # i.e. by less than an edge for a few points
+        distances = np.linalg.norm(uv_3d - out['uv_3d'].reshape(uv_3d.shape).numpy(), axis=-1)
+        assert np.mean(distances > 1E-4) < 1E-3
+        assert distances.max() < max_edge
@@ -0,0 +1,198 @@
+import json
+import os.path as osp
+
+import numpy as np
+import pytest
+import scipy.io as sio
+
+from src.nnutils import pck
+
+
+IMG_SIZE = 256
+DIST_THRESHOLDS = [1e-4, 1e-3, 0.25*1e-2, 0.5*1e-2, 0.75*1e-2, 1E-2, 1E-1, 0.2, 0.3, 0.4, 0.5, 0.6, 10]
+KP_NAMES = ['kp_%d' % i for i in range(15)]
+
+
+def synthetic_stats(num_pairs=4000, seed=0):
+    """
+    :return: The bench_stats of KPTransferTester for random pairs, i.e. the (N X KP X 3) kps1, kps2 and kps_err
+    """
+
+    rng = np.random.default_rng(seed)
+    nkps = len(KP_NAMES)
+
+    kps1 = rng.uniform(0, IMG_SIZE, (num_pairs, nkps, 3))
+    kps2 = rng.uniform(0, IMG_SIZE, (num_pairs, nkps, 3))
+    kps1[:, :, 2] = rng.random((num_pairs, nkps)) < 0.8
+    kps2[:, :, 2] = rng.random((num_pairs, nkps)) < 0.7
+
+    kps_err = np.zeros((num_pairs, nkps, 3))
+    kps_err[:, :, 0] = np.abs(rng.normal(0, 0.12, (num_pairs, nkps))) * IMG_SIZE
+    kps_err[:, :, 1] = (kps1[:, :, 2] > 0.5) & (kps2[:, :, 2] > 0.5)
+    kps_err[:, :, 2] = rng.exponential(0.2, (num_pairs, nkps))
+
+    return {'kps1': kps1, 'kps2': kps2, 'kps_err': kps_err}
+
+
+# The implementations before the vectorization with np.float and np.int replaced by float and int
+
+
+def benchmark_vis_instances_ref(intervals, dist_thresholds, kpnames, bench_stats, img_size):
+    stats = {}
+    stats['data'] = {}
+    stats['eval_params'] ={}
+    stats['pck'] ={}
+    stats['interval'] = intervals
+    bench_stats_kps_error = 1*bench_stats['kps_err']
+    bench_stats_kps_error[:,:,0] = bench_stats_kps_error[:,:,0]/img_size
+    ndata_points, nkps, _ = bench_stats['kps_err'].shape
+
+    kps_vis1 =  bench_stats['kps1'][:,:,2] > 0.5
+    kps_vis2 =  bench_stats['kps2'][:,:,2] > 0.5
+    stats['eval_params']['total'] = np.sum(kps_vis1, axis=0) + 1E-10
+    for dx, dist_thresh in enumerate(dist_thresholds):
+        stats['eval_params'][dx] = {}
+        stats['eval_params'][dx]['correct'] = np.zeros((len(kpnames),len(intervals)))
+        for kpx, kp_name in enumerate(kpnames):
+            valid_inds = np.where(bench_stats_kps_error[:,kpx,2] < dist_thresh)[0].tolist()
+            common_inds = np.where(bench_stats_kps_error[:, kpx, 1] > 0.5)[0].tolist()
+            valid_inds = set(valid_inds)
+            common_inds = set(common_inds)
+            ck = pck.ck_at_interval(intervals, bench_stats_kps_error[:,kpx,0])
+            ck = np.stack(ck, axis=1)
+            ex = np.array(list(common_inds & valid_inds))
+            if len(ex) > 0:
+                stats['eval_params'][dx]['correct'][kpx] += np.sum(ck[ex,:], axis=0)
+
+            kps_vis1_ind = np.where(kps_vis1[:,kpx])[0]
+            kps_vis2_ind = np.where(kps_vis2[:,kpx])[0]
+            ex = np.array(list(set(kps_vis1_ind) - set(kps_vis2_ind))).astype(int)
+            if len(ex) > 0:
+                stats['eval_params'][dx]['correct'][kpx] += np.sum(bench_stats_kps_error[ex,kpx,2] > dist_thresh)
+        stats['eval_params'][dx]['acc'] =  stats['eval_params'][dx]['correct'] / stats['eval_params']['total'].reshape(-1,1)
+    return stats
+
+
+def collate_all_instances_ref(intervals, kp_names , bench_stats, img_size):
+    bench_stats_kps_error  = bench_stats['kps_err']*1
+    bench_stats_kps_error[:,:,0] = bench_stats_kps_error[:,:,0]/img_size
+    prediction_error = []  # N x 1
+    prediction_score = []  # N x 1
+    prediction_label = []  # N x len(intervals)
+    gt_label = []
+
+    kps_vis1 =  bench_stats['kps1'][:,:,2] > 0.5
+    kps_vis2 =  bench_stats['kps2'][:,:,2] > 0.5
+
+    for kpx, kp_name in enumerate(kp_names):
+        common_inds = np.where(bench_stats_kps_error[:, kpx, 1] > 0.5)[0].tolist()
+        ck = pck.ck_at_interval(intervals, bench_stats_kps_error[:,kpx,0])
+        ck = np.stack(ck, axis=1)
+        ex = np.array(list(common_inds))
+        if len(ex) > 0:
+            prediction_error.append(bench_stats_kps_error[ex,kpx,0])
+            prediction_score.append(bench_stats_kps_error[ex,kpx,2])
+            prediction_label.append(ck[ex,:]*1)
+            gt_label.append(ck[ex,:]*0 + 1)
+
+        kps_vis1_ind = np.where(kps_vis1[:,kpx])[0]
+        kps_vis2_ind = np.where(kps_vis2[:,kpx])[0]
+        # Sorted instead of the iteration order of the set, the only change.
+        # collate_all_instances orders these rows by instance as well
+        ex = np.array(sorted(set(kps_vis1_ind) - set(kps_vis2_ind))).astype(int)
+        if len(ex) > 0:
+            prediction_error.append(bench_stats_kps_error[ex,kpx,0])
+            prediction_score.append(bench_stats_kps_error[ex,kpx,2])
+            prediction_label.append(ck[ex,:]*0)
+            gt_label.append(ck[ex,:]*0)
+
+
+    prediction_error = np.concatenate(prediction_error,axis=0)
+    prediction_score = np.concatenate(prediction_score, axis=0)
+    prediction_label = np.concatenate(prediction_label, axis=0)
+    gt_label = np.concatenate(gt_label, axis=0)
+
+    stats = {}
+    stats['pred_label'] = prediction_label
+    stats['gt_label'] = gt_label
+    stats['score'] = prediction_score ## lower the score better it is.
+    return stats
+
+
+@pytest.fixture(scope='module')
+def bench_stats():
+    return synthetic_stats()
+
+
+def test_benchmark_vis_instances(bench_stats):
+
+    stats = pck.benchmark_vis_instances(pck.kp_eval_thresholds, DIST_THRESHOLDS, KP_NAMES, bench_stats, IMG_SIZE)
+    ref = benchmark_vis_instances_ref(pck.kp_eval_thresholds, DIST_THRESHOLDS, KP_NAMES, bench_stats, IMG_SIZE)
+
+    np.testing.assert_array_equal(stats['eval_params']['total'], ref['eval_params']['total'])
+    for dx in range(len(DIST_THRESHOLDS)):
+        np.testing.assert_array_equal(stats['eval_params'][dx]['correct'], ref['eval_params'][dx]['correct'])
+        np.testing.assert_array_equal(stats['eval_params'][dx]['acc'], ref['eval_params'][dx]['acc'])
+
+
+def test_collate_all_instances(bench_stats):
+
+    stats = pck.collate_all_instances(pck.kp_eval_thresholds, KP_NAMES, bench_stats, IMG_SIZE)
+    ref = collate_all_instances_ref(pck.kp_eval_thresholds, KP_NAMES, bench_stats, IMG_SIZE)
+
+    # Same rows in the same order
+    for k in ['pred_label', 'gt_label', 'score']:
+        np.testing.assert_array_equal(stats[k], ref[k])
+
+    ap = pck.inst_bench_evaluate(stats['pred_label'], stats['gt_label'], stats['score'])['ap']
+    ref_ap = pck.inst_bench_evaluate(ref['pred_label'], ref['gt_label'], ref['score'])['ap']
+    np.testing.assert_array_equal(ap, ref_ap)
+
+
+def test_accumulator(bench_stats, tmp_path):
+
+    batch_dir = tmp_path / 'batch'
+    acc_dir = tmp_path / 'acc'
+    batch_dir.mkdir()
+    acc_dir.mkdir()
+
+    stats = pck.run_evaluation(bench_stats, 0, str(batch_dir), IMG_SIZE, KP_NAMES, DIST_THRESHOLDS)
+
+    # Uneven batches and a merge of two accumulators
+    accumulators = [pck.PCKAccumulator(KP_NAMES, IMG_SIZE, DIST_THRESHOLDS) for _ in range(2)]
+    for i, start in enumerate(range(0, len(bench_stats['kps1']), 333)):
+        accumulators[i % 2].update(*[bench_stats[k][start:start + 333] for k in ['kps1', 'kps2', 'kps_err']])
+    accumulator = accumulators[0]
+    accumulator.merge(accumulators[1])
+    acc_stats = accumulator.run_evaluation(0, str(acc_dir))
+
+    for dx in range(len(DIST_THRESHOLDS)):
+        np.testing.assert_array_equal(acc_stats['eval_params'][dx]['correct'], stats['eval_params'][dx]['correct'])
+
+    with open(osp.join(batch_dir, 'stats_m1_0.json')) as f:
+        instance_stats = json.load(f)
+    with open(osp.join(acc_dir, 'stats_m1_0.json')) as f:
+        acc_instance_stats = json.load(f)
+
+    np.testing.assert_allclose(acc_instance_stats['mean_kp_err'], instance_stats['mean_kp_err'], atol=1E-4)
+    np.testing.assert_allclose(acc_instance_stats['std_kp_err'], instance_stats['std_kp_err'], atol=1E-4)
+    np.testing.assert_allclose(acc_instance_stats['median_kp_err'], instance_stats['median_kp_err'], atol=2E-3)
+    np.testing.assert_allclose(acc_instance_stats['eval_params']['acc'], instance_stats['eval_params']['acc'])
+    for kp_name in KP_NAMES:
+        np.testing.assert_allclose(acc_instance_stats['pck'][kp_name], instance_stats['pck'][kp_name])
+        np.testing.assert_allclose(acc_instance_stats['eval_params'][kp_name]['acc'],
+                                   instance_stats['eval_params'][kp_name]['acc'])
+
+    ap = sio.loadmat(osp.join(batch_dir, 'pr_0.mat'))['ap']
+    acc_ap = sio.loadmat(osp.join(acc_dir, 'pr_0.mat'))['ap']
+    np.testing.assert_allclose(acc_ap, ap, atol=5E-3)
+
+    # The live summary
+    error = bench_stats['kps_err'][:, :, 0] / IMG_SIZE
+    error = error[bench_stats['kps_err'][:, :, 1] > 0.5]
+    summary = accumulator.summary()
+    assert summary['mean_err'] == pytest.approx(np.mean(error))
+    assert summary['median_err'] == pytest.approx(np.median(error), abs=2E-3)
+    for i, t in enumerate(pck.kp_eval_thresholds):
+        assert summary['pck@%g' % t] == pytest.approx(np.mean([p[i] for p in instance_stats['pck'].values()]),
+                                                      abs=1E-3)
@@ -0,0 +1,72 @@
+import pytest
+import torch
+
+pytest.importorskip('pytorch3d')
+
+from pytorch3d.utils import ico_sphere
+
+from src.nnutils.geometry import get_scaled_orthographic_projection
+from src.nnutils.rendering import MaskAndDepthRenderer
+
+
+IMG_SIZE = 64
+
+
+@pytest.fixture(scope='module')
+def template():
+    return ico_sphere(3)
+
+
+@pytest.fixture(scope='module')
+def cameras():
+
+    torch.manual_seed(0)
+    num_cameras = 8
+    scale = 0.5 + 0.2 * torch.rand(num_cameras)
+    trans = 0.1 * torch.randn(num_cameras, 2)
+    quat = torch.nn.functional.normalize(torch.randn(num_cameras, 4), dim=1)
+
+    return get_scaled_orthographic_projection(scale, trans, quat, True)
+
+
+def test_render_hard(template, cameras):
+    """
+    The hard rendering of use_gt_cam (train.render.hard) gives the depths and the binarized masks of forward
+    """
+
+    renderer = MaskAndDepthRenderer(template, IMG_SIZE)
+    with torch.no_grad():
+        mask, depth = renderer(*cameras)
+        hard_mask, hard_depth = renderer.render_hard(*cameras)
+
+    covered = hard_mask > 0.5
+    assert covered.any()
+    assert torch.all((hard_mask == 0) | (hard_mask == 1))
+    # Pixels exactly on an edge have a soft mask of 0.5
+    assert torch.mean(((mask > 0.5) != covered).float()) < 1E-3
+    torch.testing.assert_close(hard_depth[covered], depth[covered])
+
+
+@pytest.mark.parametrize('mask_settings, depth_settings, min_iou', [
+    ({'faces_per_pixel': 10}, {'faces_per_pixel': 1}, 0.999),
+    ({'image_size': IMG_SIZE // 2, 'faces_per_pixel': 10}, {'image_size': IMG_SIZE // 2, 'faces_per_pixel': 1}, 0.85),
+])
+def test_render_settings(template, cameras, mask_settings, depth_settings, min_iou):
+    """
+    Fewer faces per pixel and upsampled passes stay close to the default settings
+    """
+
+    with torch.no_grad():
+        ref_mask, ref_depth = MaskAndDepthRenderer(template, IMG_SIZE)(*cameras)
+        mask, depth = MaskAndDepthRenderer(template, IMG_SIZE, mask_settings, depth_settings)(*cameras)
+
+    assert mask.shape == ref_mask.shape and depth.shape == ref_depth.shape
+
+    ref_mask, mask = ref_mask > 0.5, mask > 0.5
+    iou = (mask & ref_mask).sum() / (mask | ref_mask).sum()
+    assert iou >= min_iou
+
+    if 'image_size' not in depth_settings:
+        # The depth of the closest face does not depend on the number of faces per pixel
+        common = mask & ref_mask
+        torch.testing.assert_close(depth[common], ref_depth[common])